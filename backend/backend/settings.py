@@ -10,11 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+load_dotenv()
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -45,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'moodle_api.middleware.MetricsMiddleware',  # Primero: mide la pila completa
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Debe ir antes de CommonMiddleware
@@ -52,6 +58,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.TokenAuthenticationMiddleware',  # Después de AuthenticationMiddleware
+    'moodle_api.middleware.ProfilingMiddleware',  # Después de la autenticación: comprueba X-Profile
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -85,6 +93,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: las lecturas no esperan a las escrituras. Las transacciones
+            # toman el cerrojo de escritura al empezar (IMMEDIATE) y esperan
+            # hasta 20 s antes de fallar con "database is locked". Con DEFERRED,
+            # una transacción que lee y luego escribe falla al instante si otra
+            # escribió entretanto (SQLite no aplica el timeout al ascender el
+            # cerrojo). IMMEDIATE solo afecta a los bloques atomic(): las
+            # lecturas en autocommit no toman el cerrojo, y todos los atomic()
+            # del proyecto escriben. Un atomic() de solo lectura lo tomaría
+            # igualmente: no hay que añadirlos.
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -138,4 +160,157 @@ CORS_ALLOWED_ORIGINS = [
 ]
 CORS_ALLOW_CREDENTIALS = True  # Si usas sesión o cookies
 
-AUTH_USER_MODEL = 'users.CustomUser'
\ No newline at end of file
+AUTH_USER_MODEL = 'users.CustomUser'
+
+# Moodle Web Services
+MOODLE_URL = os.getenv('MOODLE_URL')
+MOODLE_TOKEN = os.getenv('MOODLE_TOKEN')
+
+# Cliente HTTP compartido: tiempos de espera (segundos), reintentos para las
+# funciones de solo lectura y tamaño del pool de conexiones por worker.
+MOODLE_CONNECT_TIMEOUT = 3.05
+MOODLE_READ_TIMEOUT = 15
+MOODLE_MAX_RETRIES = 2
+MOODLE_RETRY_BACKOFF = 0.3
+MOODLE_POOL_SIZE = 10
+
+# Caché compartida. En producción conviene un backend común a todos los
+# workers (Redis o Memcached), p. ej. django.core.cache.backends.redis.RedisCache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Segundos que se reutiliza la respuesta de core_webservice_get_site_info.
+MOODLE_SITE_INFO_TTL = 600
+
+# Conexiones simultáneas a Moodle del cliente asíncrono compartido de cada proceso.
+MOODLE_ASYNC_POOL_SIZE = 100
+
+# Coalescencia de descargas concurrentes del mismo curso: duración máxima del
+# cerrojo compartido, espera máxima de los demás workers y vida del resultado.
+MOODLE_SINGLEFLIGHT_LOCK_TIMEOUT = 60
+MOODLE_SINGLEFLIGHT_WAIT_TIMEOUT = 30
+MOODLE_SINGLEFLIGHT_RESULT_TTL = 10
+
+# Agrupación de consultas de cursos: ventana (segundos) durante la que se
+# juntan peticiones concurrentes y longitud máxima de la URL de cada llamada.
+MOODLE_BATCH_WINDOW = 0.005
+MOODLE_MAX_URL_LENGTH = 4000
+
+# Exportaciones en segundo plano (python manage.py run_export_workers)
+EXPORT_ROOT = BASE_DIR / 'exports'
+EXPORT_JOB_CHUNK_SIZE = 5000
+# Un trabajo "en curso" sin progreso durante este tiempo se considera
+# abandonado y otro worker lo reanuda.
+EXPORT_JOB_STALE_SECONDS = 300
+# Tiempo durante el que se reutiliza una exportación terminada si las
+# matrículas del curso no han cambiado.
+EXPORT_JOB_REUSE_SECONDS = 3600
+
+# Importaciones de usuarios en segundo plano (python manage.py run_import_workers):
+# ficheros subidos pendientes, tamaño máximo del fichero y tiempo tras el que
+# una importación "en curso" se da por abandonada y se repite (sin duplicar
+# usuarios).
+IMPORT_ROOT = BASE_DIR / 'imports'
+IMPORT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+IMPORT_JOB_STALE_SECONDS = 3600
+
+# Circuit breaker de Moodle: fallos seguidos de una función que abren su
+# circuito y segundos que permanece abierto antes de probar de nuevo.
+MOODLE_BREAKER_FAILURE_THRESHOLD = 5
+MOODLE_BREAKER_RECOVERY_TIMEOUT = 30
+# Vida de la última respuesta buena que se sirve mientras Moodle no responde
+# y frecuencia máxima de los refrescos en segundo plano.
+MOODLE_STALE_TTL = 7 * 24 * 3600
+MOODLE_STALE_REFRESH_INTERVAL = 30
+
+# Sesiones leídas de la caché (y escritas también en la base de datos).
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Vida (segundos) de los tokens firmados de la API que emite LoginView. Es
+# también el tiempo máximo que tarda en aplicarse una revocación si la caché
+# se pierde o no se comparte entre workers (LocMemCache): en producción
+# CACHES debe ser compartida (ver users/tokens.py).
+API_TOKEN_MAX_AGE = 15 * 60
+
+# Escritura agrupada de matrículas (ver moodle_api/groupcommit.py): máximo de
+# matrículas por transacción y espera máxima (segundos) para juntar un lote.
+# Los TestCase que matriculan por la vista lo desactivan con override_settings:
+# el hilo escritor no ve los datos de la transacción que envuelve cada test.
+ENROLLMENT_GROUP_COMMIT = os.getenv('ENROLLMENT_GROUP_COMMIT', 'True') == 'True'
+ENROLLMENT_BATCH_MAX_SIZE = 200
+ENROLLMENT_BATCH_MAX_DELAY = 0.005
+
+# Proxy de imágenes de los cursos (ver moodle_api/images.py): directorio de
+# las variantes redimensionadas, tamaño máximo que ocupa en disco (se
+# desalojan las menos usadas) y tamaño máximo de la imagen original.
+COURSE_IMAGE_ROOT = BASE_DIR / 'course_images'
+COURSE_IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+COURSE_IMAGE_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+# Reconciliación de matrículas con Moodle (python manage.py reconcile_enrollments):
+# cursos por bloque en memoria, llamadas simultáneas a Moodle (no más que
+# MOODLE_POOL_SIZE), alumnos por página de core_enrol_get_enrolled_users y
+# rol con el que se envían matrículas a Moodle (5 = student).
+MOODLE_RECONCILE_CHUNK_SIZE = 100
+MOODLE_RECONCILE_CONCURRENCY = 8
+MOODLE_RECONCILE_PAGE_SIZE = 1000
+MOODLE_STUDENT_ROLE_ID = 5
+
+# Exportación incremental (moodle_api/exports.py): segundos más recientes que
+# se dejan fuera de cada exportación para que las transacciones en curso
+# confirmen antes de que el cursor las adelante.
+EXPORT_CURSOR_LAG = 30
+
+# Codec JSON de las respuestas de Moodle y de la API (moodle_api/jsoncodec.py):
+# 'auto' usa orjson si está instalado; 'orjson' o 'json' fuerzan uno.
+JSON_CODEC = 'auto'
+
+# Control de admisión de las vistas con picos (moodle_api/admission.py), por
+# worker: token bucket global y por usuario (fichas por segundo y ráfaga) de
+# cada política, espera máxima (segundos) antes de responder 429 y peticiones
+# que pueden esperar a la vez por política.
+ADMISSION_ENABLED = True
+ADMISSION_POLICIES = {
+    'enroll': {'rate': 100, 'burst': 200, 'user_rate': 1, 'user_burst': 5},
+    'enrolled_courses': {'rate': 200, 'burst': 400, 'user_rate': 2, 'user_burst': 10},
+}
+ADMISSION_MAX_WAIT = 1.0
+ADMISSION_QUEUE_SIZE = 100
+
+# Límite de llamadas salientes a Moodle compartido entre workers a través de
+# CACHES (moodle_api/throttle.py): llamadas simultáneas, llamadas por segundo
+# en total y por función, espera máxima (segundos) para conseguir hueco y vida
+# de cada hueco si el worker muere sin liberarlo. 0 = sin límite.
+MOODLE_MAX_CONCURRENT_CALLS = 20
+MOODLE_MAX_CALLS_PER_SECOND = 100
+MOODLE_FUNCTION_RATE_LIMITS = {
+    'core_enrol_get_users_courses': 50,
+}
+MOODLE_THROTTLE_MAX_WAIT = 2.0
+MOODLE_CALL_LEASE = 60
+
+
+# Redes (direcciones o CIDR, separadas por comas) desde las que se puede leer
+# /metrics sin sesión de personal, p. ej. la del servidor de Prometheus. Se
+# comprueba REMOTE_ADDR: detrás de un proxy, pon la red del proxy solo si
+# este no reenvía /metrics desde fuera.
+METRICS_ALLOWED_NETWORKS = [
+    network.strip() for network in os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.1,::1').split(',')
+    if network.strip()
+]
+
+# Perfilado de peticiones (moodle_api/profiling.py). Desactivado no añade
+# ningún coste. Activado, perfila la fracción PROFILING_SAMPLE_RATE de las
+# peticiones y las del personal que envíen la cabecera X-Profile: muestrea la
+# pila cada PROFILING_INTERVAL segundos durante como mucho
+# PROFILING_MAX_DURATION y guarda los PROFILING_MAX_PROFILES perfiles más
+# recientes en PROFILING_ROOT (ver /api/profiles/).
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL = 0.005
+PROFILING_MAX_DURATION = 60
+PROFILING_MAX_PROFILES = 200
+PROFILING_ROOT = BASE_DIR / 'profiles'
@@ -16,10 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from moodle_api.views import MetricsView
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('moodle_api.urls')),
     path('api/', include('users.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
@@ -0,0 +1,185 @@
+# moodle_api/admission.py
+"""
+Control de admisión de las vistas más expuestas a picos (matrículas y
+cursos del usuario).
+
+Cada política de ``ADMISSION_POLICIES`` tiene un token bucket global y uno
+por usuario (o por IP si no hay sesión). Una petición que no encuentra
+fichas libres espera a que se repongan, pero solo si la espera no supera
+``ADMISSION_MAX_WAIT`` segundos y hay sitio en la cola de espera
+(``ADMISSION_QUEUE_SIZE`` peticiones por política); si no, se rechaza al
+momento con un 429 y ``Retry-After``. Así un pico se reparte en el tiempo
+sin acumular peticiones colgadas.
+
+Los buckets viven en la memoria de cada worker: los límites se aplican por
+proceso.
+"""
+import asyncio
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+from .jsoncodec import JsonResponse
+
+# Buckets por usuario que se conservan por política (los menos recientes se descartan).
+MAX_TRACKED_USERS = 10000
+
+
+class TokenBucket:
+    """Bucket de ``burst`` fichas que se repone a ``rate`` fichas por segundo."""
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def delay(self, now):
+        """Segundos hasta que haya una ficha libre (0 si ya la hay)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        # Puede quedar en negativo: las fichas ya reservadas por quien espera.
+        self.tokens -= 1
+
+
+class AdmissionController:
+    def __init__(self, name, rate, burst, user_rate, user_burst, max_wait=None, queue_size=None):
+        self.name = name
+        self.global_bucket = TokenBucket(rate, burst)
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._max_wait = max_wait
+        self._queue_size = queue_size
+        self._users = OrderedDict()
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_wait(self):
+        return self._max_wait if self._max_wait is not None else settings.ADMISSION_MAX_WAIT
+
+    @property
+    def queue_size(self):
+        return self._queue_size if self._queue_size is not None else settings.ADMISSION_QUEUE_SIZE
+
+    def _user_bucket(self, key, now):
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = self._users[key] = TokenBucket(self.user_rate, self.user_burst, now)
+            if len(self._users) > MAX_TRACKED_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return bucket
+
+    def reserve(self, key):
+        """
+        Reserva una ficha para ``key``. Devuelve ``(espera, None)`` si se
+        admite tras esperar ``espera`` segundos (ya contada en la cola; hay
+        que llamar a ``done`` al terminar la espera), o ``(reintento, motivo)``
+        si se rechaza.
+        """
+        now = time.monotonic()
+        with self._lock:
+            user_bucket = self._user_bucket(key, now)
+            user_delay = user_bucket.delay(now)
+            global_delay = self.global_bucket.delay(now)
+            delay = max(user_delay, global_delay)
+            if delay > self.max_wait:
+                return delay, 'user' if user_delay >= global_delay else 'global'
+            if delay > 0 and self._waiting >= self.queue_size:
+                return delay, 'queue'
+            user_bucket.take()
+            self.global_bucket.take()
+            if delay > 0:
+                self._waiting += 1
+            return delay, None
+
+    def done(self):
+        with self._lock:
+            self._waiting -= 1
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(policy):
+    controller = _controllers.get(policy)
+    if controller is None:
+        with _controllers_lock:
+            controller = _controllers.get(policy)
+            if controller is None:
+                controller = _controllers[policy] = AdmissionController(policy, **settings.ADMISSION_POLICIES[policy])
+    return controller
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting.startswith('ADMISSION_'):
+        _controllers.clear()
+
+
+def _client_key(request, user):
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _rejected(policy, retry_after, reason):
+    metrics.ADMISSION_SHED.inc((policy, reason))
+    response = JsonResponse(
+        {'error': 'Demasiadas solicitudes; inténtalo de nuevo en unos segundos'}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admission_control(policy):
+    """
+    Decorador de vistas (síncronas o asíncronas) que aplica la política
+    ``policy`` de ``ADMISSION_POLICIES``.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if not settings.ADMISSION_ENABLED:
+                    return await view(request, *args, **kwargs)
+                controller = get_controller(policy)
+                delay, reason = controller.reserve(_client_key(request, await request.auser()))
+                if reason:
+                    return _rejected(policy, delay, reason)
+                if delay:
+                    try:
+                        await asyncio.sleep(delay)
+                    finally:
+                        controller.done()
+                return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if not settings.ADMISSION_ENABLED:
+                    return view(request, *args, **kwargs)
+                controller = get_controller(policy)
+                delay, reason = controller.reserve(_client_key(request, request.user))
+                if reason:
+                    return _rejected(policy, delay, reason)
+                if delay:
+                    try:
+                        time.sleep(delay)
+                    finally:
+                        controller.done()
+                return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
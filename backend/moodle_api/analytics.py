@@ -0,0 +1,169 @@
+# moodle_api/analytics.py
+"""
+Estadísticas de matrículas por curso.
+
+``EnrollmentStat`` guarda un contador por curso y valor de cada dimensión
+(día de matrícula, país, franja de edad y propósito). Las altas de
+enrollment.py llaman a ``record_enrollments`` dentro de su transacción, así
+que los paneles leen unas pocas filas en lugar de recorrer matrículas y
+perfiles. ``rebuild_stats`` recalcula todo desde cero.
+"""
+from collections import Counter
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Substr, TruncDate
+from django.utils import timezone
+
+from users.models import UserProfile
+from .models import Enrollment, EnrollmentStat
+
+# Límite superior (exclusivo) de cada franja de edad.
+AGE_BANDS = [(18, '<18'), (25, '18-24'), (35, '25-34'), (45, '35-44'), (55, '45-54'), (65, '55-64')]
+OLDEST_BAND = '65+'
+PURPOSE_MAX_LENGTH = 255
+
+# Claves por consulta al actualizar contadores (límite de expresiones de SQLite).
+UPDATE_CHUNK_SIZE = 200
+# Filas de resumen leídas e insertadas por bloque al reconstruir.
+REBUILD_BATCH_SIZE = 1000
+
+
+def age_band(age):
+    if age is None:
+        return ''
+    for upper, label in AGE_BANDS:
+        if age < upper:
+            return label
+    return OLDEST_BAND
+
+
+def _dimension_values(day, profile):
+    if profile is None:
+        country = band = purpose = ''
+    else:
+        country, band, purpose = profile['country'] or '', age_band(profile['age']), (profile['purpose'] or '')
+    return [
+        (EnrollmentStat.DAY, day.isoformat()),
+        (EnrollmentStat.COUNTRY, country),
+        (EnrollmentStat.AGE_BAND, band),
+        (EnrollmentStat.PURPOSE, purpose[:PURPOSE_MAX_LENGTH]),
+    ]
+
+
+def record_enrollments(pairs, sign=1, day=None):
+    """
+    Suma (o resta, con ``sign=-1``) las matrículas ``(user_id, course_id)``
+    a las estadísticas. Usa una consulta para los perfiles, un insert que
+    crea los contadores que falten y un ``UPDATE`` por cada incremento
+    distinto; debe llamarse dentro de la transacción que escribe las matrículas.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return
+    day = day or timezone.localdate()
+    profiles = {
+        p['user_id']: p for p in UserProfile.objects.filter(user_id__in={user_id for user_id, _ in pairs})
+        .values('user_id', 'country', 'age', 'purpose')
+    }
+    deltas = Counter()
+    for user_id, course_id in pairs:
+        for dimension, value in _dimension_values(day, profiles.get(user_id)):
+            deltas[(course_id, dimension, value)] += sign
+    _apply(deltas)
+
+
+def _apply(deltas):
+    EnrollmentStat.objects.bulk_create(
+        [EnrollmentStat(course_id=c, dimension=d, value=v) for c, d, v in deltas],
+        ignore_conflicts=True,
+    )
+    by_delta = {}
+    for key, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(key)
+    for delta, keys in by_delta.items():
+        for start in range(0, len(keys), UPDATE_CHUNK_SIZE):
+            match = reduce(or_, [
+                Q(course_id=c, dimension=d, value=v) for c, d, v in keys[start:start + UPDATE_CHUNK_SIZE]
+            ])
+            EnrollmentStat.objects.filter(match).update(count=F('count') + delta)
+
+
+def _age_band_expression():
+    whens = [When(user__profile__age__lt=upper, then=Value(label)) for upper, label in AGE_BANDS]
+    return Case(
+        When(user__profile__age__isnull=True, then=Value('')),
+        *whens,
+        default=Value(OLDEST_BAND),
+        output_field=CharField(),
+    )
+
+
+def rebuild_stats(course_ids=None):
+    """
+    Recalcula las estadísticas (de todos los cursos o de ``course_ids``)
+    agregando la tabla de matrículas: una consulta por dimensión, leída e
+    insertada en bloques de ``REBUILD_BATCH_SIZE`` filas para no cargar en
+    memoria todas las combinaciones curso × valor. Devuelve el número de
+    filas de resumen escritas.
+    """
+    enrollments = Enrollment.objects.all()
+    stats = EnrollmentStat.objects.all()
+    if course_ids is not None:
+        enrollments = enrollments.filter(course_id__in=course_ids)
+        stats = stats.filter(course_id__in=course_ids)
+
+    expressions = {
+        EnrollmentStat.DAY: Cast(TruncDate('enrolled_at'), CharField()),
+        EnrollmentStat.COUNTRY: Coalesce('user__profile__country', Value('')),
+        EnrollmentStat.AGE_BAND: _age_band_expression(),
+        EnrollmentStat.PURPOSE: Coalesce(Substr('user__profile__purpose', 1, PURPOSE_MAX_LENGTH), Value('')),
+    }
+    with transaction.atomic():
+        stats.delete()
+        written = 0
+        for dimension, expression in expressions.items():
+            grouped = (
+                enrollments.order_by().annotate(stat_value=expression)
+                .values('course_id', 'stat_value').annotate(n=Count('id'))
+            )
+            rows = (
+                EnrollmentStat(course_id=g['course_id'], dimension=dimension, value=g['stat_value'], count=g['n'])
+                for g in grouped.iterator(chunk_size=REBUILD_BATCH_SIZE)
+            )
+            # bulk_create convierte su argumento en lista: se le pasan bloques.
+            while batch := list(islice(rows, REBUILD_BATCH_SIZE)):
+                EnrollmentStat.objects.bulk_create(batch)
+                written += len(batch)
+    return written
+
+
+def course_stats(course_ids=None, date_from=None, date_to=None, top=None):
+    """
+    Devuelve las estadísticas agregadas por dimensión para ``course_ids`` (o
+    todos los cursos). El rango de fechas solo filtra la serie diaria.
+    """
+    stats = EnrollmentStat.objects.exclude(count=0)
+    if course_ids is not None:
+        stats = stats.filter(course_id__in=course_ids)
+    total = stats.filter(dimension=EnrollmentStat.COUNTRY).aggregate(total=Sum('count'))['total']
+    result = {'total': total or 0}
+    for dimension, _ in EnrollmentStat.DIMENSION_CHOICES:
+        rows = stats.filter(dimension=dimension)
+        if dimension == EnrollmentStat.DAY:
+            if date_from:
+                rows = rows.filter(value__gte=date_from.isoformat())
+            if date_to:
+                rows = rows.filter(value__lte=date_to.isoformat())
+            rows = rows.values('value').annotate(total=Sum('count')).order_by('value')
+        else:
+            rows = rows.values('value').annotate(total=Sum('count')).order_by('-total', 'value')
+            if top and dimension == EnrollmentStat.PURPOSE:
+                # El propósito es texto libre: solo los más frecuentes.
+                rows = rows[:top]
+        result[dimension] = [{'value': r['value'], 'count': r['total']} for r in rows]
+    return result
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class MoodleApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'moodle_api'
+
+    def ready(self):
+        # Registra el contador de consultas SQL en cada conexión nueva.
+        from . import metrics  # noqa: F401
+        # Mantiene el índice de búsqueda al guardar o borrar cursos.
+        from . import search  # noqa: F401
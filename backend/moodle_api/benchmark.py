@@ -0,0 +1,234 @@
+# moodle_api/benchmark.py
+"""
+Banco de pruebas de carga para los endpoints de la API.
+
+``run_benchmark`` lanza cada escenario con varios niveles de concurrencia
+usando el cliente de pruebas de Django (un cliente por hilo) y mide latencia
+(p50/p99), rendimiento, consultas SQL por petición, errores y pico de
+memoria. Los resultados pueden guardarse como línea base y compararse con
+ella para detectar regresiones en CI (ver el comando ``benchmark``).
+"""
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from users.models import UserProfile
+from .analytics import rebuild_stats
+from .enrollment import reconcile_enrollment_counts
+from .models import Course, Enrollment
+
+User = get_user_model()
+
+BENCH_PASSWORD = 'benchmark-password'
+
+
+@dataclass
+class BenchContext:
+    users: list
+    course_ids: list
+    synced_course_ids: list
+    counter: itertools.count
+
+
+def seed(users=200, courses=50, synced_courses=40, enrollments_per_course=100):
+    """Crea usuarios, perfiles, cursos locales y matrículas sintéticos en bloque."""
+    password = make_password(BENCH_PASSWORD)
+    User.objects.bulk_create([
+        User(email=f'bench{i}@example.com', username=f'bench{i}', password=password,
+             first_name='Bench', last_name=str(i))
+        for i in range(users)
+    ], batch_size=1000)
+    user_list = list(User.objects.filter(email__startswith='bench').order_by('id'))
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, age=18 + user.pk % 50, country='Cuba', purpose='Benchmark')
+        for user in user_list
+    ], batch_size=1000)
+
+    # Ids de Moodle a partir de 2: el 1 es la portada del sitio.
+    course_ids = list(range(2, courses + 2))
+    Course.objects.bulk_create([
+        Course(moodle_id=moodle_id, name=f'Curso sintético {moodle_id}', summary='', category=3,
+               timemodified=1690000000 + moodle_id)
+        for moodle_id in course_ids[:synced_courses]
+    ])
+    enrollments = []
+    for course in Course.objects.all():
+        for user in user_list[:enrollments_per_course]:
+            enrollments.append(Enrollment(user=user, course=course))
+    Enrollment.objects.bulk_create(enrollments, batch_size=5000, ignore_conflicts=True)
+    reconcile_enrollment_counts()
+    rebuild_stats()
+    return BenchContext(user_list, course_ids, course_ids[:synced_courses], itertools.count())
+
+
+def _consume(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+# Cada escenario recibe el cliente del hilo, su usuario y el contexto.
+
+def _site_info(client, user, ctx):
+    return client.get('/api/site-info/')
+
+
+def _enrolled_courses(client, user, ctx):
+    return client.get('/api/enrolled-courses/')
+
+
+def _enroll(client, user, ctx):
+    course_id = random.choice(ctx.course_ids)
+    return client.post('/api/enroll/', {'courseid': course_id}, content_type='application/json')
+
+
+def _export(client, user, ctx):
+    return _consume(client.get(f'/api/export/{random.choice(ctx.synced_course_ids)}/'))
+
+
+def _register(client, user, ctx):
+    n = next(ctx.counter)
+    return client.post('/api/register/', {
+        'email': f'nuevo{n}-{time.monotonic_ns()}@example.com', 'password': BENCH_PASSWORD,
+        'name': 'Nuevo Usuario', 'age': 30, 'country': 'Cuba', 'purpose': 'Benchmark',
+    }, content_type='application/json')
+
+
+def _login(client, user, ctx):
+    return client.post('/api/login/', {'email': user.email, 'password': BENCH_PASSWORD},
+                       content_type='application/json')
+
+
+SCENARIOS = {
+    'site-info': (_site_info, False),
+    'enrolled-courses': (_enrolled_courses, False),
+    'enroll': (_enroll, True),
+    'export': (_export, False),
+    'register': (_register, False),
+    'login': (_login, False),
+}
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_scenario(name, ctx, concurrency, requests):
+    """Ejecuta ``requests`` peticiones del escenario con ``concurrency`` hilos."""
+    scenario, needs_login = SCENARIOS[name]
+    latencies, queries, statuses = [], [], []
+    lock = threading.Lock()
+    remaining = itertools.count()
+    users = itertools.cycle(ctx.users)
+
+    def worker():
+        with lock:
+            user = next(users)
+        client = Client()
+        if needs_login:
+            client.force_login(user)
+        while next(remaining) < requests:
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = scenario(client, user, ctx)
+                elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                queries.append(len(captured))
+                statuses.append(response.status_code)
+        connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'rps': round(len(latencies) / wall, 1) if wall else 0.0,
+        'queries_avg': round(statistics.fmean(queries), 2) if queries else 0.0,
+        'errors': sum(1 for status in statuses if status >= 500),
+    }
+
+
+def measure_memory(name, ctx, requests=20):
+    """Pico de memoria (KiB) de una ráfaga secuencial, con tracemalloc activo solo aquí."""
+    scenario, needs_login = SCENARIOS[name]
+    user = ctx.users[0]
+    client = Client()
+    if needs_login:
+        client.force_login(user)
+    tracemalloc.start()
+    try:
+        for _ in range(requests):
+            scenario(client, user, ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def run_benchmark(ctx, endpoints, concurrency_levels, requests, memory=True, progress=None):
+    results = {}
+    for name in endpoints:
+        results[name] = {}
+        for concurrency in concurrency_levels:
+            stats = run_scenario(name, ctx, concurrency, requests)
+            results[name][str(concurrency)] = stats
+            if progress:
+                progress(name, concurrency, stats)
+        if memory:
+            results[name]['peak_memory_kib'] = measure_memory(name, ctx)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Devuelve la lista de regresiones respecto a ``baseline``: p99 o consultas
+    por petición por encima, o rendimiento por debajo, del margen ``tolerance``.
+    """
+    regressions = []
+    for name, levels in results.items():
+        for level, stats in levels.items():
+            base = baseline.get(name, {}).get(level)
+            if not isinstance(stats, dict) or not isinstance(base, dict):
+                continue
+            label = f'{name} (concurrencia {level})'
+            if stats['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+                regressions.append(f"{label}: p99 {stats['p99_ms']} ms > {base['p99_ms']} ms")
+            if stats['rps'] < base['rps'] * (1 - tolerance):
+                regressions.append(f"{label}: {stats['rps']} req/s < {base['rps']} req/s")
+            if stats['queries_avg'] > base['queries_avg'] + 0.5:
+                regressions.append(f"{label}: {stats['queries_avg']} consultas/petición > {base['queries_avg']}")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
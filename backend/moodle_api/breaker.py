@@ -0,0 +1,99 @@
+# moodle_api/breaker.py
+"""
+Circuit breaker por ``wsfunction``.
+
+Tras ``MOODLE_BREAKER_FAILURE_THRESHOLD`` fallos seguidos de disponibilidad
+(timeouts, conexiones rechazadas, 5xx) el circuito de esa función se abre y
+las llamadas fallan al instante durante ``MOODLE_BREAKER_RECOVERY_TIMEOUT``
+segundos. Pasado ese tiempo se deja pasar una sola llamada de prueba: si
+funciona el circuito se cierra, si no vuelve a abrirse. Una prueba que no
+informa de su resultado (cancelada, o con un error que no es de Moodle) se
+devuelve con ``release``; si ni eso ocurre, caduca tras otro
+``MOODLE_BREAKER_RECOVERY_TIMEOUT`` y se deja pasar otra.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _State:
+    __slots__ = ('status', 'failures', 'opened_at', 'probe_at')
+
+    def __init__(self):
+        self.status = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_at = 0.0
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=None, recovery_timeout=None):
+        self._failure_threshold = failure_threshold
+        self._recovery_timeout = recovery_timeout
+        self._states = {}
+        self._lock = threading.Lock()
+
+    @property
+    def failure_threshold(self):
+        return self._failure_threshold or settings.MOODLE_BREAKER_FAILURE_THRESHOLD
+
+    @property
+    def recovery_timeout(self):
+        return self._recovery_timeout or settings.MOODLE_BREAKER_RECOVERY_TIMEOUT
+
+    def state(self, wsfunction):
+        state = self._states.get(wsfunction)
+        return state.status if state is not None else CLOSED
+
+    def allow(self, wsfunction):
+        """Indica si puede llamarse a ``wsfunction`` ahora mismo."""
+        state = self._states.get(wsfunction)
+        if state is None or state.status == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if (state.status == OPEN and now - state.opened_at >= self.recovery_timeout
+                    or state.status == HALF_OPEN and now - state.probe_at >= self.recovery_timeout):
+                # Deja pasar una única llamada de prueba (otra si la anterior no informó a tiempo).
+                state.status = HALF_OPEN
+                state.probe_at = now
+                return True
+            return state.status == CLOSED
+
+    def release(self, wsfunction):
+        """
+        Devuelve la llamada de prueba en curso sin contarla como éxito ni
+        fallo: la siguiente llamada vuelve a ser la prueba.
+        """
+        state = self._states.get(wsfunction)
+        if state is not None and state.status == HALF_OPEN:
+            with self._lock:
+                if state.status == HALF_OPEN:
+                    state.status = OPEN
+
+    def record_success(self, wsfunction):
+        state = self._states.get(wsfunction)
+        if state is not None and (state.status != CLOSED or state.failures):
+            with self._lock:
+                state.status = CLOSED
+                state.failures = 0
+
+    def record_failure(self, wsfunction):
+        with self._lock:
+            state = self._states.setdefault(wsfunction, _State())
+            state.failures += 1
+            if state.status == HALF_OPEN or state.failures >= self.failure_threshold:
+                state.status = OPEN
+                state.opened_at = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self._states.clear()
+
+
+breaker = CircuitBreaker()
@@ -0,0 +1,509 @@
+# moodle_api/client.py
+"""
+Clientes compartidos para los Web Services REST de Moodle.
+
+Todas las llamadas a Moodle pasan por aquí: se reutiliza un pool de
+conexiones keep-alive por proceso, se aplican tiempos de espera a cada
+petición, se reintentan con backoff las funciones de solo lectura y los
+errores que devuelve Moodle se convierten en excepciones tipadas. Un circuit
+breaker por función (``breaker.py``) corta las llamadas mientras Moodle está
+caído para que las vistas no se queden esperando.
+
+``MoodleClient`` se usa desde código síncrono (vistas WSGI, comandos) y
+``AsyncMoodleClient`` desde las vistas asíncronas, a través del cliente
+compartido de ``get_async_client``.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from . import metrics, profiling, throttle
+from .breaker import breaker
+from .jsoncodec import LazyJSON, loads
+
+logger = logging.getLogger(__name__)
+
+# Funciones que modifican datos en Moodle: nunca se reintentan automáticamente.
+NON_IDEMPOTENT_FUNCTIONS = frozenset({
+    'enrol_manual_enrol_users',
+    'enrol_manual_unenrol_users',
+    'core_user_create_users',
+    'core_user_update_users',
+    'core_user_delete_users',
+    'core_course_create_courses',
+    'core_course_update_courses',
+    'core_course_delete_courses',
+})
+
+# Nombre con el que las descargas de ficheros aparecen en métricas y en el breaker.
+DOWNLOAD_FUNCTION = 'pluginfile'
+
+
+class MoodleError(Exception):
+    """Error base al comunicarse con Moodle."""
+
+
+class MoodleUnavailable(MoodleError):
+    """Moodle no respondió a tiempo, rechazó la conexión o devolvió un 5xx."""
+
+
+class MoodleCircuitOpen(MoodleUnavailable):
+    """El circuito de la función está abierto: no se llama a Moodle hasta que se recupere."""
+
+
+class MoodleThrottled(MoodleUnavailable):
+    """El límite de llamadas salientes a Moodle (``throttle.py``) está lleno: la llamada no se envía."""
+
+
+class MoodleAPIError(MoodleError):
+    """Moodle respondió con un payload de error (``exception``/``errorcode``)."""
+
+    def __init__(self, message, errorcode=None, exception=None, debuginfo=None):
+        super().__init__(message)
+        self.errorcode = errorcode
+        self.exception = exception
+        self.debuginfo = debuginfo
+
+
+class MoodleInvalidToken(MoodleAPIError):
+    """El token configurado no es válido o ha caducado."""
+
+
+class MoodleAccessDenied(MoodleAPIError):
+    """El token no tiene permiso para ejecutar la función solicitada."""
+
+
+class MoodleInvalidParameter(MoodleAPIError):
+    """Moodle rechazó los parámetros enviados."""
+
+
+ERRORCODE_EXCEPTIONS = {
+    'invalidtoken': MoodleInvalidToken,
+    'accessexception': MoodleAccessDenied,
+    'nopermissions': MoodleAccessDenied,
+    'invalidparameter': MoodleInvalidParameter,
+}
+
+
+def flatten_params(params, prefix=''):
+    """
+    Convierte listas y diccionarios al formato que espera Moodle:
+    ``{'courseids': [1, 2]}`` -> ``{'courseids[0]': 1, 'courseids[1]': 2}``.
+    """
+    flat = {}
+    for key, value in params.items():
+        name = f'{prefix}[{key}]' if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten_params(value, name))
+        elif isinstance(value, (list, tuple)):
+            flat.update(flatten_params(dict(enumerate(value)), name))
+        elif value is not None:
+            flat[name] = value
+    return flat
+
+
+def raise_for_payload(data):
+    """Lanza la excepción adecuada si ``data`` es un payload de error de Moodle."""
+    if isinstance(data, LazyJSON):
+        # Sin decodificar: solo un objeto que mencione "exception" puede ser un error.
+        if not data.is_object or not data.mentions(b'"exception"'):
+            return data
+        data = data.data
+    if isinstance(data, dict) and 'exception' in data:
+        errorcode = data.get('errorcode')
+        exc_class = ERRORCODE_EXCEPTIONS.get(errorcode, MoodleAPIError)
+        raise exc_class(
+            data.get('message') or errorcode or 'Error de Moodle',
+            errorcode=errorcode,
+            exception=data.get('exception'),
+            debuginfo=data.get('debuginfo'),
+        )
+    return data
+
+
+def same_site(url, base_url):
+    """Si ``url`` tiene el mismo esquema, host y puerto que ``base_url``."""
+    url, base = urlsplit(url or ''), urlsplit(base_url or '')
+    return bool(base.netloc) and (url.scheme.lower(), url.netloc.lower()) == (base.scheme.lower(), base.netloc.lower())
+
+
+@contextmanager
+def throttled(wsfunction):
+    try:
+        with throttle.limit(wsfunction):
+            yield
+    except throttle.ThrottleTimeout as e:
+        raise MoodleThrottled(f'Demasiadas llamadas a Moodle en curso ({e.reason}); no se envía {wsfunction}') from e
+
+
+@asynccontextmanager
+async def athrottled(wsfunction):
+    try:
+        async with throttle.alimit(wsfunction):
+            yield
+    except throttle.ThrottleTimeout as e:
+        raise MoodleThrottled(f'Demasiadas llamadas a Moodle en curso ({e.reason}); no se envía {wsfunction}') from e
+
+
+class BaseMoodleClient:
+    """Configuración y tratamiento de respuestas comunes a ambos clientes."""
+
+    def __init__(self, url=None, token=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, retry_backoff=None, pool_size=None):
+        self.url = url or settings.MOODLE_URL
+        self.token = token or settings.MOODLE_TOKEN
+        self.connect_timeout = connect_timeout or settings.MOODLE_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.MOODLE_READ_TIMEOUT
+        self.max_retries = settings.MOODLE_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = settings.MOODLE_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.pool_size = pool_size or settings.MOODLE_POOL_SIZE
+
+    def build_params(self, wsfunction, params):
+        return {
+            'wstoken': self.token,
+            'wsfunction': wsfunction,
+            'moodlewsrestformat': 'json',
+            **flatten_params(params),
+        }
+
+    def prepare(self, wsfunction, idempotent, params):
+        """Devuelve la query a enviar, si la llamada es idempotente y cuántos intentos admite."""
+        if not self.url:
+            raise MoodleError('MOODLE_URL no está configurado')
+        if not breaker.allow(wsfunction):
+            metrics.MOODLE_CALL_ERRORS.inc((wsfunction, MoodleCircuitOpen.__name__))
+            raise MoodleCircuitOpen(f'Moodle no está disponible para {wsfunction}; se reintentará más tarde')
+        if idempotent is None:
+            idempotent = wsfunction not in NON_IDEMPOTENT_FUNCTIONS
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        return self.build_params(wsfunction, params), idempotent, attempts
+
+    def retry_delay(self, wsfunction, attempt, error):
+        delay = self.retry_backoff * (2 ** attempt)
+        logger.warning('Reintentando %s en %.2fs: %s', wsfunction, delay, error)
+        return delay
+
+    def observe(self, wsfunction, start, error=None, size=None):
+        metrics.observe_moodle_call(
+            wsfunction, time.perf_counter() - start,
+            error=type(error).__name__ if error is not None else None, size=size,
+        )
+
+    def decoder(self, content, lazy):
+        if lazy:
+            return lambda: LazyJSON(content)
+        return lambda: loads(content)
+
+    def parse_response(self, status_code, decode):
+        if status_code >= 500:
+            raise MoodleUnavailable(f'Moodle respondió {status_code}')
+        if status_code != 200:
+            raise MoodleError(f'Moodle respondió {status_code}')
+        try:
+            data = decode()
+        except ValueError as e:
+            raise MoodleError('Moodle devolvió una respuesta que no es JSON') from e
+        return raise_for_payload(data)
+
+
+class MoodleClient(BaseMoodleClient):
+    """Cliente síncrono con pool de conexiones para un sitio Moodle."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def call(self, wsfunction, idempotent=None, lazy=False, **params):
+        """
+        Ejecuta ``wsfunction`` y devuelve el JSON decodificado (o, con
+        ``lazy=True``, un ``LazyJSON`` que solo se decodifica si se lee).
+
+        Las funciones de solo lectura se envían por GET y se reintentan ante
+        fallos de red o respuestas 5xx; las que modifican datos se envían por
+        POST una única vez.
+        """
+        query, idempotent, attempts = self.prepare(wsfunction, idempotent, params)
+        try:
+            for attempt in range(attempts):
+                try:
+                    with throttled(wsfunction), profiling.moodle_call(wsfunction):
+                        data = self._request(wsfunction, query, idempotent, lazy)
+                except MoodleThrottled:
+                    # No llegó a enviarse: ni se reintenta ni cuenta para el breaker, pero
+                    # si era la llamada de prueba se devuelve para que la haga otra.
+                    breaker.release(wsfunction)
+                    raise
+                except MoodleUnavailable as e:
+                    if attempt + 1 >= attempts:
+                        breaker.record_failure(wsfunction)
+                        raise
+                    time.sleep(self.retry_delay(wsfunction, attempt, e))
+                except MoodleError:
+                    # Moodle respondió, aunque fuera con un error: está disponible.
+                    breaker.record_success(wsfunction)
+                    raise
+                else:
+                    breaker.record_success(wsfunction)
+                    return data
+        except MoodleError:
+            raise
+        except BaseException:
+            # Cancelada o con un error inesperado: no informó al breaker, así que
+            # devuelve la llamada de prueba si lo era.
+            breaker.release(wsfunction)
+            raise
+
+    def _request(self, wsfunction, query, idempotent, lazy=False):
+        start = time.perf_counter()
+        try:
+            if idempotent:
+                response = self.session.get(self.url, params=query, timeout=self.timeout)
+            else:
+                response = self.session.post(self.url, data=query, timeout=self.timeout)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error = MoodleUnavailable(f'No se pudo contactar con Moodle: {e}')
+            self.observe(wsfunction, start, error)
+            raise error from e
+        try:
+            data = self.parse_response(response.status_code, self.decoder(response.content, lazy))
+        except MoodleError as e:
+            self.observe(wsfunction, start, e, len(response.content))
+            raise
+        self.observe(wsfunction, start, size=len(response.content))
+        return data
+
+    def download(self, fileurl, max_bytes):
+        """
+        Descarga un fichero de ``pluginfile.php`` (p. ej. la imagen de un
+        curso) con el token del servicio y la misma sesión, tiempos de espera,
+        reintentos y circuit breaker que las llamadas a funciones. Devuelve
+        los bytes; lanza ``MoodleError`` si supera ``max_bytes`` o si
+        ``fileurl`` no es del mismo sitio que ``MOODLE_URL`` (no se envía el
+        token a otro servidor).
+        """
+        if not same_site(fileurl, self.url):
+            raise MoodleError(f'La URL {fileurl} no pertenece al sitio de Moodle')
+        _, _, attempts = self.prepare(DOWNLOAD_FUNCTION, True, {})
+        try:
+            for attempt in range(attempts):
+                try:
+                    with throttled(DOWNLOAD_FUNCTION), profiling.moodle_call(DOWNLOAD_FUNCTION):
+                        content = self._download(fileurl, max_bytes)
+                except MoodleThrottled:
+                    breaker.release(DOWNLOAD_FUNCTION)
+                    raise
+                except MoodleUnavailable as e:
+                    if attempt + 1 >= attempts:
+                        breaker.record_failure(DOWNLOAD_FUNCTION)
+                        raise
+                    time.sleep(self.retry_delay(DOWNLOAD_FUNCTION, attempt, e))
+                except MoodleError:
+                    breaker.record_success(DOWNLOAD_FUNCTION)
+                    raise
+                else:
+                    breaker.record_success(DOWNLOAD_FUNCTION)
+                    return content
+        except MoodleError:
+            raise
+        except BaseException:
+            breaker.release(DOWNLOAD_FUNCTION)
+            raise
+
+    def _download(self, fileurl, max_bytes):
+        start = time.perf_counter()
+        try:
+            with self.session.get(fileurl, params={'token': self.token}, timeout=self.timeout,
+                                  stream=True) as response:
+                if response.status_code >= 500:
+                    raise MoodleUnavailable(f'Moodle respondió {response.status_code}')
+                if response.status_code != 200:
+                    raise MoodleError(f'Moodle respondió {response.status_code}')
+                chunks, size = [], 0
+                for chunk in response.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MoodleError(f'El fichero supera el máximo de {max_bytes} bytes')
+                    chunks.append(chunk)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error = MoodleUnavailable(f'No se pudo contactar con Moodle: {e}')
+            self.observe(DOWNLOAD_FUNCTION, start, error)
+            raise error from e
+        except MoodleError as e:
+            self.observe(DOWNLOAD_FUNCTION, start, e)
+            raise
+        content = b''.join(chunks)
+        self.observe(DOWNLOAD_FUNCTION, start, size=len(content))
+        return content
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncMoodleClient(BaseMoodleClient):
+    """Cliente asíncrono (httpx) con pool compartido dentro de un event loop."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('pool_size', settings.MOODLE_ASYNC_POOL_SIZE)
+        super().__init__(**kwargs)
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def call(self, wsfunction, idempotent=None, lazy=False, **params):
+        """Equivalente asíncrono de ``MoodleClient.call``."""
+        query, idempotent, attempts = self.prepare(wsfunction, idempotent, params)
+        try:
+            for attempt in range(attempts):
+                try:
+                    async with athrottled(wsfunction):
+                        with profiling.moodle_call(wsfunction):
+                            data = await self._request(wsfunction, query, idempotent, lazy)
+                except MoodleThrottled:
+                    breaker.release(wsfunction)
+                    raise
+                except MoodleUnavailable as e:
+                    if attempt + 1 >= attempts:
+                        breaker.record_failure(wsfunction)
+                        raise
+                    await asyncio.sleep(self.retry_delay(wsfunction, attempt, e))
+                except MoodleError:
+                    # Moodle respondió, aunque fuera con un error: está disponible.
+                    breaker.record_success(wsfunction)
+                    raise
+                else:
+                    breaker.record_success(wsfunction)
+                    return data
+        except MoodleError:
+            raise
+        except BaseException:
+            breaker.release(wsfunction)
+            raise
+
+    async def _request(self, wsfunction, query, idempotent, lazy=False):
+        start = time.perf_counter()
+        try:
+            if idempotent:
+                response = await self.http.get(self.url, params=query)
+            else:
+                response = await self.http.post(self.url, data=query)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            error = MoodleUnavailable(f'No se pudo contactar con Moodle: {e}')
+            self.observe(wsfunction, start, error)
+            raise error from e
+        try:
+            data = self.parse_response(response.status_code, self.decoder(response.content, lazy))
+        except MoodleError as e:
+            self.observe(wsfunction, start, e, len(response.content))
+            raise
+        self.observe(wsfunction, start, size=len(response.content))
+        return data
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Devuelve el cliente compartido del proceso (uno por worker)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                # Tras un fork no se reutilizan los sockets del proceso padre.
+                _client = MoodleClient()
+                _client_pid = pid
+    return _client
+
+
+class SharedAsyncMoodleClient:
+    """
+    ``AsyncMoodleClient`` compartido por todo el proceso.
+
+    Las conexiones de httpx pertenecen al event loop que las abrió, y con
+    WSGI Django ejecuta cada vista asíncrona en un loop nuevo: un cliente por
+    loop se crearía (y quedaría sin cerrar) en cada petición, sin reutilizar
+    ninguna conexión. Por eso el cliente vive en un event loop propio, en un
+    hilo daemon, y ``call`` le envía la corrutina y la espera desde el loop
+    de la vista. El contexto (perfil, métricas de la petición) viaja con la
+    llamada y cancelar la espera cancela la llamada.
+    """
+
+    def __init__(self, **kwargs):
+        self.client = AsyncMoodleClient(**kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='moodle-async-client', daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        # url, build_params... los consultan los cargadores para trocear las llamadas.
+        return getattr(self.client, name)
+
+    async def call(self, wsfunction, **params):
+        future = asyncio.run_coroutine_threadsafe(self.client.call(wsfunction, **params), self.loop)
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.aclose(), self.loop).result(timeout=5)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+
+_async_client = None
+_async_client_pid = None
+
+
+def get_async_client():
+    """Devuelve el cliente asíncrono compartido del proceso (uno por worker)."""
+    global _async_client, _async_client_pid
+    pid = os.getpid()
+    if _async_client is None or _async_client_pid != pid:
+        with _client_lock:
+            if _async_client is None or _async_client_pid != pid:
+                # Tras un fork el hilo del loop no existe en el hijo.
+                _async_client = SharedAsyncMoodleClient()
+                _async_client_pid = pid
+    return _async_client
+
+
+def reset_client():
+    global _client, _async_client
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        if _async_client is not None and _async_client_pid == os.getpid():
+            _async_client.close()
+        _async_client = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting.startswith('MOODLE_'):
+        reset_client()
+        breaker.reset()
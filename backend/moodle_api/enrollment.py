@@ -0,0 +1,187 @@
+# moodle_api/enrollment.py
+"""
+Altas y bajas de matrículas locales.
+
+Cada alta incrementa ``Course.enrollment_count`` en la misma transacción
+que inserta la ``Enrollment``, con una actualización condicional que
+también respeta ``seat_limit``: ni mostrar cuántos alumnos hay ni limitar
+plazas necesita un ``COUNT(*)`` sobre la tabla de matrículas. En la misma
+transacción se actualizan las estadísticas de analytics.py.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .analytics import record_enrollments
+from .models import Course, Enrollment
+
+ENROLLED = 'enrolled'
+ALREADY_ENROLLED = 'already_enrolled'
+COURSE_FULL = 'course_full'
+
+BULK_BATCH_SIZE = 1000
+# Veces que bulk_enroll vuelve a intentar la inserción si choca con una alta concurrente.
+BULK_INSERT_ATTEMPTS = 3
+
+
+def _has_seats():
+    return Q(seat_limit__isnull=True) | Q(enrollment_count__lt=F('seat_limit'))
+
+
+def enroll(user, course):
+    """
+    Matricula a ``user`` en ``course`` y devuelve ``ENROLLED``,
+    ``ALREADY_ENROLLED`` o ``COURSE_FULL``.
+
+    La plaza se reserva con un único ``UPDATE`` condicional sobre el curso;
+    si la inserción choca con una matrícula existente, la transacción se
+    deshace y el contador queda como estaba.
+    """
+    try:
+        with transaction.atomic():
+            reserved = (
+                Course.objects.filter(pk=course.pk).filter(_has_seats())
+                .update(enrollment_count=F('enrollment_count') + 1)
+            )
+            if not reserved:
+                if Enrollment.objects.filter(user=user, course=course).exists():
+                    return ALREADY_ENROLLED
+                return COURSE_FULL
+            Enrollment.objects.create(user=user, course=course)
+            record_enrollments([(user.pk, course.pk)])
+    except IntegrityError:
+        return ALREADY_ENROLLED
+    return ENROLLED
+
+
+def bulk_enroll(pairs, enforce_seat_limit=True):
+    """
+    Matricula en bloque una colección de pares ``(user_id, course_id)``.
+
+    Los cursos afectados se bloquean (``select_for_update``) y, ya con el
+    cerrojo, las matrículas que ya existían se detectan con una sola
+    consulta; las plazas libres se reparten por orden de llegada y las
+    nuevas matrículas se insertan con ``bulk_create``; los contadores se
+    actualizan con un solo ``UPDATE``. Con ``enforce_seat_limit=False``
+    (matrículas que ya existen en Moodle) no se limitan las plazas. Devuelve
+    un diccionario ``{(user_id, course_id): ENROLLED | ALREADY_ENROLLED |
+    COURSE_FULL}``.
+    """
+    # Conserva el orden de llegada: las plazas libres se reparten por orden.
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}
+    user_ids = {user_id for user_id, _ in pairs}
+    course_ids = {course_id for _, course_id in pairs}
+
+    with transaction.atomic():
+        # enroll() también escribe la fila del curso antes de insertar, así que
+        # con el cerrojo ninguna otra alta en estos cursos está a medias.
+        seats = {
+            pk: None if limit is None or not enforce_seat_limit else max(limit - count, 0)
+            for pk, limit, count in Course.objects.select_for_update()
+            .filter(pk__in=course_ids).values_list('pk', 'seat_limit', 'enrollment_count')
+        }
+        for attempt in range(BULK_INSERT_ATTEMPTS):
+            existing, new_pairs, full = _plan_bulk_enroll(pairs, user_ids, course_ids, seats)
+            try:
+                # Sin ignore_conflicts: si aun así se adelanta una alta que no
+                # pasa por este módulo (el admin, un script), se deshace solo
+                # el punto de guardado y se vuelve a mirar qué existe, en vez
+                # de contar como insertadas filas que no lo fueron.
+                with transaction.atomic():
+                    Enrollment.objects.bulk_create(
+                        [Enrollment(user_id=user_id, course_id=course_id) for user_id, course_id in new_pairs],
+                        batch_size=BULK_BATCH_SIZE,
+                    )
+                break
+            except IntegrityError:
+                if attempt + 1 == BULK_INSERT_ATTEMPTS:
+                    raise
+        record_enrollments(new_pairs)
+        added = Counter(course_id for _, course_id in new_pairs)
+        if added:
+            Course.objects.filter(pk__in=added).update(enrollment_count=F('enrollment_count') + Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in added.items()], default=Value(0),
+            ))
+
+    results = dict.fromkeys(existing, ALREADY_ENROLLED)
+    results.update(dict.fromkeys(full, COURSE_FULL))
+    results.update(dict.fromkeys(new_pairs, ENROLLED))
+    return results
+
+
+def _plan_bulk_enroll(pairs, user_ids, course_ids, seats):
+    """Separa ``pairs`` en ya matriculados, a insertar y sin plaza."""
+    existing = set(
+        Enrollment.objects.filter(user_id__in=user_ids, course_id__in=course_ids)
+        .values_list('user_id', 'course_id')
+    ) & set(pairs)
+    seats = dict(seats)
+    new_pairs, full = [], []
+    for pair in pairs:
+        if pair in existing:
+            continue
+        course_id = pair[1]
+        if seats.get(course_id) == 0:
+            full.append(pair)
+            continue
+        if seats.get(course_id) is not None:
+            seats[course_id] -= 1
+        new_pairs.append(pair)
+    return existing, new_pairs, full
+
+
+def bulk_unenroll(pairs):
+    """
+    Da de baja en bloque los pares ``(user_id, course_id)`` que estén
+    matriculados, descontando contadores y estadísticas (cada matrícula en
+    el día en que se hizo) en la misma transacción. Devuelve cuántas
+    matrículas se borraron.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    with transaction.atomic():
+        rows = [
+            row for row in Enrollment.objects.filter(
+                user_id__in={user_id for user_id, _ in pairs},
+                course_id__in={course_id for _, course_id in pairs},
+            ).values_list('pk', 'user_id', 'course_id', 'enrolled_at')
+            if (row[1], row[2]) in pairs
+        ]
+        ids = [pk for pk, _, _, _ in rows]
+        for start in range(0, len(ids), BULK_BATCH_SIZE):
+            Enrollment.objects.filter(pk__in=ids[start:start + BULK_BATCH_SIZE]).delete()
+
+        by_day = {}
+        for _, user_id, course_id, enrolled_at in rows:
+            by_day.setdefault(timezone.localdate(enrolled_at), []).append((user_id, course_id))
+        for day, day_pairs in by_day.items():
+            record_enrollments(day_pairs, sign=-1, day=day)
+
+        removed = Counter(course_id for _, _, course_id, _ in rows)
+        if removed:
+            # Sin bajar de cero aunque el contador estuviera desviado.
+            Course.objects.filter(pk__in=removed).update(enrollment_count=Greatest(F('enrollment_count') - Case(
+                *[When(pk=pk, then=Value(n)) for pk, n in removed.items()], default=Value(0),
+            ), Value(0)))
+    return len(rows)
+
+
+def reconcile_enrollment_counts(course_ids=None):
+    """
+    Recalcula ``enrollment_count`` a partir de la tabla de matrículas y
+    devuelve cuántos cursos tenían un contador desviado.
+    """
+    counts = (
+        Enrollment.objects.filter(course=OuterRef('pk')).order_by()
+        .values('course').annotate(n=Count('id')).values('n')
+    )
+    actual = Coalesce(Subquery(counts), Value(0))
+    courses = Course.objects.all() if course_ids is None else Course.objects.filter(pk__in=course_ids)
+    with transaction.atomic():
+        return courses.annotate(actual=actual).exclude(enrollment_count=F('actual')).update(enrollment_count=actual)
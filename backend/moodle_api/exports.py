@@ -0,0 +1,171 @@
+# moodle_api/exports.py
+"""Generación de los listados de matriculados en CSV y NDJSON."""
+import csv
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .jsoncodec import dumps
+from .models import Enrollment
+from .pagination import decode_cursor, encode_cursor
+
+EXPORT_HEADER = [
+    'Nombre Completo',
+    'Correo Electrónico',
+    'Edad',
+    'País',
+    'Propósito',
+    'Fecha de Matrícula',
+]
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Objeto tipo fichero que devuelve lo escrito en lugar de guardarlo."""
+
+    def write(self, value):
+        return value
+
+
+# Columnas leídas en la consulta con JOIN sobre matrícula, curso, usuario y perfil.
+EXPORT_VALUES = (
+    'id', 'course__name',
+    'user__first_name', 'user__last_name', 'user__email',
+    'user__profile__age', 'user__profile__country', 'user__profile__purpose',
+    'enrolled_at',
+)
+
+
+def format_row(values):
+    """Convierte una tupla de ``EXPORT_VALUES`` en ``(id, curso, fila CSV)``."""
+    enrollment_id, course_name, first_name, last_name, email, age, country, purpose, enrolled_at = values
+    return enrollment_id, course_name, [
+        f"{first_name} {last_name}".strip(),
+        email,
+        age or 'No disponible',
+        country or 'No disponible',
+        purpose or 'No disponible',
+        enrolled_at.strftime("%d/%m/%Y %H:%M"),
+    ]
+
+
+def enrollment_values(course=None, after_id=0):
+    """Matrículas (de un curso o de todos) posteriores a ``after_id``, en orden de id."""
+    queryset = Enrollment.objects.filter(id__gt=after_id)
+    if course is not None:
+        queryset = queryset.filter(course=course)
+    return queryset.order_by('id').values_list(*EXPORT_VALUES)
+
+
+def enrollment_rows(course, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Recorre las matrículas del curso con una única consulta (matrícula +
+    usuario + perfil) leída por bloques, sin cargar el curso entero en memoria.
+    """
+    for values in enrollment_values(course).iterator(chunk_size=chunk_size):
+        yield format_row(values)[2]
+
+
+def iter_csv(rows, header=EXPORT_HEADER):
+    """Serializa ``rows`` a CSV línea a línea."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+# Exportación incremental: solo las matrículas posteriores a un cursor
+# (marca de agua ``(enrolled_at, id)``), de un curso o de todos.
+
+INCREMENTAL_HEADER = ['ID', 'ID Curso', 'Curso'] + EXPORT_HEADER
+INCREMENTAL_VALUES = ('id', 'course__moodle_id') + EXPORT_VALUES[1:]
+
+# Tamaño aproximado de cada trozo enviado al cliente.
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def incremental_values(course=None, cursor=None, limit=None):
+    """
+    Devuelve ``(filas, siguiente_cursor)``: las matrículas posteriores a
+    ``cursor`` en orden ``(enrolled_at, id)``, como mucho ``limit``, y el
+    cursor de la última. El cursor se fija antes de leer las filas, así que
+    se puede enviar en las cabeceras; sin filas nuevas se devuelve ``cursor``.
+
+    Se excluyen las matrículas de los últimos ``EXPORT_CURSOR_LAG`` segundos:
+    una transacción aún abierta puede confirmar después filas con una fecha
+    anterior a la de una ya exportada, y quedarían detrás del cursor.
+    """
+    queryset = Enrollment.objects.filter(
+        enrolled_at__lte=timezone.now() - timedelta(seconds=settings.EXPORT_CURSOR_LAG))
+    if course is not None:
+        queryset = queryset.filter(course=course)
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(enrolled_at__gt=timestamp) | Q(enrolled_at=timestamp, id__gt=pk))
+    queryset = queryset.order_by('enrolled_at', 'id')
+
+    keys = queryset.values_list('enrolled_at', 'id')
+    last = None
+    if limit:
+        last = keys[limit - 1:limit].first()
+    if last is None:
+        last = keys.last()
+    if last is None:
+        return queryset.none().values_list(*INCREMENTAL_VALUES), cursor
+
+    timestamp, pk = last
+    queryset = queryset.filter(Q(enrolled_at__lt=timestamp) | Q(enrolled_at=timestamp, id__lte=pk))
+    return queryset.values_list(*INCREMENTAL_VALUES), encode_cursor(timestamp, pk)
+
+
+def iter_incremental_csv(values, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(INCREMENTAL_HEADER)
+    for row in values.iterator(chunk_size=chunk_size):
+        # Sin el id de la matrícula la fila tiene la forma de EXPORT_VALUES.
+        course_id, course_name, fields = format_row(row[1:])
+        yield writer.writerow([row[0], course_id, course_name] + fields)
+
+
+def iter_ndjson(values, chunk_size=EXPORT_CHUNK_SIZE):
+    for (enrollment_id, course_id, course_name, first_name, last_name, email, age, country, purpose,
+         enrolled_at) in values.iterator(chunk_size=chunk_size):
+        yield dumps({
+            'id': enrollment_id,
+            'courseid': course_id,
+            'course': course_name,
+            'fullname': f"{first_name} {last_name}".strip(),
+            'email': email,
+            'age': age,
+            'country': country,
+            'purpose': purpose,
+            'enrolled_at': enrolled_at.isoformat(),
+        }) + b'\n'
+
+
+def buffered(lines, size=STREAM_BUFFER_SIZE):
+    """Agrupa ``lines`` (texto o bytes) en trozos de bytes de unos ``size`` bytes."""
+    buffer, length = [], 0
+    for line in lines:
+        data = line if isinstance(line, bytes) else line.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_stream(chunks, level=6):
+    """Comprime ``chunks`` (bytes) en formato gzip a medida que se generan."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,164 @@
+# moodle_api/fake_moodle.py
+"""
+Servidor local que imita el endpoint REST de Moodle para pruebas y benchmarks.
+
+Responde a las funciones que usa el proyecto con datos sintéticos y permite
+inyectar latencia, errores (HTTP 503 o payloads de excepción de Moodle) y
+catálogos grandes::
+
+    with FakeMoodleServer(latency=0.05, error_rate=0.01, catalog_size=20000) as moodle:
+        settings.MOODLE_URL = moodle.url
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+SITE_USERID = 2
+
+
+def _unflatten(pairs):
+    """Reconstruye ``options[ids][0]=1`` como ``{'options': {'ids': {'0': '1'}}}``."""
+    data = {}
+    for key, value in pairs:
+        parts = re.findall(r'[^\[\]]+', key)
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return data
+
+
+def _values(node):
+    if isinstance(node, dict):
+        return [node[k] for k in sorted(node, key=int)]
+    return [node]
+
+
+class FakeMoodleServer:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, catalog_size=100,
+                 users_per_course=20, host='127.0.0.1', port=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.catalog_size = catalog_size
+        self.users_per_course = users_per_course
+        # Últimas llamadas recibidas (acotado para no crecer en benchmarks largos).
+        self.calls = deque(maxlen=1000)
+        self.enrolments = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/webservice/rest/server.php'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # Datos sintéticos
+
+    def course(self, course_id):
+        return {
+            'id': course_id,
+            'shortname': f'C{course_id}',
+            'fullname': f'Curso sintético {course_id}',
+            'categoryid': 3,
+            'summary': '<p>' + 'Contenido del curso. ' * 20 + '</p>',
+            'format': 'site' if course_id == 1 else 'topics',
+            'startdate': 1700000000,
+            'enddate': 1710000000,
+            'timemodified': 1690000000 + course_id,
+        }
+
+    def enrolled_user(self, course_id, index):
+        user_id = course_id * 100000 + index
+        return {'id': user_id, 'email': f'alumno{index}@example.com', 'fullname': f'Alumno {index}'}
+
+    # Funciones de Moodle
+
+    def handle(self, wsfunction, params):
+        if wsfunction == 'core_webservice_get_site_info':
+            return {'sitename': 'Moodle de pruebas', 'userid': SITE_USERID, 'username': 'ws'}
+        if wsfunction == 'core_enrol_get_users_courses':
+            return [self.course(course_id) for course_id in range(2, min(self.catalog_size, 50) + 2)]
+        if wsfunction == 'core_course_get_courses':
+            ids = _values(params.get('options', {}).get('ids', {}))
+            if ids:
+                return [self.course(int(i)) for i in ids if 1 <= int(i) <= self.catalog_size + 1]
+            return [self.course(course_id) for course_id in range(1, self.catalog_size + 2)]
+        if wsfunction == 'core_enrol_get_enrolled_users':
+            course_id = int(params['courseid'])
+            options = {o['name']: o['value'] for o in _values(params.get('options', {}))}
+            start = int(options.get('limitfrom', 0))
+            limit = int(options.get('limitnumber', 0)) or self.users_per_course
+            end = min(start + limit, self.users_per_course)
+            return [self.enrolled_user(course_id, i) for i in range(start, end)]
+        if wsfunction == 'core_user_get_users_by_field':
+            emails = _values(params.get('values', {}))
+            return [{'id': zlib.crc32(email.encode()) % 1000000 + 1000, 'email': email} for email in emails]
+        if wsfunction == 'enrol_manual_enrol_users':
+            with self._lock:
+                self.enrolments.extend(_values(params.get('enrolments', {})))
+            return None
+        return {'exception': 'dml_missing_record_exception', 'errorcode': 'invalidrecord',
+                'message': f'Función no soportada: {wsfunction}'}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, como el servidor web real delante de Moodle.
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.respond(parse_qsl(urlsplit(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.respond(parse_qsl(self.rfile.read(length).decode()))
+
+            def respond(self, pairs):
+                params = _unflatten(pairs)
+                wsfunction = params.get('wsfunction', '')
+                with server._lock:
+                    server.calls.append((wsfunction, params))
+                    delay = server.latency + server._random.uniform(0, server.jitter)
+                    failing = server._random.random() < server.error_rate
+                if delay:
+                    time.sleep(delay)
+                if failing:
+                    self.send_error(503, 'Moodle no disponible')
+                    return
+                body = json.dumps(server.handle(wsfunction, params)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,133 @@
+# moodle_api/groupcommit.py
+"""
+Escritura agrupada ("group commit") de matrículas.
+
+Con SQLite solo puede haber un escritor a la vez: si cada petición hace su
+propia transacción, en un pico de matrículas las peticiones se encolan en
+el cerrojo de la base de datos y muchas acaban en "database is locked".
+
+``EnrollmentQueue`` recibe las matrículas en una cola del proceso y un
+único hilo escritor las vuelca con ``bulk_enroll`` en una transacción por
+lote: cada ``ENROLLMENT_BATCH_MAX_DELAY`` segundos o al juntar
+``ENROLLMENT_BATCH_MAX_SIZE`` matrículas. Cada petición espera el resultado
+de la suya a través de un ``Future``, así que la respuesta es la misma que
+con una escritura individual.
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import OperationalError, connection
+
+from . import metrics
+from .enrollment import ALREADY_ENROLLED, ENROLLED, bulk_enroll, enroll
+
+logger = logging.getLogger(__name__)
+
+# Reintentos de un lote cuando SQLite sigue bloqueada tras el busy timeout.
+FLUSH_ATTEMPTS = 3
+
+
+class EnrollmentQueue:
+    def __init__(self, max_batch=None, max_delay=None):
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def max_batch(self):
+        return self._max_batch or settings.ENROLLMENT_BATCH_MAX_SIZE
+
+    @property
+    def max_delay(self):
+        return self._max_delay if self._max_delay is not None else settings.ENROLLMENT_BATCH_MAX_DELAY
+
+    def submit(self, user_id, course_id):
+        """Encola la matrícula y devuelve un ``Future`` con su estado."""
+        self._ensure_writer()
+        future = Future()
+        self._queue.put(((user_id, course_id), future))
+        return future
+
+    def _ensure_writer(self):
+        pid = os.getpid()
+        if self._thread is None or self._pid != pid or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or self._pid != pid or not self._thread.is_alive():
+                    if self._pid != pid:
+                        # Tras un fork el hilo del proceso padre no existe en el hijo.
+                        self._queue = queue.SimpleQueue()
+                    self._thread = threading.Thread(target=self._run, name='enrollment-writer', daemon=True)
+                    self._pid = pid
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+            connection.close_if_unusable_or_obsolete()
+
+    def flush(self, batch):
+        """Escribe ``batch`` (pares y futures) en una transacción y resuelve cada future."""
+        metrics.ENROLLMENT_BATCH_SIZE.observe((), len(batch))
+        pairs = [pair for pair, _ in batch]
+        for attempt in range(FLUSH_ATTEMPTS):
+            try:
+                results = bulk_enroll(pairs)
+                break
+            except OperationalError as e:
+                if attempt + 1 < FLUSH_ATTEMPTS:
+                    logger.warning('Reintentando lote de %s matrículas: %s', len(batch), e)
+                    time.sleep(0.05 * (attempt + 1))
+                    continue
+                self._fail(batch, e)
+                return
+            except Exception as e:
+                logger.exception('Falló el lote de %s matrículas', len(batch))
+                self._fail(batch, e)
+                return
+
+        seen = set()
+        for pair, future in batch:
+            status = results[pair]
+            if pair in seen and status == ENROLLED:
+                # La misma matrícula pedida dos veces en el lote: solo la primera la crea.
+                status = ALREADY_ENROLLED
+            seen.add(pair)
+            future.set_result(status)
+
+    def _fail(self, batch, error):
+        for _, future in batch:
+            future.set_exception(error)
+
+
+enrollment_queue = EnrollmentQueue()
+
+
+async def aenroll(user, course):
+    """
+    Matricula a ``user`` en ``course`` desde una vista asíncrona. Con
+    ``ENROLLMENT_GROUP_COMMIT`` la escritura va al lote en curso y se espera
+    su resultado sin ocupar un hilo; sin él se usa ``enroll``.
+    """
+    if not settings.ENROLLMENT_GROUP_COMMIT:
+        return await sync_to_async(enroll)(user, course)
+    return await asyncio.wrap_future(enrollment_queue.submit(user.pk, course.pk))
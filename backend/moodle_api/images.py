@@ -0,0 +1,194 @@
+# moodle_api/images.py
+"""
+Proxy de las imágenes de los cursos.
+
+La imagen original de cada curso (``Course.image_url``, alojada en Moodle)
+se descarga una sola vez, se generan las variantes de ``IMAGE_VARIANTS`` y
+se guardan en ``COURSE_IMAGE_ROOT``. Ese directorio funciona como una caché
+LRU acotada a ``COURSE_IMAGE_CACHE_MAX_BYTES``: cada lectura renueva la fecha
+de modificación del fichero y, al escribir variantes nuevas, se borran las
+menos usadas hasta volver al límite.
+
+Los ficheros se nombran con un resumen de la URL original y del
+``timemodified`` del curso, que también sirve de versión y de ETag. Moodle
+conserva la URL si la imagen se sustituye por otra con el mismo nombre, pero
+editar el curso cambia su ``timemodified`` y con él el nombre, así que las
+variantes servidas nunca cambian de contenido.
+
+Las imágenes se descargan con el token del servicio, así que solo se
+descargan URLs del mismo sitio que ``MOODLE_URL`` (ver
+``MoodleClient.download``).
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .client import MoodleError, get_client
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Variantes servidas: nombre -> (ancho, alto). Se recortan para cubrir el tamaño.
+IMAGE_VARIANTS = {
+    'thumb': (160, 120),
+    'card': (640, 360),
+}
+JPEG_QUALITY = 85
+# Las lecturas solo renuevan la fecha del fichero si es más antigua que esto,
+# para no escribir en disco en cada petición.
+TOUCH_INTERVAL = 3600
+
+# Coalescencia de las descargas de una misma imagen entre peticiones y workers.
+image_fetches = SingleFlight('course-image')
+
+
+def image_version(image_url, timemodified):
+    return hashlib.sha256(f'{image_url}\n{timemodified}'.encode()).hexdigest()[:16]
+
+
+def image_etag(version, variant):
+    return f'"{version}-{variant}"'
+
+
+def proxy_url(course, variant='card'):
+    """URL del proxy para la imagen de ``course``, o ``None`` si no tiene."""
+    if not course.image_url:
+        return None
+    path = reverse('course_image', args=[course.moodle_id, variant])
+    return f'{path}?v={image_version(course.image_url, course.timemodified)}'
+
+
+def _root():
+    return Path(settings.COURSE_IMAGE_ROOT)
+
+
+def variant_path(version, variant):
+    return _root() / f'{version}-{variant}.jpg'
+
+
+def open_variant(image_url, version, variant):
+    """
+    Abre la variante ``variant`` de la versión ``version`` de la imagen
+    ``image_url`` y la devuelve como fichero binario. Si no está en disco se descarga el original de Moodle
+    (una sola vez aunque lleguen muchas peticiones a la vez) y se generan
+    todas las variantes. Lanza ``MoodleError`` si no se puede obtener.
+    """
+    path = variant_path(version, variant)
+    try:
+        return _open(path)
+    except FileNotFoundError:
+        pass
+    image_fetches.do(version, lambda: _build_variants(image_url, version))
+    try:
+        return _open(path)
+    except FileNotFoundError:
+        # Lo generó otro worker y ya se ha desalojado, o falló su escritura.
+        _build_variants(image_url, version)
+        return _open(path)
+
+
+def _open(path):
+    f = open(path, 'rb')
+    try:
+        mtime = os.fstat(f.fileno()).st_mtime
+        if time.time() - mtime > TOUCH_INTERVAL:
+            os.utime(path)
+    except OSError:
+        pass
+    return f
+
+
+def _build_variants(image_url, version):
+    if all(variant_path(version, v).exists() for v in IMAGE_VARIANTS):
+        return
+    original = get_client().download(image_url, settings.COURSE_IMAGE_MAX_SOURCE_BYTES)
+    try:
+        variants = render_variants(original)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise MoodleError(f'La imagen del curso no es válida: {e}') from e
+
+    root = _root()
+    root.mkdir(parents=True, exist_ok=True)
+    for variant, data in variants.items():
+        _write_atomic(variant_path(version, variant), data)
+    evict(settings.COURSE_IMAGE_CACHE_MAX_BYTES)
+
+
+def render_variants(original):
+    """Genera cada variante en JPEG a partir de los bytes de la imagen original."""
+    with Image.open(io.BytesIO(original)) as image:
+        largest = max(IMAGE_VARIANTS.values())
+        # En JPEG decodifica directamente a una escala reducida: mucho más rápido.
+        image.draft('RGB', largest)
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+        variants = {}
+        for variant, size in IMAGE_VARIANTS.items():
+            resized = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            variants[variant] = out.getvalue()
+        return variants
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def evict(max_bytes):
+    """
+    Borra las variantes usadas hace más tiempo hasta que el directorio ocupe
+    como mucho ``max_bytes``. Devuelve el número de ficheros borrados.
+    """
+    entries = []
+    total = 0
+    try:
+        with os.scandir(_root()) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.info('Caché de imágenes: %s ficheros desalojados', removed)
+    return removed
@@ -0,0 +1,170 @@
+# moodle_api/jobs.py
+"""
+Exportaciones en segundo plano.
+
+La tabla ``ExportJob`` hace de cola: ``create_export_job`` encola un trabajo
+(o devuelve uno reciente equivalente) y los workers de
+``run_export_workers`` los reclaman y escriben el CSV a disco por bloques.
+Tras cada bloque se guarda el punto de reanudación, así que un trabajo que
+quedó a medias por un reinicio continúa donde se quedó.
+"""
+import csv
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .exports import EXPORT_HEADER, Echo, enrollment_values, format_row
+from .models import Enrollment, ExportJob
+
+logger = logging.getLogger(__name__)
+
+
+def export_path(job):
+    return os.path.join(settings.EXPORT_ROOT, job.file_name)
+
+
+def _snapshot(course):
+    queryset = Enrollment.objects.all() if course is None else Enrollment.objects.filter(course=course)
+    stats = queryset.aggregate(total=Count('id'), last=Max('id'))
+    total, last = stats['total'], stats['last'] or 0
+    fingerprint = f"{course.pk if course else 'all'}:{total}:{last}"
+    return fingerprint, total, last
+
+
+def create_export_job(course=None, user=None):
+    """
+    Encola la exportación de ``course`` (o de todos los cursos).
+
+    Si ya hay un trabajo con la misma huella pendiente, en curso o terminado
+    hace menos de ``EXPORT_JOB_REUSE_SECONDS``, se devuelve ese trabajo.
+    """
+    fingerprint, total, last = _snapshot(course)
+    reuse_after = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_REUSE_SECONDS)
+    candidates = (
+        ExportJob.objects.filter(fingerprint=fingerprint)
+        .filter(Q(status__in=[ExportJob.PENDING, ExportJob.RUNNING]) |
+                Q(status=ExportJob.DONE, finished_at__gte=reuse_after))
+        .order_by('-created_at')
+    )
+    for job in candidates:
+        if job.status != ExportJob.DONE or os.path.exists(export_path(job)):
+            return job, False
+
+    job = ExportJob.objects.create(
+        course=course,
+        requested_by=user if user is not None and user.is_authenticated else None,
+        fingerprint=fingerprint,
+        total_rows=total,
+        max_enrollment_id=last,
+    )
+    job.file_name = f'export_{job.pk}.csv'
+    job.save(update_fields=['file_name'])
+    return job, True
+
+
+def claim_job():
+    """
+    Reclama el trabajo pendiente más antiguo, o uno en curso cuyo worker dejó
+    de dar señales de vida. Usa una actualización condicional en lugar de
+    bloqueos de fila para funcionar también sobre SQLite.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_STALE_SECONDS)
+    claimable = ExportJob.objects.filter(
+        Q(status=ExportJob.PENDING) | Q(status=ExportJob.RUNNING, updated_at__lt=stale_before)
+    ).order_by('created_at')
+    for job in claimable[:10]:
+        claimed = ExportJob.objects.filter(
+            pk=job.pk, status=job.status, updated_at=job.updated_at,
+        ).update(status=ExportJob.RUNNING, updated_at=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job, chunk_size=None, stop_event=None):
+    """
+    Escribe (o continúa escribiendo) el CSV de ``job`` por bloques. Si se
+    activa ``stop_event`` el trabajo vuelve a la cola tras el bloque en curso.
+    """
+    chunk_size = chunk_size or settings.EXPORT_JOB_CHUNK_SIZE
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    path = export_path(job)
+    try:
+        with open(path, 'a+b') as raw:
+            # Descarta lo escrito después del último punto de reanudación guardado.
+            raw.truncate(job.bytes_written)
+            raw.seek(job.bytes_written)
+            if job.bytes_written == 0:
+                _write_rows(raw, job, [], header=True)
+                _checkpoint(job, raw, job.last_enrollment_id, 0)
+
+            while True:
+                values = list(
+                    enrollment_values(job.course, after_id=job.last_enrollment_id)
+                    .filter(id__lte=job.max_enrollment_id)[:chunk_size]
+                )
+                if not values:
+                    break
+                rows = [format_row(v) for v in values]
+                _write_rows(raw, job, rows)
+                _checkpoint(job, raw, rows[-1][0], len(rows))
+                if stop_event is not None and stop_event.is_set():
+                    job.status = ExportJob.PENDING
+                    job.save(update_fields=['status', 'updated_at'])
+                    return
+
+        job.status = ExportJob.DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    except Exception as e:
+        logger.exception('Falló la exportación %s', job.pk)
+        job.status = ExportJob.FAILED
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+
+
+def _write_rows(raw, job, rows, header=False):
+    writer = csv.writer(Echo())
+    all_courses = job.course_id is None
+    lines = []
+    if header:
+        lines.append(writer.writerow((['Curso'] if all_courses else []) + EXPORT_HEADER))
+    for _, course_name, row in rows:
+        lines.append(writer.writerow(([course_name] if all_courses else []) + row))
+    raw.write(''.join(lines).encode('utf-8'))
+
+
+def _checkpoint(job, raw, last_enrollment_id, rows):
+    raw.flush()
+    os.fsync(raw.fileno())
+    job.last_enrollment_id = last_enrollment_id
+    job.rows_written += rows
+    job.bytes_written = raw.tell()
+    job.save(update_fields=['last_enrollment_id', 'rows_written', 'bytes_written', 'updated_at'])
+
+
+def work(stop_event=None, poll_interval=1.0, once=False):
+    """Bucle de un worker: reclama trabajos y los ejecuta hasta que se le pide parar."""
+    try:
+        while stop_event is None or not stop_event.is_set():
+            close_old_connections()
+            job = claim_job()
+            if job is not None:
+                logger.info('Exportando trabajo %s', job.pk)
+                run_job(job, stop_event=stop_event)
+                continue
+            if once:
+                break
+            if stop_event is None:
+                time.sleep(poll_interval)
+            else:
+                stop_event.wait(poll_interval)
+    finally:
+        connections.close_all()
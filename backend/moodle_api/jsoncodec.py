@@ -0,0 +1,170 @@
+# moodle_api/jsoncodec.py
+"""
+Codificación JSON de las respuestas de Moodle y de la API.
+
+El backend se elige con ``JSON_CODEC``: ``'auto'`` usa orjson si está
+instalado y si no el módulo ``json`` de la biblioteca estándar; ``'orjson'``
+o ``'json'`` lo fijan. Ambos producen el mismo JSON (las fechas, decimales y
+UUID se serializan como ``DjangoJSONEncoder``).
+
+``LazyJSON`` guarda el cuerpo de una respuesta de Moodle sin decodificar: se
+decodifica la primera vez que se lee su contenido y, si nadie lo hace,
+``JsonResponse`` envía los bytes tal cual. Al guardarlo en la caché también
+se guardan los bytes, no los objetos de Python.
+"""
+import json
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_default = DjangoJSONEncoder().default
+
+
+class StdlibCodec:
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class OrjsonCodec:
+    name = 'orjson'
+    # Fechas con DjangoJSONEncoder para que la salida no dependa del backend.
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=_default, option=self.options)
+
+
+_codec = None
+
+
+def get_codec():
+    global _codec
+    if _codec is None:
+        choice = settings.JSON_CODEC
+        if choice == 'orjson' and orjson is None:
+            raise ImproperlyConfigured("JSON_CODEC = 'orjson' pero orjson no está instalado")
+        if choice not in ('auto', 'orjson', 'json'):
+            raise ImproperlyConfigured(f'JSON_CODEC no válido: {choice}')
+        _codec = OrjsonCodec() if choice != 'json' and orjson is not None else StdlibCodec()
+    return _codec
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    global _codec
+    if setting == 'JSON_CODEC':
+        _codec = None
+
+
+def loads(data):
+    """Decodifica ``data`` (bytes o str); lanza ``ValueError`` si no es JSON."""
+    return get_codec().loads(data)
+
+
+def dumps(obj):
+    """Codifica ``obj`` y devuelve bytes UTF-8."""
+    return get_codec().dumps(obj)
+
+
+_OBJECT_RE = re.compile(rb'\s*\{')
+
+
+class LazyJSON:
+    """
+    Cuerpo JSON que se decodifica al primer acceso. Se lee como el valor
+    decodificado (``payload['userid']``, ``'userid' in payload``, iteración).
+    Una vez decodificado, ``content`` se vuelve a codificar desde los datos,
+    por si se modificaron.
+    """
+
+    __slots__ = ('_content', '_data', '_decoded')
+
+    def __init__(self, content):
+        self._content = content
+        self._data = None
+        self._decoded = False
+
+    @property
+    def data(self):
+        if not self._decoded:
+            self._data = loads(self._content)
+            self._decoded = True
+        return self._data
+
+    @property
+    def content(self):
+        return dumps(self._data) if self._decoded else self._content
+
+    @property
+    def is_object(self):
+        """Si el cuerpo es un objeto JSON (sin decodificarlo)."""
+        if self._decoded:
+            return isinstance(self._data, dict)
+        return bool(_OBJECT_RE.match(self._content))
+
+    def mentions(self, needle):
+        """Si ``needle`` (bytes) aparece en el cuerpo original, sin decodificarlo."""
+        return needle in self._content
+
+    def __contains__(self, item):
+        return item in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyJSON):
+            other = other.data
+        return self.data == other
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __reduce__(self):
+        return LazyJSON, (self.content,)
+
+    def __repr__(self):
+        return f'<LazyJSON {len(self._content)} bytes>'
+
+
+class JsonResponse(HttpResponse):
+    """
+    Como ``django.http.JsonResponse`` pero con el codec configurado. Acepta
+    un ``LazyJSON``, cuyo cuerpo se envía sin decodificar si nadie lo leyó.
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if isinstance(data, LazyJSON):
+            is_object, content = data.is_object, data.content
+        else:
+            is_object, content = isinstance(data, dict), None
+        if safe and not is_object:
+            raise TypeError('Para serializar algo que no sea un dict hay que pasar safe=False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=content if content is not None else dumps(data), **kwargs)
@@ -0,0 +1,142 @@
+# moodle_api/loaders.py
+"""
+Carga de cursos por lotes al estilo "dataloader".
+
+``core_course_get_courses`` admite muchos ids en una sola llamada. El
+``CourseLoader`` junta los ids pedidos dentro de una misma operación
+(``load_many``) o por peticiones concurrentes durante una ventana corta
+(``load``) y los resuelve con una llamada multi-id, partiéndola en varias
+cuando la URL resultante superaría ``MOODLE_MAX_URL_LENGTH``.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from .client import get_async_client, get_client
+
+
+class _Batch:
+    def __init__(self):
+        self.ids = set()
+        self.event = threading.Event()
+        self.results = {}
+        self.error = None
+
+
+class CourseLoader:
+    wsfunction = 'core_course_get_courses'
+
+    def __init__(self, window=None, max_url_length=None):
+        self._window = window
+        self._max_url_length = max_url_length
+        self._lock = threading.Lock()
+        self._pending = None
+        self._async_pending = weakref.WeakKeyDictionary()
+
+    @property
+    def window(self):
+        return settings.MOODLE_BATCH_WINDOW if self._window is None else self._window
+
+    @property
+    def max_url_length(self):
+        return self._max_url_length or settings.MOODLE_MAX_URL_LENGTH
+
+    def chunks(self, client, course_ids):
+        """Reparte ``course_ids`` en grupos cuya URL de consulta cabe en el límite."""
+        base = len(client.url or '') + 1 + len(urlencode(client.build_params(self.wsfunction, {})))
+        chunk, length = [], base
+        for course_id in course_ids:
+            cost = len(urlencode({f'options[ids][{len(chunk)}]': course_id})) + 1
+            if chunk and length + cost > self.max_url_length:
+                yield chunk
+                chunk, length = [], base
+                cost = len(urlencode({'options[ids][0]': course_id})) + 1
+            chunk.append(course_id)
+            length += cost
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _index(courses):
+        return {course['id']: course for course in courses}
+
+    def load_many(self, course_ids):
+        """Devuelve ``{id: curso}`` con una llamada por cada grupo de ids."""
+        client = get_client()
+        results = {}
+        for chunk in self.chunks(client, sorted(set(course_ids))):
+            results.update(self._index(client.call(self.wsfunction, options={'ids': chunk})))
+        return results
+
+    async def aload_many(self, course_ids):
+        """Como ``load_many``, pero lanzando los grupos en paralelo."""
+        client = get_async_client()
+        responses = await asyncio.gather(*(
+            client.call(self.wsfunction, options={'ids': chunk})
+            for chunk in self.chunks(client, sorted(set(course_ids)))
+        ))
+        results = {}
+        for courses in responses:
+            results.update(self._index(courses))
+        return results
+
+    def load(self, course_id):
+        """
+        Devuelve un curso (o ``None`` si Moodle no lo conoce), agrupando con
+        las demás llamadas a ``load`` que lleguen durante ``window`` segundos.
+        """
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            batch.ids.add(course_id)
+
+        if leader:
+            if self.window:
+                time.sleep(self.window)
+            with self._lock:
+                self._pending = None
+            try:
+                batch.results = self.load_many(batch.ids)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.event.set()
+        else:
+            batch.event.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(course_id)
+
+    async def aload(self, course_id):
+        """Versión asíncrona de ``load`` (agrupa dentro del mismo event loop)."""
+        loop = asyncio.get_running_loop()
+        pending = self._async_pending.get(loop)
+        if pending is None:
+            pending = ids, future = {course_id}, loop.create_future()
+            self._async_pending[loop] = pending
+            try:
+                await asyncio.sleep(self.window)
+                del self._async_pending[loop]
+                future.set_result(await self.aload_many(ids))
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                if self._async_pending.get(loop) is pending:
+                    del self._async_pending[loop]
+        else:
+            ids, future = pending
+            ids.add(course_id)
+        return (await asyncio.shield(future)).get(course_id)
+
+
+course_loader = CourseLoader()
@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from moodle_api import benchmark
+from moodle_api.fake_moodle import FakeMoodleServer
+
+
+class Command(BaseCommand):
+    help = ('Mide latencia, rendimiento, consultas y memoria de los endpoints contra un Moodle '
+            'simulado, sobre una base de datos temporal.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', nargs='+', choices=sorted(benchmark.SCENARIOS),
+                            default=list(benchmark.SCENARIOS))
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8])
+        parser.add_argument('--requests', type=int, default=100, help='Peticiones por nivel de concurrencia')
+        parser.add_argument('--latency', type=float, default=0.02, help='Latencia de Moodle simulada (s)')
+        parser.add_argument('--jitter', type=float, default=0.01, help='Variación aleatoria de la latencia (s)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de respuestas 503')
+        parser.add_argument('--catalog-size', type=int, default=200, help='Cursos en el Moodle simulado')
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--courses', type=int, default=50, help='Cursos usados por los escenarios')
+        parser.add_argument('--enrollments-per-course', type=int, default=100)
+        parser.add_argument('--no-memory', action='store_true', help='No medir el pico de memoria')
+        parser.add_argument('--output', help='Guardar los resultados en este fichero JSON')
+        parser.add_argument('--baseline', help='Fichero JSON con la línea base')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Guardar los resultados como nueva línea base en --baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Margen permitido respecto a la línea base (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline necesita --baseline')
+
+        results = self.run(options)
+
+        if options['output']:
+            benchmark.save_baseline(options['output'], results)
+        if options['baseline'] and options['save_baseline']:
+            benchmark.save_baseline(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f"Línea base guardada en {options['baseline']}"))
+        elif options['baseline']:
+            regressions = benchmark.compare(results, benchmark.load_baseline(options['baseline']),
+                                            options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(self.style.ERROR(f'Regresión: {regression}'))
+                sys.exit(1)
+            self.stdout.write(self.style.SUCCESS('Sin regresiones respecto a la línea base'))
+
+    def run(self, options):
+        # Base de datos en un fichero temporal: nunca se toca db.sqlite3 y los
+        # hilos comparten datos como lo harían los workers reales.
+        workdir = tempfile.mkdtemp(prefix='moodle-bench-')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with FakeMoodleServer(latency=options['latency'], jitter=options['jitter'],
+                                  error_rate=options['error_rate'],
+                                  catalog_size=max(options['catalog_size'], options['courses'])) as moodle, \
+                    override_settings(MOODLE_URL=moodle.url, MOODLE_TOKEN='benchmark',
+                                      EXPORT_ROOT=os.path.join(workdir, 'exports')):
+                cache.clear()
+                ctx = benchmark.seed(users=options['users'], courses=options['courses'],
+                                     synced_courses=int(options['courses'] * 0.8),
+                                     enrollments_per_course=options['enrollments_per_course'])
+                return benchmark.run_benchmark(
+                    ctx, options['endpoints'], options['concurrency'], options['requests'],
+                    memory=not options['no_memory'], progress=self.report,
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def report(self, name, concurrency, stats):
+        self.stdout.write(
+            f"{name:<18} c={concurrency:<4} p50={stats['p50_ms']:>8.2f} ms  p99={stats['p99_ms']:>8.2f} ms  "
+            f"{stats['rps']:>8.1f} req/s  {stats['queries_avg']:>6.2f} consultas  {stats['errors']} errores"
+        )
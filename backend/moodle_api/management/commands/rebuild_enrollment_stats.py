@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from moodle_api.analytics import rebuild_stats
+from moodle_api.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las estadísticas de matrículas (por día, país, edad y propósito) desde cero.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', nargs='+', type=int, help='Reconstruir solo estos cursos de Moodle')
+
+    def handle(self, *args, **options):
+        course_ids = None
+        if options['ids']:
+            course_ids = list(Course.objects.filter(moodle_id__in=options['ids']).values_list('pk', flat=True))
+        rows = rebuild_stats(course_ids)
+        self.stdout.write(self.style.SUCCESS(f'{rows} filas de estadísticas escritas'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from moodle_api.enrollment import reconcile_enrollment_counts
+from moodle_api.models import Course
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el contador de matrículas de cada curso a partir de la tabla de matrículas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', nargs='+', type=int, help='Reconciliar solo estos cursos de Moodle')
+
+    def handle(self, *args, **options):
+        course_ids = None
+        if options['ids']:
+            course_ids = list(Course.objects.filter(moodle_id__in=options['ids']).values_list('pk', flat=True))
+        fixed = reconcile_enrollment_counts(course_ids)
+        self.stdout.write(self.style.SUCCESS(f'{fixed} cursos con el contador corregido'))
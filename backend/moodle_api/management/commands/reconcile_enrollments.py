@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from moodle_api.reconciliation import reconcile_enrollments
+
+
+class Command(BaseCommand):
+    help = 'Reconcilia las matrículas locales con las de Moodle (por correo) en los cursos sincronizados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', nargs='+', type=int, help='Reconciliar solo estos cursos de Moodle')
+        local_only = parser.add_mutually_exclusive_group()
+        local_only.add_argument('--push', action='store_true',
+                                help='Matricular en Moodle las matrículas locales que falten allí')
+        local_only.add_argument('--delete', action='store_true',
+                                help='Borrar las matrículas locales que falten en Moodle (por defecto se conservan)')
+        parser.add_argument('--dry-run', action='store_true', help='Contar los cambios sin aplicarlos')
+        parser.add_argument('--chunk-size', type=int, help='Cursos procesados por bloque')
+        parser.add_argument('--concurrency', type=int, help='Llamadas simultáneas a Moodle')
+        parser.add_argument('--page-size', type=int, help='Alumnos por página de core_enrol_get_enrolled_users')
+
+    def handle(self, *args, **options):
+        report = reconcile_enrollments(
+            options['ids'], push=options['push'], delete=options['delete'], dry_run=options['dry_run'],
+            chunk_size=options['chunk_size'], concurrency=options['concurrency'], page_size=options['page_size'],
+        )
+        prefix = 'Simulación: ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{report['courses']} cursos reconciliados: {report['added']} altas, "
+            f"{report['removed']} bajas, {report['pushed']} enviadas a Moodle, "
+            f"{report['local_only']} solo locales conservadas, "
+            f"{report['unmatched']} sin usuario correspondiente"
+        ))
+        if report['failed'] or report['push_failed']:
+            self.stderr.write(
+                f"{report['failed']} cursos sin leer de Moodle, {report['push_failed']} matrículas sin enviar"
+            )
@@ -0,0 +1,39 @@
+import logging
+import threading
+
+from django.core.management.base import BaseCommand
+
+from moodle_api.jobs import work
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta los trabajos de exportación en segundo plano con un pool de hilos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Número de hilos trabajadores')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Segundos de espera cuando la cola está vacía')
+        parser.add_argument('--once', action='store_true',
+                            help='Procesar los trabajos pendientes y terminar')
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        stop = threading.Event()
+        threads = [
+            threading.Thread(
+                target=work,
+                kwargs={'stop_event': stop, 'poll_interval': options['poll_interval'], 'once': options['once']},
+                name=f'export-worker-{i}',
+            )
+            for i in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # Los trabajos interrumpidos se reanudan desde su último bloque.
+            stop.set()
+            for thread in threads:
+                thread.join()
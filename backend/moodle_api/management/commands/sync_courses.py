@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from moodle_api.client import MoodleError
+from moodle_api.search import rebuild_index
+from moodle_api.services import fetch_courses, upsert_courses
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza el catálogo local de cursos con Moodle (solo los cursos modificados).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', nargs='+', type=int, help='Sincronizar solo estos cursos de Moodle')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Cursos escritos por lote en la base de datos')
+        parser.add_argument('--force', action='store_true',
+                            help='Reescribir todos los cursos aunque su timemodified no haya cambiado')
+        parser.add_argument('--reindex', action='store_true',
+                            help='Reconstruir después el índice de búsqueda de todo el catálogo')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Repetir la sincronización cada N segundos (0 = una sola vez)')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                self.sync(options)
+            except MoodleError as e:
+                if not options['interval']:
+                    raise CommandError(f'Error al sincronizar con Moodle: {e}')
+                self.stderr.write(f'Error al sincronizar con Moodle: {e}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def sync(self, options):
+        # Con --ids los cursos se piden en llamadas multi-id (ver CourseLoader).
+        courses = fetch_courses(options['ids'])
+        written, skipped = upsert_courses(courses, batch_size=options['batch_size'], force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(courses)} cursos recibidos: {written} actualizados, {skipped} sin cambios'
+        ))
+        if options['reindex']:
+            self.stdout.write(self.style.SUCCESS(f'{rebuild_index()} cursos indexados para la búsqueda'))
@@ -0,0 +1,226 @@
+# moodle_api/metrics.py
+"""
+Métricas en formato de texto de Prometheus.
+
+Cada métrica guarda sus valores en un fragmento por hilo: en el camino
+caliente solo se toca el diccionario del propio hilo, sin cerrojos. El
+cerrojo se usa una vez por hilo (al registrar su fragmento) y al servir
+``/metrics``, que suma todos los fragmentos. Los fragmentos de los hilos
+que ya terminaron (runserver abre uno por petición) se suman a un
+fragmento base y se descartan, así que no se acumulan.
+
+Los valores son por proceso: con varios workers, cada uno expone los suyos.
+
+``/metrics`` revela latencias, consultas y funciones de Moodle: solo lo
+leen el personal y los clientes de ``METRICS_ALLOWED_NETWORKS``.
+"""
+import contextvars
+import ipaddress
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REGISTRY = []
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = {}
+        # Lo acumulado por los hilos que ya terminaron.
+        self._base = {}
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._shards_lock:
+                self._fold_dead_shards()
+                self._shards[threading.current_thread()] = values
+            return values
+
+    def _fold_dead_shards(self):
+        # Con el cerrojo tomado. Un hilo terminado ya no escribe en su fragmento.
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            self._merge(self._base, self._shards.pop(thread))
+
+    def _snapshots(self):
+        with self._shards_lock:
+            self._fold_dead_shards()
+            # dict.copy() es atómico con el GIL aunque otro hilo esté escribiendo.
+            return [self._merge({}, self._base)] + [shard.copy() for shard in self._shards.values()]
+
+    def _totals(self):
+        totals = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        return totals
+
+    def _labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, labelvalues=(), amount=1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def value(self, labelvalues=()):
+        return sum(shard.get(labelvalues, 0) for shard in self._snapshots())
+
+    @staticmethod
+    def _merge(totals, shard):
+        for labelvalues, value in shard.items():
+            totals[labelvalues] = totals.get(labelvalues, 0) + value
+        return totals
+
+    def _render_samples(self):
+        for labelvalues, value in sorted(self._totals().items()):
+            yield f'{self.name}{self._labels(labelvalues)} {value}'
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labelvalues, value):
+        shard = self._shard()
+        state = shard.get(labelvalues)
+        if state is None:
+            # Un contador por cubeta (la última es +Inf) seguido de la suma.
+            state = shard[labelvalues] = [0] * (len(self.buckets) + 2)
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @staticmethod
+    def _merge(totals, shard):
+        for labelvalues, state in shard.items():
+            total = totals.setdefault(labelvalues, [0] * len(state))
+            for i, value in enumerate(list(state)):
+                total[i] += value
+        return totals
+
+    def _render_samples(self):
+        for labelvalues, state in sorted(self._totals().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket{self._labels(labelvalues, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{self._labels(labelvalues)} {state[-1]}'
+            yield f'{self.name}_count{self._labels(labelvalues)} {cumulative}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """Devuelve todas las métricas en el formato de exposición de Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Duración de las peticiones por vista.', ['view', 'method', 'status'])
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Consultas SQL por petición.', ['view'], buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_duration_seconds', 'Tiempo en la base de datos por petición.', ['view'])
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Tamaño del cuerpo de la respuesta.', ['view'], buckets=SIZE_BUCKETS)
+MOODLE_CALL_LATENCY = Histogram(
+    'moodle_call_duration_seconds', 'Duración de cada intento de llamada a Moodle.', ['wsfunction'])
+MOODLE_CALL_ERRORS = Counter(
+    'moodle_call_errors_total', 'Llamadas a Moodle fallidas por tipo de error.', ['wsfunction', 'error'])
+ENROLLMENT_BATCH_SIZE = Histogram(
+    'enrollment_batch_size', 'Matrículas escritas por transacción agrupada.', buckets=BATCH_SIZE_BUCKETS)
+ADMISSION_SHED = Counter(
+    'admission_shed_total', 'Peticiones rechazadas con 429 por el control de admisión.', ['policy', 'reason'])
+MOODLE_THROTTLED = Counter(
+    'moodle_throttled_total', 'Llamadas a Moodle no enviadas por el límite saliente.', ['wsfunction', 'reason'])
+MOODLE_RESPONSE_SIZE = Histogram(
+    'moodle_response_size_bytes', 'Tamaño de las respuestas de Moodle.', ['wsfunction'], buckets=SIZE_BUCKETS)
+
+
+def observe_moodle_call(wsfunction, duration, error=None, size=None):
+    MOODLE_CALL_LATENCY.observe((wsfunction,), duration)
+    if error is not None:
+        MOODLE_CALL_ERRORS.inc((wsfunction, error))
+    if size is not None:
+        MOODLE_RESPONSE_SIZE.observe((wsfunction,), size)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Estadísticas de la petición en curso. Se propaga a los hilos de
+# sync_to_async, así que también cuenta las consultas de las vistas asíncronas.
+current_request = contextvars.ContextVar('current_request_stats', default=None)
+
+
+def _observe_query(execute, sql, params, many, context):
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_observer(sender, connection, **kwargs):
+    if _observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_observe_query)
+
+
+connection_created.connect(install_query_observer)
+
+
+def scrape_allowed(request):
+    """¿Puede ``request`` leer ``/metrics``? Personal o dirección en ``METRICS_ALLOWED_NETWORKS``."""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in settings.METRICS_ALLOWED_NETWORKS)
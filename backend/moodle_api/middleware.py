@@ -0,0 +1,163 @@
+# moodle_api/middleware.py
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics, profiling
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<sin_ruta>'
+
+
+def _record(request, response, stats, start):
+    view = _view_name(request)
+    metrics.REQUEST_LATENCY.observe((view, request.method, response.status_code), time.perf_counter() - start)
+    if response.streaming and not response.is_async:
+        # Las consultas de una respuesta en streaming se ejecutan al recorrerla.
+        response.streaming_content = _observe_stream(response.streaming_content, view, stats)
+        return
+    metrics.REQUEST_DB_QUERIES.observe((view,), stats.queries)
+    metrics.REQUEST_DB_TIME.observe((view,), stats.db_time)
+    if not response.streaming:
+        metrics.RESPONSE_SIZE.observe((view,), len(response.content))
+
+
+def _observe_stream(content, view, stats):
+    iterator = iter(content)
+    size = 0
+    try:
+        while True:
+            token = metrics.current_request.set(stats)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                metrics.current_request.reset(token)
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.REQUEST_DB_QUERIES.observe((view,), stats.queries)
+        metrics.REQUEST_DB_TIME.observe((view,), stats.db_time)
+        metrics.RESPONSE_SIZE.observe((view,), size)
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """Mide duración, consultas SQL y tamaño de respuesta de cada vista."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = metrics.RequestStats()
+            token = metrics.current_request.set(stats)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+            finally:
+                metrics.current_request.reset(token)
+            _record(request, response, stats, start)
+            return response
+    else:
+        def middleware(request):
+            stats = metrics.RequestStats()
+            token = metrics.current_request.set(stats)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+            finally:
+                metrics.current_request.reset(token)
+            _record(request, response, stats, start)
+            return response
+    return middleware
+
+
+def _profile_trigger(user):
+    # ``user`` solo se resuelve si la petición trae la cabecera X-Profile.
+    if user is not None and user.is_authenticated and user.is_staff:
+        return 'header'
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def _finish_profile(request, response, profile, user):
+    response['X-Profile-Id'] = profile.id
+    details = {
+        'method': request.method,
+        'path': request.path,
+        'view': _view_name(request),
+        'status': response.status_code,
+        'user': user.get_username() if user is not None else None,
+    }
+    if response.streaming and not response.is_async:
+        # El perfil sigue abierto hasta que el servidor termina de recorrer la respuesta.
+        response.streaming_content = _profile_stream(response.streaming_content, profile, details)
+    else:
+        profile.stop()
+        profiling.save(profile, **details)
+
+
+def _profile_stream(content, profile, details):
+    iterator = iter(content)
+    try:
+        while True:
+            with profile.recording():
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+            yield chunk
+    finally:
+        profile.stop()
+        profiling.save(profile, **details)
+
+
+@sync_and_async_middleware
+def ProfilingMiddleware(get_response):
+    """
+    Perfila las peticiones muestreadas o marcadas por el personal con
+    ``X-Profile`` (ver ``profiling.py``). Va detrás de la autenticación para
+    poder comprobar quién envía la cabecera.
+    """
+    if not settings.PROFILING_ENABLED:
+        raise MiddlewareNotUsed
+    profiling.install()
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            user = await request.auser() if request.headers.get(profiling.PROFILE_HEADER) else None
+            trigger = _profile_trigger(user)
+            if trigger is None:
+                return await get_response(request)
+            # El hilo del loop es compartido: se muestrea el de sync_to_async de la petición.
+            profile = profiling.Profile(None, trigger)
+            try:
+                with profile.recording():
+                    response = await get_response(request)
+            except BaseException:
+                profile.stop()
+                raise
+            _finish_profile(request, response, profile, user if trigger == 'header' else None)
+            return response
+    else:
+        def middleware(request):
+            user = request.user if request.headers.get(profiling.PROFILE_HEADER) else None
+            trigger = _profile_trigger(user)
+            if trigger is None:
+                return get_response(request)
+            profile = profiling.Profile(threading.get_ident(), trigger)
+            try:
+                with profile.recording():
+                    response = get_response(request)
+            except BaseException:
+                profile.stop()
+                raise
+            _finish_profile(request, response, profile, user if trigger == 'header' else None)
+            return response
+    return middleware
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moodle_api', '0002_alter_course_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='synced_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='timemodified',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:44
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_enrollments(apps, schema_editor):
+    Course = apps.get_model('moodle_api', 'Course')
+    Enrollment = apps.get_model('moodle_api', 'Enrollment')
+    counts = (
+        Enrollment.objects.filter(course=OuterRef('pk')).order_by()
+        .values('course').annotate(n=Count('id')).values('n')
+    )
+    Course.objects.update(enrollment_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moodle_api', '0005_enrollment_user_recent_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='enrollment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='seat_limit',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(count_enrollments, migrations.RunPython.noop),
+    ]
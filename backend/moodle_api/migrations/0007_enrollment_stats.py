@@ -0,0 +1,79 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:45
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Value, When
+from django.db.models.functions import Cast, Coalesce, Substr, TruncDate
+
+# Copia de analytics.py en el momento de esta migración.
+AGE_BANDS = [(18, '<18'), (25, '18-24'), (35, '25-34'), (45, '35-44'), (55, '45-54'), (65, '55-64')]
+OLDEST_BAND = '65+'
+PURPOSE_MAX_LENGTH = 255
+
+
+def build_stats(apps, schema_editor):
+    """Rellena las estadísticas con las matrículas existentes (como ``analytics.rebuild_stats``)."""
+    Enrollment = apps.get_model('moodle_api', 'Enrollment')
+    EnrollmentStat = apps.get_model('moodle_api', 'EnrollmentStat')
+    age_band = Case(
+        When(user__profile__age__isnull=True, then=Value('')),
+        *[When(user__profile__age__lt=upper, then=Value(label)) for upper, label in AGE_BANDS],
+        default=Value(OLDEST_BAND),
+        output_field=CharField(),
+    )
+    expressions = {
+        'day': Cast(TruncDate('enrolled_at'), CharField()),
+        'country': Coalesce('user__profile__country', Value('')),
+        'age_band': age_band,
+        'purpose': Coalesce(Substr('user__profile__purpose', 1, PURPOSE_MAX_LENGTH), Value('')),
+    }
+    for dimension, expression in expressions.items():
+        grouped = (
+            Enrollment.objects.order_by().annotate(stat_value=expression)
+            .values('course_id', 'stat_value').annotate(n=Count('id'))
+        )
+        rows = (
+            EnrollmentStat(course_id=g['course_id'], dimension=dimension, value=g['stat_value'], count=g['n'])
+            for g in grouped.iterator(chunk_size=1000)
+        )
+        # bulk_create convierte su argumento en lista: se le pasan bloques.
+        while batch := list(islice(rows, 1000)):
+            EnrollmentStat.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moodle_api', '0006_course_enrollment_count_seat_limit'),
+        ('users', '0002_alter_customuser_username'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollmentStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('day', 'Día'), ('country', 'País'), ('age_band', 'Franja de edad'), ('purpose', 'Propósito')], max_length=10)),
+                ('value', models.CharField(blank=True, max_length=255)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['course', 'enrolled_at'], name='enrollment_course_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='enrollmentstat',
+            name='course',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='moodle_api.course'),
+        ),
+        migrations.AddConstraint(
+            model_name='enrollmentstat',
+            constraint=models.UniqueConstraint(fields=('course', 'dimension', 'value'), name='enrollment_stat_unique'),
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+from django.utils.html import strip_tags
+
+FTS_TABLE = 'moodle_api_course_fts'
+PG_VECTOR = "to_tsvector('spanish', coalesce(name, '') || ' ' || coalesce(summary, ''))"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"name, summary, tokenize='unicode61 remove_diacritics 2')"
+        )
+        Course = apps.get_model('moodle_api', 'Course')
+        rows = [(pk, name, strip_tags(summary or '')) for pk, name, summary in
+                Course.objects.values_list('id', 'name', 'summary').iterator()]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, summary) VALUES (%s, %s, %s)', rows)
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS moodle_api_course_search_idx '
+                              f'ON moodle_api_course USING gin ({PG_VECTOR})')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS moodle_api_course_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moodle_api', '0007_enrollment_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
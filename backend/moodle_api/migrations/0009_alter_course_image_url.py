@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moodle_api', '0008_course_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='image_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+    ]
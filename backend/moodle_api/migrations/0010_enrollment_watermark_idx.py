@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moodle_api', '0009_alter_course_image_url'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['enrolled_at', 'id'], name='enrollment_watermark_idx'),
+        ),
+    ]
@@ -8,7 +8,16 @@ class Course(models.Model):
     startdate = models.BigIntegerField(null=True, blank=True)
     enddate = models.BigIntegerField(null=True, blank=True)
     summary = models.TextField()
-    image_url = models.URLField(null=True, blank=True)
+    image_url = models.URLField(max_length=500, null=True, blank=True)
+    # Marca de Moodle de la última modificación; la sincronización solo
+    # reescribe los cursos cuyo timemodified cambió.
+    timemodified = models.BigIntegerField(null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    # Contador desnormalizado de matrículas, actualizado en la misma
+    # transacción que cada alta (ver enrollment.py) y reparable con
+    # ``reconcile_enrollment_counts``. ``seat_limit`` vacío = sin límite.
+    enrollment_count = models.PositiveIntegerField(default=0)
+    seat_limit = models.PositiveIntegerField(null=True, blank=True)
 
 class Enrollment(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -16,4 +25,74 @@ class Enrollment(models.Model):
     enrolled_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('user', 'course')
\ No newline at end of file
+        unique_together = ('user', 'course')
+        indexes = [
+            # Listado paginado por cursor de "mis cursos".
+            models.Index(fields=['user', '-enrolled_at', '-id'], name='enrollment_user_recent_idx'),
+            # Reconstrucción de estadísticas y exportaciones por curso y fecha.
+            models.Index(fields=['course', 'enrolled_at'], name='enrollment_course_date_idx'),
+            # Exportación incremental de todos los cursos por marca de agua (fecha, id).
+            models.Index(fields=['enrolled_at', 'id'], name='enrollment_watermark_idx'),
+        ]
+
+
+class EnrollmentStat(models.Model):
+    """
+    Resumen de matrículas por curso y dimensión (día, país, franja de edad o
+    propósito). Se mantiene de forma incremental en cada alta (ver
+    analytics.py) y se reconstruye con ``rebuild_enrollment_stats``.
+    """
+
+    DAY = 'day'
+    COUNTRY = 'country'
+    AGE_BAND = 'age_band'
+    PURPOSE = 'purpose'
+    DIMENSION_CHOICES = [
+        (DAY, 'Día'),
+        (COUNTRY, 'País'),
+        (AGE_BAND, 'Franja de edad'),
+        (PURPOSE, 'Propósito'),
+    ]
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='stats')
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    # Vacío cuando el usuario no tiene perfil o no indicó el dato.
+    value = models.CharField(max_length=255, blank=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'dimension', 'value'], name='enrollment_stat_unique'),
+        ]
+
+class ExportJob(models.Model):
+    """Exportación CSV en segundo plano; ``course`` vacío significa todos los cursos."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pendiente'),
+        (RUNNING, 'En curso'),
+        (DONE, 'Terminada'),
+        (FAILED, 'Fallida'),
+    ]
+
+    course = models.ForeignKey(Course, null=True, blank=True, on_delete=models.CASCADE)
+    requested_by = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Número de matrículas y última matrícula al crear el trabajo: si no
+    # cambian, un trabajo reciente terminado puede reutilizarse.
+    fingerprint = models.CharField(max_length=100, db_index=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    rows_written = models.PositiveIntegerField(default=0)
+    # Punto de reanudación: última matrícula escrita y tamaño del fichero en ese momento.
+    last_enrollment_id = models.BigIntegerField(default=0)
+    bytes_written = models.BigIntegerField(default=0)
+    max_enrollment_id = models.BigIntegerField(default=0)
+    file_name = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,49 @@
+# moodle_api/pagination.py
+"""
+Paginación por cursor (keyset) para listados ordenados por fecha.
+
+El cursor codifica la fecha y el id de la última fila entregada, así que
+cada página es una consulta por índice que no recorre las anteriores, a
+diferencia de ``OFFSET``.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    raw = json.dumps([timestamp.isoformat(), pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, pk = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Cursor no válido') from e
+
+
+def paginate_desc(queryset, field, cursor=None, limit=20):
+    """
+    Devuelve ``(filas, siguiente_cursor)`` recorriendo ``queryset`` de más
+    reciente a más antiguo según ``field`` y, a igualdad, por ``id``.
+    ``queryset`` debe ser un ``values()`` que incluya ``field`` e ``id``.
+    """
+    queryset = queryset.order_by(f'-{field}', '-id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'id__lt': pk}))
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][field], rows[-1]['id'])
+    return rows, next_cursor
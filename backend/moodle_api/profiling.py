@@ -0,0 +1,289 @@
+# moodle_api/profiling.py
+"""
+Perfilado de peticiones bajo demanda.
+
+Con ``PROFILING_ENABLED`` el ``ProfilingMiddleware`` perfila una fracción
+``PROFILING_SAMPLE_RATE`` de las peticiones y todas las del personal que
+envíen la cabecera ``X-Profile``. Desactivado, el middleware se retira de la
+cadena y el observador de consultas ni siquiera se instala: no cuesta nada.
+
+Un hilo muestrea cada ``PROFILING_INTERVAL`` segundos la pila de los hilos
+que atienden la petición y cuenta las pilas en formato «collapsed» (una
+línea ``marco;marco;marco N`` por pila, el que leen flamegraph.pl y
+speedscope). Mientras un hilo ejecuta una consulta SQL o una llamada a
+Moodle se añade a su pila un marco ficticio (``[sql] SELECT
+moodle_api_course``, ``[moodle] core_enrol_get_users_courses``), y además se
+cronometran con exactitud para el resumen de cada perfil.
+
+En las vistas síncronas se muestrea el hilo de la petición. En las
+asíncronas el hilo del event loop se comparte con otras peticiones, así que
+no se muestrea: se muestrea el hilo de ``sync_to_async`` de la petición
+(Django dedica uno a cada petición ASGI), que se registra en el perfil al
+ejecutar su primera consulta. Las llamadas a Moodle hechas desde el loop
+solo aparecen en el resumen cronometrado.
+
+Cada perfil se guarda en ``PROFILING_ROOT`` como ``<id>.collapsed`` más un
+``<id>.json`` con el resumen; se conservan los ``PROFILING_MAX_PROFILES``
+más recientes.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+# Consultas y funciones de Moodle que se detallan en el resumen de cada perfil.
+SUMMARY_TOP = 20
+
+_PROFILE_ID_RE = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+_SQL_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+["`]?(\w+)', re.IGNORECASE)
+
+# Perfil de la petición en curso. Se propaga a los hilos de sync_to_async.
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    # co_qualname solo existe desde Python 3.11.
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class Profile:
+    """
+    Perfil de una petición. ``thread_id`` es el hilo a muestrear (``None`` en
+    las vistas asíncronas: los hilos se registran con ``attach``).
+    """
+
+    def __init__(self, thread_id, trigger, interval=None, max_duration=None):
+        self.created = timezone.now()
+        # Los identificadores ordenan cronológicamente (al microsegundo).
+        self.id = f"{self.created.strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        self.trigger = trigger
+        self.asynchronous = thread_id is None
+        self.thread_ids = set() if self.asynchronous else {thread_id}
+        self.interval = interval or settings.PROFILING_INTERVAL
+        self.max_duration = max_duration or settings.PROFILING_MAX_DURATION
+        self.stacks = Counter()
+        self.queries = {}
+        self.moodle_calls = {}
+        # Marco ficticio de la operación en curso en cada hilo (consulta o llamada a Moodle).
+        self.activity = {}
+        self.duration = None
+        self._start = time.perf_counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f'profiler-{self.id}', daemon=True)
+        self._sampler.start()
+
+    def _run(self):
+        deadline = self._start + self.max_duration
+        while not self._stop.wait(self.interval):
+            if time.perf_counter() > deadline:
+                # Una respuesta en streaming que nunca se recorre no detiene el
+                # perfil: se corta aquí para no muestrear indefinidamente.
+                break
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for thread_id in list(self.thread_ids):
+            frame = frames.get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if not stack:
+                continue
+            stack.reverse()
+            activity = self.activity.get(thread_id)
+            if activity is not None:
+                stack.append(activity)
+            self.stacks[';'.join(stack)] += 1
+
+    def attach(self):
+        """Muestrea también el hilo actual (el de ``sync_to_async`` de la petición)."""
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_ids:
+            self.thread_ids = self.thread_ids | {thread_id}
+
+    def stop(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._start
+            self._stop.set()
+            self._sampler.join()
+        return self.duration
+
+    @contextmanager
+    def recording(self):
+        token = current_profile.set(self)
+        try:
+            yield self
+        finally:
+            current_profile.reset(token)
+
+    @contextmanager
+    def span(self, frame, totals, key):
+        thread_id = threading.get_ident()
+        previous = self.activity.get(thread_id)
+        self.activity[thread_id] = frame
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.activity[thread_id] = previous
+            total = totals.setdefault(key, [0, 0.0])
+            total[0] += 1
+            total[1] += time.perf_counter() - start
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def summary(self, **extra):
+        return {
+            'id': self.id,
+            'created': self.created.isoformat(),
+            'trigger': self.trigger,
+            'asynchronous': self.asynchronous,
+            **extra,
+            'duration': round(self.duration, 6),
+            'interval': self.interval,
+            'samples': sum(self.stacks.values()),
+            'sql': _totals(self.queries, 'statement'),
+            'moodle': _totals(self.moodle_calls, 'wsfunction'),
+        }
+
+
+def _totals(totals, label):
+    items = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        'count': sum(count for count, _ in totals.values()),
+        'seconds': round(sum(seconds for _, seconds in totals.values()), 6),
+        'top': [{label: key, 'count': count, 'seconds': round(seconds, 6)}
+                for key, (count, seconds) in items[:SUMMARY_TOP]],
+    }
+
+
+def sql_shape(sql):
+    """Resume una sentencia como verbo y tabla (``SELECT moodle_api_course``)."""
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else '?'
+    match = _SQL_TABLE_RE.search(sql)
+    return f'{verb} {match.group(1)}' if match else verb
+
+
+def _profile_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    if profile.asynchronous:
+        profile.attach()
+    shape = sql_shape(sql)
+    with profile.span(f'[sql] {shape}', profile.queries, shape):
+        return execute(sql, params, many, context)
+
+
+def _install_query_observer(sender, connection, **kwargs):
+    if _profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_profile_query)
+
+
+def install():
+    """Instala el observador de consultas; lo llama el middleware solo si el perfilado está activo."""
+    connection_created.connect(_install_query_observer, dispatch_uid='moodle_api.profiling')
+    if connection.connection is not None:
+        _install_query_observer(None, connection)
+
+
+def moodle_call(wsfunction):
+    """Contexto que atribuye al perfil en curso (si lo hay) una llamada a Moodle."""
+    profile = current_profile.get()
+    if profile is None:
+        return nullcontext()
+    return profile.span(f'[moodle] {wsfunction}', profile.moodle_calls, wsfunction)
+
+
+def _root():
+    return Path(settings.PROFILING_ROOT)
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def save(profile, **extra):
+    """Guarda ``profile`` (ya detenido) y descarta los perfiles más antiguos."""
+    root = _root()
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        _write_atomic(root / f'{profile.id}.collapsed', profile.collapsed().encode())
+        # El resumen va el último: solo se listan los perfiles completos.
+        _write_atomic(root / f'{profile.id}.json', json.dumps(profile.summary(**extra)).encode())
+    except OSError:
+        logger.exception('No se pudo guardar el perfil %s', profile.id)
+        return
+    evict(settings.PROFILING_MAX_PROFILES)
+
+
+def _profile_ids():
+    try:
+        names = os.listdir(_root())
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith('.json') and _PROFILE_ID_RE.match(name[:-5]))
+
+
+def evict(max_profiles):
+    """Borra los perfiles más antiguos hasta dejar ``max_profiles``. Devuelve cuántos borró."""
+    ids = _profile_ids()
+    stale = ids[:max(0, len(ids) - max_profiles)]
+    for profile_id in stale:
+        for suffix in ('.json', '.collapsed'):
+            try:
+                os.unlink(_root() / f'{profile_id}{suffix}')
+            except FileNotFoundError:
+                pass
+    return len(stale)
+
+
+def list_profiles():
+    """Resúmenes de los perfiles guardados, del más reciente al más antiguo."""
+    summaries = []
+    for profile_id in reversed(_profile_ids()):
+        try:
+            summaries.append(json.loads((_root() / f'{profile_id}.json').read_bytes()))
+        except (FileNotFoundError, ValueError):
+            # Desalojado o a medio escribir por otro worker.
+            continue
+    return summaries
+
+
+def collapsed_path(profile_id):
+    """Ruta del fichero collapsed de ``profile_id``, o ``None`` si no existe."""
+    if not _PROFILE_ID_RE.match(profile_id):
+        return None
+    path = _root() / f'{profile_id}.collapsed'
+    return path if path.exists() else None
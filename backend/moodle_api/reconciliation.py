@@ -0,0 +1,210 @@
+# moodle_api/reconciliation.py
+"""
+Reconciliación de las matrículas locales con las de Moodle.
+
+Los cursos se procesan por bloques de ``MOODLE_RECONCILE_CHUNK_SIZE``. Para
+cada bloque se descargan las listas de alumnos con
+``core_enrol_get_enrolled_users`` (paginadas y en paralelo, con como mucho
+``MOODLE_RECONCILE_CONCURRENCY`` llamadas a la vez) y se comparan con las
+matrículas locales como conjuntos de correos:
+
+- Matriculados en Moodle y no aquí: se crean las matrículas locales (si el
+  usuario existe localmente).
+- Matriculados aquí y no en Moodle: por defecto solo se cuentan, porque
+  ``EnrollUserView`` matricula localmente sin avisar a Moodle y son
+  matrículas legítimas. Con ``push=True`` se matriculan en Moodle con
+  ``enrol_manual_enrol_users``; con ``delete=True`` se borran las locales.
+
+Solo se guarda en memoria un bloque a la vez, así que una ejecución nocturna
+sobre miles de cursos usa memoria acotada. Un curso cuya lista no se pudo
+descargar o llegó malformada se omite entero (cuenta en ``failed``): nunca
+se tocan matrículas por un fallo de Moodle.
+"""
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.functions import Lower
+
+from .client import MoodleError, get_client
+from .enrollment import ENROLLED, bulk_enroll, bulk_unenroll
+from .models import Course, Enrollment
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Correos por consulta al buscar usuarios locales (límite de parámetros de SQLite).
+LOOKUP_CHUNK_SIZE = 5000
+# Correos por llamada a core_user_get_users_by_field y matrículas por
+# llamada a enrol_manual_enrol_users al enviar a Moodle.
+PUSH_BATCH_SIZE = 100
+
+
+def fetch_roster(moodle_course_id, page_size=None):
+    """Devuelve el conjunto de correos (en minúsculas) matriculados en el curso de Moodle."""
+    page_size = page_size or settings.MOODLE_RECONCILE_PAGE_SIZE
+    client = get_client()
+    emails = set()
+    start = 0
+    while True:
+        page = client.call(
+            'core_enrol_get_enrolled_users',
+            courseid=moodle_course_id,
+            options=[
+                {'name': 'onlyactive', 'value': 1},
+                {'name': 'userfields', 'value': 'id,email'},
+                {'name': 'limitfrom', 'value': start},
+                {'name': 'limitnumber', 'value': page_size},
+            ],
+        ) or []
+        try:
+            if not isinstance(page, list):
+                raise TypeError(f'se esperaba una lista y llegó {type(page).__name__}')
+            emails.update(user['email'].lower() for user in page if user.get('email'))
+        except (AttributeError, KeyError, TypeError) as e:
+            # Una respuesta malformada invalida solo la lista de este curso.
+            raise MoodleError(f'Lista de alumnos malformada del curso {moodle_course_id}: {e}') from e
+        if len(page) < page_size:
+            return emails
+        start += page_size
+
+
+def fetch_rosters(moodle_course_ids, concurrency=None, page_size=None):
+    """
+    Descarga en paralelo las listas de ``moodle_course_ids``. Devuelve
+    ``{moodle_id: set(correos)}`` solo con los cursos que se pudieron leer.
+    """
+    concurrency = concurrency or settings.MOODLE_RECONCILE_CONCURRENCY
+    rosters = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(fetch_roster, moodle_id, page_size): moodle_id for moodle_id in moodle_course_ids}
+        for future, moodle_id in futures.items():
+            try:
+                rosters[moodle_id] = future.result()
+            except MoodleError as e:
+                logger.warning('No se pudo leer la lista del curso %s de Moodle: %s', moodle_id, e)
+    return rosters
+
+
+def _local_users(emails):
+    """``{correo en minúsculas: user_id}`` de los usuarios locales con esos correos."""
+    emails = list(emails)
+    users = {}
+    for start in range(0, len(emails), LOOKUP_CHUNK_SIZE):
+        users.update(
+            User.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in=emails[start:start + LOOKUP_CHUNK_SIZE])
+            .values_list('email_lower', 'pk')
+        )
+    return users
+
+
+def _course_chunks(moodle_ids, chunk_size):
+    courses = Course.objects.filter(synced_at__isnull=False)
+    if moodle_ids is not None:
+        courses = courses.filter(moodle_id__in=moodle_ids)
+    last_pk = 0
+    while True:
+        chunk = list(courses.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'moodle_id')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1][0]
+
+
+def reconcile_enrollments(moodle_ids=None, push=False, delete=False, dry_run=False, chunk_size=None,
+                          concurrency=None, page_size=None):
+    """
+    Reconcilia las matrículas de los cursos sincronizados (todos o los de
+    ``moodle_ids``). Devuelve un ``Counter`` con ``courses``, ``failed``,
+    ``added``, ``removed``, ``pushed``, ``local_only`` (matrículas locales
+    que no están en Moodle y se dejan como están) y ``unmatched`` (correos de
+    un lado sin usuario en el otro). Con ``dry_run`` solo cuenta los cambios.
+    """
+    if push and delete:
+        raise ValueError('push y delete son incompatibles')
+    chunk_size = chunk_size or settings.MOODLE_RECONCILE_CHUNK_SIZE
+    report = Counter()
+    for chunk in _course_chunks(moodle_ids, chunk_size):
+        rosters = fetch_rosters([moodle_id for _, moodle_id in chunk], concurrency, page_size)
+        report['courses'] += len(rosters)
+        report['failed'] += len(chunk) - len(rosters)
+        courses = {pk: moodle_id for pk, moodle_id in chunk if moodle_id in rosters}
+        if courses:
+            _reconcile_chunk(courses, rosters, push, delete, dry_run, report)
+    return report
+
+
+def _reconcile_chunk(courses, rosters, push, delete, dry_run, report):
+    local = {pk: {} for pk in courses}
+    for course_id, user_id, email in (
+        Enrollment.objects.filter(course_id__in=courses).annotate(email_lower=Lower('user__email'))
+        .values_list('course_id', 'user_id', 'email_lower').iterator(chunk_size=LOOKUP_CHUNK_SIZE)
+    ):
+        local[course_id][email] = user_id
+
+    users = _local_users(set().union(*(rosters[moodle_id] for moodle_id in courses.values())))
+    to_add, to_remove, to_push = [], [], []
+    for course_id, moodle_id in courses.items():
+        remote, enrolled = rosters[moodle_id], local[course_id]
+        for email in remote - enrolled.keys():
+            if email in users:
+                to_add.append((users[email], course_id))
+            else:
+                report['unmatched'] += 1
+        for email in enrolled.keys() - remote:
+            if push:
+                to_push.append((moodle_id, email))
+            elif delete:
+                to_remove.append((enrolled[email], course_id))
+            else:
+                report['local_only'] += 1
+
+    if dry_run:
+        report['added'] += len(to_add)
+        report['removed'] += len(to_remove)
+        report['pushed'] += len(to_push)
+        return
+    results = bulk_enroll(to_add, enforce_seat_limit=False)
+    report['added'] += sum(1 for status in results.values() if status == ENROLLED)
+    report['removed'] += bulk_unenroll(to_remove)
+    if to_push:
+        push_enrolments(to_push, report)
+
+
+def push_enrolments(enrolments, report):
+    """
+    Matricula en Moodle los pares ``(moodle_course_id, correo)`` como
+    alumnos. Los correos sin cuenta en Moodle se cuentan en ``unmatched``.
+    """
+    client = get_client()
+    emails = sorted({email for _, email in enrolments})
+    moodle_users = {}
+    for start in range(0, len(emails), PUSH_BATCH_SIZE):
+        batch = emails[start:start + PUSH_BATCH_SIZE]
+        try:
+            found = client.call('core_user_get_users_by_field', field='email', values=batch)
+        except MoodleError as e:
+            logger.warning('No se pudieron buscar %s usuarios en Moodle: %s', len(batch), e)
+            continue
+        moodle_users.update((user['email'].lower(), user['id']) for user in found or [] if user.get('email'))
+
+    pending = []
+    for moodle_course_id, email in enrolments:
+        if email in moodle_users:
+            pending.append({'roleid': settings.MOODLE_STUDENT_ROLE_ID, 'userid': moodle_users[email],
+                            'courseid': moodle_course_id})
+        else:
+            report['unmatched'] += 1
+    for start in range(0, len(pending), PUSH_BATCH_SIZE):
+        batch = pending[start:start + PUSH_BATCH_SIZE]
+        try:
+            client.call('enrol_manual_enrol_users', enrolments=batch)
+        except MoodleError as e:
+            logger.warning('No se pudieron enviar %s matrículas a Moodle: %s', len(batch), e)
+            report['push_failed'] += len(batch)
+        else:
+            report['pushed'] += len(batch)
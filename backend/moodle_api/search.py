@@ -0,0 +1,131 @@
+# moodle_api/search.py
+"""
+Búsqueda de texto completo en el catálogo local de cursos.
+
+Con SQLite se usa una tabla virtual FTS5 (``moodle_api_course_fts``) con el
+nombre y el resumen (sin HTML) de cada curso, cuyo ``rowid`` es el id del
+``Course``. Se mantiene al día con las señales de guardado y borrado y
+desde ``upsert_courses``, que escribe el catálogo con ``bulk_create`` (sin
+señales). Con PostgreSQL se usa ``to_tsvector`` con un índice GIN sobre la
+misma expresión. Con otros motores se recurre a ``icontains``.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.html import strip_tags
+
+from .models import Course
+
+FTS_TABLE = 'moodle_api_course_fts'
+# Más peso a las coincidencias en el nombre que en el resumen.
+NAME_WEIGHT, SUMMARY_WEIGHT = 10.0, 1.0
+PG_VECTOR = "to_tsvector('spanish', coalesce(name, '') || ' ' || coalesce(summary, ''))"
+INDEX_CHUNK_SIZE = 500
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _terms(query):
+    return WORD_RE.findall(query.lower())[:10]
+
+
+def _plain(summary):
+    return strip_tags(summary or '')
+
+
+def index_courses(rows):
+    """(Re)indexa los cursos ``rows``: tuplas ``(id, name, summary)``."""
+    if connection.vendor != 'sqlite':
+        return
+    rows = list(rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INDEX_CHUNK_SIZE):
+            chunk = rows[start:start + INDEX_CHUNK_SIZE]
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(chunk))})',
+                [pk for pk, _, _ in chunk],
+            )
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, summary) VALUES (%s, %s, %s)',
+                [(pk, name, _plain(summary)) for pk, name, summary in chunk],
+            )
+
+
+def unindex_courses(ids):
+    if connection.vendor != 'sqlite' or not ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(ids))})', list(ids))
+
+
+def rebuild_index():
+    """Vacía el índice y lo vuelve a llenar con todo el catálogo. Devuelve los cursos indexados."""
+    if connection.vendor != 'sqlite':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    rows = list(Course.objects.values_list('id', 'name', 'summary').iterator(chunk_size=INDEX_CHUNK_SIZE))
+    index_courses(rows)
+    return len(rows)
+
+
+@receiver(post_save, sender=Course)
+def _index_saved_course(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'summary'} & set(update_fields):
+        index_courses([(instance.pk, instance.name, instance.summary)])
+
+
+@receiver(post_delete, sender=Course)
+def _unindex_deleted_course(sender, instance, **kwargs):
+    unindex_courses([instance.pk])
+
+
+def search_course_ids(query, category=None, limit=20, offset=0):
+    """
+    Devuelve los ids de ``Course`` que contienen todas las palabras de
+    ``query`` (cada una como prefijo), de más a menos relevante.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        sql = (
+            f'SELECT c.id FROM {FTS_TABLE} f JOIN moodle_api_course c ON c.id = f.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s'
+        )
+        params = [match]
+        if category is not None:
+            sql += ' AND c.category = %s'
+            params.append(category)
+        sql += f' ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, {SUMMARY_WEIGHT}), c.id LIMIT %s OFFSET %s'
+    elif connection.vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        sql = f"SELECT id FROM moodle_api_course WHERE {PG_VECTOR} @@ to_tsquery('spanish', %s)"
+        params = [tsquery]
+        if category is not None:
+            sql += ' AND category = %s'
+            params.append(category)
+        sql += f" ORDER BY ts_rank({PG_VECTOR}, to_tsquery('spanish', %s)) DESC, id LIMIT %s OFFSET %s"
+        params.append(tsquery)
+    else:
+        courses = Course.objects.all()
+        for term in terms:
+            courses = courses.filter(Q(name__icontains=term) | Q(summary__icontains=term))
+        if category is not None:
+            courses = courses.filter(category=category)
+        return list(courses.order_by('name', 'id').values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_courses(query, category=None, limit=20, offset=0):
+    """Como ``search_course_ids`` pero devuelve los ``Course`` en orden de relevancia."""
+    ids = search_course_ids(query, category, limit, offset)
+    courses = Course.objects.in_bulk(ids)
+    return [courses[pk] for pk in ids if pk in courses]
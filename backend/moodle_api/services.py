@@ -0,0 +1,344 @@
+# moodle_api/services.py
+"""Operaciones de alto nivel sobre Moodle compartidas por las vistas."""
+import hashlib
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .client import MoodleError, MoodleUnavailable, get_async_client, get_client
+from .images import proxy_url
+from .loaders import course_loader
+from .models import Course
+from .search import index_courses
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Coalescencia de las descargas de un mismo curso entre peticiones y workers.
+course_fetches = SingleFlight('course')
+
+# Campos de Course que se copian desde Moodle en cada sincronización.
+SYNCED_COURSE_FIELDS = [
+    'name', 'summary', 'category', 'startdate', 'enddate', 'image_url', 'timemodified', 'synced_at',
+]
+
+
+def _site_info_key():
+    # El token forma parte de la clave: si cambia, la entrada anterior deja de usarse.
+    token = (settings.MOODLE_TOKEN or '').encode()
+    return 'moodle:site_info:' + hashlib.sha256(token).hexdigest()[:16]
+
+
+def get_site_info(refresh=False):
+    """
+    Devuelve ``core_webservice_get_site_info`` del token configurado.
+
+    La respuesta se guarda en la caché de Django durante
+    ``MOODLE_SITE_INFO_TTL`` segundos, así que con un backend compartido
+    todos los workers reutilizan la misma entrada.
+    """
+    key = _site_info_key()
+    if not refresh:
+        site_info = cache.get(key)
+        if site_info is not None:
+            return site_info
+    site_info = get_client().call('core_webservice_get_site_info', lazy=True)
+    cache.set(key, site_info, settings.MOODLE_SITE_INFO_TTL)
+    _remember(key, site_info)
+    return site_info
+
+
+async def aget_site_info(refresh=False):
+    """Versión asíncrona de ``get_site_info`` (misma entrada de caché)."""
+    key = _site_info_key()
+    if not refresh:
+        site_info = await cache.aget(key)
+        if site_info is not None:
+            return site_info
+    site_info = await get_async_client().call('core_webservice_get_site_info', lazy=True)
+    await cache.aset(key, site_info, settings.MOODLE_SITE_INFO_TTL)
+    await cache.aset(_stale_key(key), site_info, settings.MOODLE_STALE_TTL)
+    return site_info
+
+
+def invalidate_site_info():
+    cache.delete(_site_info_key())
+
+
+# Última respuesta buena de cada lectura, para servirla (marcada como
+# obsoleta) mientras Moodle no responde o su circuito está abierto.
+
+def _stale_key(key):
+    return 'moodle:stale:' + key
+
+
+def _remember(key, data):
+    cache.set(_stale_key(key), data, settings.MOODLE_STALE_TTL)
+
+
+async def _arefresh_in_background(key, refresh):
+    """
+    Ejecuta ``refresh`` en un hilo aparte, como mucho una vez cada
+    ``MOODLE_STALE_REFRESH_INTERVAL`` segundos por clave entre todos los
+    workers. Mientras el circuito siga abierto el intento falla al instante.
+    La marca se toma con ``cache.aadd`` para no bloquear el event loop con
+    una caché de red.
+    """
+    if not await cache.aadd(f'moodle:refreshing:{key}', 1, settings.MOODLE_STALE_REFRESH_INTERVAL):
+        return
+    threading.Thread(target=_run_refresh, args=(key, refresh), daemon=True).start()
+
+
+def _run_refresh(key, refresh):
+    try:
+        refresh()
+    except MoodleError as e:
+        logger.info('Moodle sigue sin responder al refrescar %s: %s', key, e)
+
+
+async def aget_site_info_or_stale():
+    """
+    Como ``aget_site_info``, pero si Moodle no está disponible devuelve la
+    última respuesta buena. Devuelve ``(site_info, stale)``; sin copia previa
+    se propaga ``MoodleUnavailable``.
+    """
+    try:
+        return await aget_site_info(), False
+    except MoodleUnavailable:
+        key = _site_info_key()
+        site_info = await cache.aget(_stale_key(key))
+        if site_info is None:
+            raise
+        await _arefresh_in_background(key, lambda: get_site_info(refresh=True))
+        return site_info, True
+
+
+def _users_courses_key(userid):
+    return f'moodle:users_courses:{userid}'
+
+
+def get_users_courses(userid):
+    """Cursos en los que está matriculado ``userid`` según Moodle."""
+    courses = get_client().call('core_enrol_get_users_courses', userid=userid, lazy=True)
+    _remember(_users_courses_key(userid), courses)
+    return courses
+
+
+async def aget_users_courses_or_stale(userid):
+    """
+    Versión asíncrona de ``get_users_courses`` con respaldo: si Moodle no está
+    disponible se devuelve la última respuesta buena o, si no la hay, el
+    catálogo local. Devuelve ``(courses, stale)``.
+    """
+    key = _users_courses_key(userid)
+    try:
+        courses = await get_async_client().call('core_enrol_get_users_courses', userid=userid, lazy=True)
+    except MoodleUnavailable:
+        courses = await cache.aget(_stale_key(key))
+        if courses is None:
+            courses = await alocal_courses()
+        await _arefresh_in_background(key, lambda: get_users_courses(userid))
+        return courses, True
+    await cache.aset(_stale_key(key), courses, settings.MOODLE_STALE_TTL)
+    return courses, False
+
+
+def course_payload(course):
+    """Representa un ``Course`` local con los campos que devuelve Moodle."""
+    return {
+        'id': course.moodle_id,
+        'fullname': course.name,
+        'summary': course.summary,
+        'category': course.category,
+        'startdate': course.startdate,
+        'enddate': course.enddate,
+        'enrollment_count': course.enrollment_count,
+        'seat_limit': course.seat_limit,
+        'courseimage': proxy_url(course),
+    }
+
+
+async def alocal_courses():
+    """Cursos sincronizados del catálogo local (sin los registros provisionales)."""
+    return [
+        course_payload(course)
+        async for course in Course.objects.filter(synced_at__isnull=False).order_by('name')
+    ]
+
+
+def course_fields_from_moodle(data):
+    """Traduce un curso de ``core_course_get_courses`` a campos de ``Course``."""
+    return {
+        'name': data['fullname'][:255],
+        'summary': data.get('summary') or '',
+        'category': data.get('categoryid'),
+        'startdate': data.get('startdate'),
+        'enddate': data.get('enddate'),
+        'image_url': _overview_image(data),
+        'timemodified': data.get('timemodified'),
+    }
+
+
+def _overview_image(data):
+    # La imagen del curso es el primer fichero de resumen que sea una imagen.
+    for file in data.get('overviewfiles') or []:
+        if (file.get('mimetype') or 'image/').startswith('image/') and file.get('fileurl'):
+            return file['fileurl']
+    return None
+
+
+def _without_site_course(data):
+    # Moodle expone la portada del sitio como un curso con formato ``site``.
+    return [c for c in data if c.get('format') != 'site']
+
+
+def fetch_courses(course_ids=None):
+    """
+    Pide cursos a Moodle. Sin ``course_ids`` devuelve el catálogo completo;
+    con ids los agrupa en llamadas multi-id a través de ``course_loader``.
+    """
+    if course_ids is None:
+        data = get_client().call('core_course_get_courses')
+    else:
+        data = list(course_loader.load_many(course_ids).values())
+    return _without_site_course(data)
+
+
+def upsert_courses(courses_data, batch_size=500, force=False):
+    """
+    Inserta o actualiza en bloque los cursos recibidos de Moodle.
+
+    Solo escribe los cursos nuevos o cuyo ``timemodified`` cambió respecto a
+    la copia local, salvo que ``force`` sea verdadero. Devuelve el número de
+    cursos escritos y el de cursos omitidos por no haber cambiado.
+    """
+    written = skipped = 0
+    now = timezone.now()
+    for start in range(0, len(courses_data), batch_size):
+        batch = courses_data[start:start + batch_size]
+        known = dict(
+            Course.objects.filter(moodle_id__in=[c['id'] for c in batch])
+            .values_list('moodle_id', 'timemodified')
+        )
+        changed = []
+        for data in batch:
+            fields = course_fields_from_moodle(data)
+            if not force and data['id'] in known and known[data['id']] == fields['timemodified']:
+                skipped += 1
+                continue
+            changed.append(Course(moodle_id=data['id'], synced_at=now, **fields))
+        if changed:
+            Course.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['moodle_id'],
+                update_fields=SYNCED_COURSE_FIELDS,
+            )
+            # bulk_create no envía señales: el índice de búsqueda se actualiza aquí.
+            index_courses(
+                Course.objects.filter(moodle_id__in=[c.moodle_id for c in changed])
+                .values_list('id', 'name', 'summary')
+            )
+            written += len(changed)
+    return written, skipped
+
+
+def _placeholder_fields(moodle_id, defaults):
+    return {'name': f'Curso {moodle_id}', 'summary': '', **(defaults or {})}
+
+
+def _fields_from_fetch(data):
+    return {**course_fields_from_moodle(data), 'synced_at': timezone.now()}
+
+
+def _create_course(moodle_id, fields):
+    try:
+        with transaction.atomic():
+            return Course.objects.create(moodle_id=moodle_id, **fields)
+    except IntegrityError:
+        # Otra petición lo creó mientras consultábamos a Moodle.
+        return Course.objects.get(moodle_id=moodle_id)
+
+
+def get_or_fetch_course(moodle_id, defaults=None):
+    """
+    Devuelve el ``Course`` local para ``moodle_id``.
+
+    Con el catálogo sincronizado nunca se llama a Moodle. Si el curso aún no
+    existe localmente se pide a Moodle una sola vez, aunque lleguen muchas
+    peticiones a la vez (ver ``course_fetches``); si Moodle no responde se
+    guarda un registro provisional con ``defaults`` que completará la próxima
+    sincronización.
+    """
+    course = Course.objects.filter(moodle_id=moodle_id).first()
+    if course is not None:
+        return course
+    return course_fetches.do(moodle_id, lambda: _fetch_course(moodle_id, defaults))
+
+
+def _fetch_course(moodle_id, defaults):
+    # Puede que otro worker lo haya creado mientras esperábamos el cerrojo.
+    course = Course.objects.filter(moodle_id=moodle_id).first()
+    if course is not None:
+        return course
+
+    fields = _placeholder_fields(moodle_id, defaults)
+    try:
+        data = course_loader.load(moodle_id)
+    except MoodleError as e:
+        logger.warning('No se pudo obtener el curso %s de Moodle: %s', moodle_id, e)
+    else:
+        if data:
+            fields = _fields_from_fetch(data)
+    return _create_course(moodle_id, fields)
+
+
+async def aget_or_fetch_course(moodle_id, defaults=None):
+    """Versión asíncrona de ``get_or_fetch_course``."""
+    course = await Course.objects.filter(moodle_id=moodle_id).afirst()
+    if course is not None:
+        return course
+    return await course_fetches.ado(moodle_id, lambda: _afetch_course(moodle_id, defaults))
+
+
+async def _afetch_course(moodle_id, defaults):
+    course = await Course.objects.filter(moodle_id=moodle_id).afirst()
+    if course is not None:
+        return course
+
+    fields = _placeholder_fields(moodle_id, defaults)
+    try:
+        data = await course_loader.aload(moodle_id)
+    except MoodleError as e:
+        logger.warning('No se pudo obtener el curso %s de Moodle: %s', moodle_id, e)
+    else:
+        if data:
+            fields = _fields_from_fetch(data)
+    return await sync_to_async(_create_course)(moodle_id, fields)
+
+
+def resolve_courses(moodle_ids):
+    """
+    Devuelve ``{moodle_id: Course}`` para muchos cursos a la vez.
+
+    Los cursos locales se leen en una consulta y los que faltan se piden a
+    Moodle en llamadas multi-id (una sola salvo que la URL sea demasiado larga). Los cursos que Moodle no conoce (o
+    que no pudieron obtenerse) no aparecen en el resultado.
+    """
+    moodle_ids = set(moodle_ids)
+    courses = Course.objects.in_bulk(moodle_ids, field_name='moodle_id')
+    missing = moodle_ids - courses.keys()
+    if missing:
+        try:
+            fetched = fetch_courses(missing)
+        except MoodleError as e:
+            logger.warning('No se pudieron obtener %s cursos de Moodle: %s', len(missing), e)
+        else:
+            upsert_courses(fetched, force=True)
+            courses.update(Course.objects.in_bulk(missing, field_name='moodle_id'))
+    return courses
@@ -0,0 +1,161 @@
+# moodle_api/singleflight.py
+"""
+Coalescencia de peticiones concurrentes ("single flight").
+
+Cuando varias peticiones necesitan el mismo dato de Moodle a la vez, solo una
+lo pide y el resto espera su resultado. Dentro del proceso se coordina con
+eventos (o futures en código asíncrono) y entre workers con un cerrojo en la
+caché de Django: el worker que consigue el cerrojo publica el resultado en la
+caché y los demás lo recogen de ahí.
+"""
+import asyncio
+import threading
+import time
+import uuid
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave bajo un prefijo ``namespace``."""
+
+    poll_interval = 0.05
+
+    def __init__(self, namespace, lock_timeout=None, wait_timeout=None, result_ttl=None):
+        self.namespace = namespace
+        self._lock_timeout = lock_timeout
+        self._wait_timeout = wait_timeout
+        self._result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._calls = {}
+        # Futures en curso por event loop para el código asíncrono.
+        self._async_calls = weakref.WeakKeyDictionary()
+
+    @property
+    def lock_timeout(self):
+        return self._lock_timeout or settings.MOODLE_SINGLEFLIGHT_LOCK_TIMEOUT
+
+    @property
+    def wait_timeout(self):
+        return self._wait_timeout or settings.MOODLE_SINGLEFLIGHT_WAIT_TIMEOUT
+
+    @property
+    def result_ttl(self):
+        return self._result_ttl or settings.MOODLE_SINGLEFLIGHT_RESULT_TTL
+
+    def _keys(self, key):
+        base = f'singleflight:{self.namespace}:{key}'
+        return base + ':lock', base + ':result'
+
+    def do(self, key, fn):
+        """Ejecuta ``fn()`` una sola vez por ``key`` entre todos los llamantes concurrentes."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _do_shared(self, key, fn):
+        lock_key, result_key = self._keys(key)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, self.lock_timeout):
+                try:
+                    cache.delete(result_key)
+                    result = fn()
+                    cache.set(result_key, result, self.result_ttl)
+                    return result
+                finally:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+
+            # Otro worker está pidiendo el mismo dato: esperamos su resultado.
+            while time.monotonic() < deadline:
+                result = cache.get(result_key, _MISSING)
+                if result is not _MISSING:
+                    return result
+                if cache.get(lock_key) is None:
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                # El otro worker tarda demasiado; no bloqueamos más la petición.
+                return fn()
+
+    async def ado(self, key, fn):
+        """Versión asíncrona de ``do``: ``fn`` es una función que devuelve una corrutina."""
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await self._ado_shared(key, fn)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Evita el aviso "exception was never retrieved" si nadie esperaba.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+    async def _ado_shared(self, key, fn):
+        lock_key, result_key = self._keys(key)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            token = uuid.uuid4().hex
+            if await cache.aadd(lock_key, token, self.lock_timeout):
+                try:
+                    await cache.adelete(result_key)
+                    result = await fn()
+                    await cache.aset(result_key, result, self.result_ttl)
+                    return result
+                finally:
+                    if await cache.aget(lock_key) == token:
+                        await cache.adelete(lock_key)
+
+            while time.monotonic() < deadline:
+                result = await cache.aget(result_key, _MISSING)
+                if result is not _MISSING:
+                    return result
+                if await cache.aget(lock_key) is None:
+                    break
+                await asyncio.sleep(self.poll_interval)
+            else:
+                return await fn()
@@ -1,3 +1,1440 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import gzip
+import importlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
+import requests
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from users.models import CustomUser, UserProfile
+
+from .breaker import CircuitBreaker, breaker
+from .client import (
+    AsyncMoodleClient, MoodleAPIError, MoodleCircuitOpen, MoodleClient, MoodleError, MoodleInvalidToken,
+    MoodleThrottled, MoodleUnavailable, flatten_params,
+)
+from .enrollment import ALREADY_ENROLLED, ENROLLED, bulk_enroll, enroll
+from .models import Course, Enrollment, EnrollmentStat, ExportJob
+from .reconciliation import reconcile_enrollments
+from .services import invalidate_site_info
+from . import benchmark, enrollment, metrics
+from .fake_moodle import FakeMoodleServer
+from .groupcommit import EnrollmentQueue, enrollment_queue
+from . import images, jsoncodec, profiling, throttle
+from .admission import AdmissionController, TokenBucket, admission_control
+from .jobs import claim_job, export_path, run_job
+from .loaders import CourseLoader
+from .middleware import ProfilingMiddleware
+from .singleflight import SingleFlight
+
+
+def fake_response(payload=None, status=200):
+    return mock.Mock(status_code=status, content=json.dumps(payload).encode())
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+class MoodleClientTests(SimpleTestCase):
+    def make_client(self, **kwargs):
+        kwargs.setdefault('retry_backoff', 0)
+        return MoodleClient(**kwargs)
+
+    def test_flatten_params(self):
+        self.assertEqual(
+            flatten_params({'courseids': [4, 7], 'enrolments': [{'roleid': 5, 'userid': 2}]}),
+            {'courseids[0]': 4, 'courseids[1]': 7,
+             'enrolments[0][roleid]': 5, 'enrolments[0][userid]': 2},
+        )
+
+    def test_call_sends_token_and_timeout(self):
+        client = self.make_client(connect_timeout=1, read_timeout=2)
+        with mock.patch.object(client.session, 'get', return_value=fake_response({'userid': 3})) as get:
+            self.assertEqual(client.call('core_webservice_get_site_info'), {'userid': 3})
+        _, kwargs = get.call_args
+        self.assertEqual(kwargs['timeout'], (1, 2))
+        self.assertEqual(kwargs['params']['wstoken'], 't0k3n')
+        self.assertEqual(kwargs['params']['wsfunction'], 'core_webservice_get_site_info')
+
+    def test_error_payload_raises_typed_exception(self):
+        client = self.make_client()
+        payload = {'exception': 'moodle_exception', 'errorcode': 'invalidtoken', 'message': 'Token no válido'}
+        with mock.patch.object(client.session, 'get', return_value=fake_response(payload)):
+            with self.assertRaises(MoodleInvalidToken) as ctx:
+                client.call('core_webservice_get_site_info')
+        self.assertEqual(ctx.exception.errorcode, 'invalidtoken')
+        self.assertIsInstance(ctx.exception, MoodleAPIError)
+
+    def test_download_sends_token_and_limits_size(self):
+        client = self.make_client()
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [b'a' * 10, b'b' * 10]
+        with mock.patch.object(client.session, 'get', return_value=response) as get:
+            self.assertEqual(client.download('http://moodle.test/pluginfile.php/1/x.png', 20), b'a' * 10 + b'b' * 10)
+            with self.assertRaisesMessage(MoodleError, 'supera el máximo'):
+                client.download('http://moodle.test/pluginfile.php/1/x.png', 15)
+        self.assertEqual(get.call_args.kwargs['params'], {'token': 't0k3n'})
+
+    def test_download_never_sends_the_token_to_another_site(self):
+        client = self.make_client()
+        with mock.patch.object(client.session, 'get') as get:
+            for url in ('http://atacante.test/pluginfile.php/1/x.png', 'https://moodle.test/pluginfile.php/1/x.png',
+                        'http://moodle.test:8080/pluginfile.php/1/x.png', 'file:///etc/passwd'):
+                with self.assertRaisesMessage(MoodleError, 'no pertenece al sitio de Moodle'):
+                    client.download(url, 20)
+        get.assert_not_called()
+
+    def test_read_functions_are_retried(self):
+        client = self.make_client(max_retries=2)
+        responses = [requests.ConnectionError('reset'), fake_response(status=503), fake_response([])]
+        with mock.patch.object(client.session, 'get', side_effect=responses) as get, \
+                self.assertLogs('moodle_api.client', 'WARNING'):
+            self.assertEqual(client.call('core_course_get_courses'), [])
+        self.assertEqual(get.call_count, 3)
+
+    def test_retries_are_bounded(self):
+        client = self.make_client(max_retries=1)
+        with mock.patch.object(client.session, 'get', side_effect=requests.Timeout('lento')) as get, \
+                self.assertLogs('moodle_api.client', 'WARNING'):
+            with self.assertRaises(MoodleUnavailable):
+                client.call('core_course_get_courses')
+        self.assertEqual(get.call_count, 2)
+
+    def test_write_functions_are_not_retried(self):
+        client = self.make_client(max_retries=3)
+        with mock.patch.object(client.session, 'post', side_effect=requests.Timeout('lento')) as post:
+            with self.assertRaises(MoodleUnavailable):
+                client.call('enrol_manual_enrol_users', enrolments=[{'roleid': 5, 'userid': 2, 'courseid': 9}])
+        self.assertEqual(post.call_count, 1)
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+class JsonCodecTests(SimpleTestCase):
+    payload = {'curso': 'Programación', 'precio': Decimal('9.50'), 'fecha': datetime(2026, 1, 2, 3, 4, 5, 678000),
+               3: [1, 2]}
+
+    def test_backends_produce_the_same_json(self):
+        outputs = set()
+        for codec in ('json', 'orjson'):
+            with override_settings(JSON_CODEC=codec):
+                self.assertEqual(jsoncodec.get_codec().name, codec)
+                outputs.add(jsoncodec.dumps(self.payload))
+        self.assertEqual(outputs, {'{"curso":"Programación","precio":"9.50","fecha":"2026-01-02T03:04:05.678",'
+                                   '"3":[1,2]}'.encode()})
+
+    def test_lazy_payload_is_passed_through_without_decoding(self):
+        body = b'[{"id": 2,  "fullname": "Python"}]'
+        payload = jsoncodec.LazyJSON(body)
+        with mock.patch.object(jsoncodec, 'loads') as loads:
+            response = jsoncodec.JsonResponse(pickle.loads(pickle.dumps(payload)), safe=False)
+        loads.assert_not_called()
+        self.assertEqual(response.content, body)
+
+        # Una vez leído se vuelve a codificar, por si se modificó.
+        payload[0]['fullname'] = 'Django'
+        self.assertEqual(jsoncodec.JsonResponse(payload, safe=False).content, b'[{"id":2,"fullname":"Django"}]')
+        with self.assertRaises(TypeError):
+            jsoncodec.JsonResponse(jsoncodec.LazyJSON(body))
+
+    @override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+    def test_lazy_client_calls_still_raise_moodle_errors(self):
+        client = MoodleClient(retry_backoff=0)
+        error = {'exception': 'moodle_exception', 'errorcode': 'invalidtoken', 'message': 'Token no válido'}
+        with mock.patch.object(client.session, 'get', return_value=fake_response(error)):
+            with self.assertRaises(MoodleInvalidToken):
+                client.call('core_enrol_get_users_courses', userid=3, lazy=True)
+        with mock.patch.object(client.session, 'get', return_value=fake_response([{'id': 2}])):
+            courses = client.call('core_enrol_get_users_courses', userid=3, lazy=True)
+        self.assertIsInstance(courses, jsoncodec.LazyJSON)
+        self.assertEqual(courses, [{'id': 2}])
+
+
+class SiteInfoCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def fake_call(self, client, wsfunction, **params):
+        self.calls.append(wsfunction)
+        if wsfunction == 'core_webservice_get_site_info':
+            return {'userid': 7, 'sitename': 'MOOC'}
+        return [{'id': 2, 'fullname': 'Python'}]
+
+    def test_enrolled_courses_reuses_cached_site_info(self):
+        self.calls = []
+        with mock.patch.object(AsyncMoodleClient, 'call', autospec=True, side_effect=self.fake_call):
+            self.client.get('/api/site-info/')
+            response = self.client.get('/api/enrolled-courses/')
+            self.client.get('/api/enrolled-courses/')
+        self.assertEqual(response.json(), [{'id': 2, 'fullname': 'Python'}])
+        self.assertEqual(self.calls, [
+            'core_webservice_get_site_info',
+            'core_enrol_get_users_courses',
+            'core_enrol_get_users_courses',
+        ])
+
+    def test_invalidate_site_info(self):
+        self.calls = []
+        with mock.patch.object(AsyncMoodleClient, 'call', autospec=True, side_effect=self.fake_call):
+            self.client.get('/api/site-info/')
+            invalidate_site_info()
+            self.client.get('/api/site-info/')
+        self.assertEqual(self.calls, ['core_webservice_get_site_info'] * 2)
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n',
+                   MOODLE_BREAKER_FAILURE_THRESHOLD=2, MOODLE_MAX_RETRIES=0)
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        breaker.reset()
+
+    def test_breaker_opens_and_recovers_after_probe(self):
+        cb = CircuitBreaker(failure_threshold=2, recovery_timeout=30)
+        cb.record_failure('f')
+        self.assertTrue(cb.allow('f'))
+        cb.record_failure('f')
+        self.assertFalse(cb.allow('f'))
+        self.assertTrue(cb.allow('otra_funcion'))
+        with mock.patch('moodle_api.breaker.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertTrue(cb.allow('f'))
+            # Solo una llamada de prueba mientras está medio abierto.
+            self.assertFalse(cb.allow('f'))
+        cb.record_success('f')
+        self.assertTrue(cb.allow('f'))
+
+    def test_unreported_probe_expires_or_is_released(self):
+        cb = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        cb.record_failure('f')
+        now = time.monotonic()
+        with mock.patch('moodle_api.breaker.time.monotonic', return_value=now + 31):
+            self.assertTrue(cb.allow('f'))
+        with mock.patch('moodle_api.breaker.time.monotonic', return_value=now + 45):
+            self.assertFalse(cb.allow('f'))
+        # La prueba nunca informó: pasado otro recovery_timeout se deja pasar otra.
+        with mock.patch('moodle_api.breaker.time.monotonic', return_value=now + 62):
+            self.assertTrue(cb.allow('f'))
+            cb.release('f')
+            self.assertEqual(cb.state('f'), 'open')
+            self.assertTrue(cb.allow('f'))
+
+    def test_cancelled_probe_is_released(self):
+        breaker.record_failure('core_webservice_get_site_info')
+        breaker.record_failure('core_webservice_get_site_info')
+
+        async def scenario():
+            client = AsyncMoodleClient()
+            with mock.patch.object(client.http, 'get', side_effect=asyncio.CancelledError):
+                with self.assertRaises(asyncio.CancelledError):
+                    await client.call('core_webservice_get_site_info')
+
+        with mock.patch('moodle_api.breaker.time.monotonic', return_value=time.monotonic() + 31):
+            asyncio.run(scenario())
+            self.assertEqual(breaker.state('core_webservice_get_site_info'), 'open')
+            self.assertTrue(breaker.allow('core_webservice_get_site_info'))
+
+    def test_open_circuit_fails_fast_without_calling_moodle(self):
+        client = MoodleClient()
+        with mock.patch.object(client.session, 'get', side_effect=requests.Timeout('lento')) as get:
+            for _ in range(2):
+                with self.assertRaises(MoodleUnavailable):
+                    client.call('core_course_get_courses')
+            with self.assertRaises(MoodleCircuitOpen):
+                client.call('core_course_get_courses')
+        self.assertEqual(get.call_count, 2)
+
+    def test_site_info_served_stale_while_moodle_is_down(self):
+        ok = mock.AsyncMock(return_value={'userid': 7, 'sitename': 'MOOC'})
+        with mock.patch.object(AsyncMoodleClient, 'call', ok):
+            self.client.get('/api/site-info/')
+        invalidate_site_info()
+        down = mock.AsyncMock(side_effect=MoodleCircuitOpen('abierto'))
+        refreshed = threading.Event()
+        with mock.patch.object(AsyncMoodleClient, 'call', down), \
+                mock.patch('moodle_api.services._run_refresh', side_effect=lambda *a: refreshed.set()) as refresh:
+            response = self.client.get('/api/site-info/')
+            self.client.get('/api/site-info/')
+            self.assertTrue(refreshed.wait(1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'userid': 7, 'sitename': 'MOOC'})
+        self.assertEqual(response['X-Moodle-Stale'], '1')
+        # El refresco en segundo plano se lanza una sola vez por intervalo.
+        self.assertEqual(refresh.call_count, 1)
+
+    def test_async_views_share_one_client_per_process(self):
+        # Con WSGI cada vista asíncrona corre en un event loop nuevo.
+        ok = mock.AsyncMock(return_value={'userid': 7, 'sitename': 'MOOC'})
+        with mock.patch.object(AsyncMoodleClient, '_request', ok), \
+                mock.patch('moodle_api.client.AsyncMoodleClient', wraps=AsyncMoodleClient) as created:
+            for _ in range(3):
+                invalidate_site_info()
+                self.assertEqual(self.client.get('/api/site-info/').status_code, 200)
+        self.assertEqual(ok.await_count, 3)
+        self.assertEqual(created.call_count, 1)
+
+    def test_enrolled_courses_fall_back_to_local_catalog(self):
+        Course.objects.create(moodle_id=4, name='Python', summary='', category=3, synced_at=timezone.now())
+        Course.objects.create(moodle_id=5, name='Curso 5', summary='')
+        down = mock.AsyncMock(side_effect=MoodleUnavailable('caído'))
+        with mock.patch.object(AsyncMoodleClient, 'call', down):
+            response = self.client.get('/api/enrolled-courses/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Moodle-Stale'], '1')
+        self.assertEqual([c['id'] for c in response.json()], [4])
+
+    def test_enroll_errors_are_json(self):
+        user = CustomUser.objects.create_user(username='eva', email='eva@example.com', password=None)
+        self.client.force_login(user)
+        with mock.patch('moodle_api.views.aget_or_fetch_course', side_effect=RuntimeError('boom')), \
+                self.assertLogs('moodle_api.views', 'ERROR'):
+            response = self.client.post('/api/enroll/', {'courseid': 3}, content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('error', response.json())
+
+
+def moodle_course(moodle_id, timemodified=1000, **extra):
+    return {
+        'id': moodle_id, 'fullname': f'Curso de prueba {moodle_id}', 'summary': '<p>Resumen</p>',
+        'categoryid': 3, 'startdate': 1700000000, 'enddate': 1710000000,
+        'timemodified': timemodified, 'format': 'topics', **extra,
+    }
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n',
+                   ENROLLMENT_GROUP_COMMIT=False)
+class CourseCatalogSyncTests(TestCase):
+    def sync(self, catalog, **options):
+        with mock.patch.object(MoodleClient, 'call', return_value=catalog) as call:
+            call_command('sync_courses', stdout=mock.Mock(), **options)
+        return call
+
+    def test_sync_upserts_only_changed_courses(self):
+        site = {'id': 1, 'fullname': 'Portada', 'format': 'site', 'timemodified': 1}
+        self.sync([site, moodle_course(2), moodle_course(3)])
+        self.assertEqual(sorted(Course.objects.values_list('moodle_id', flat=True)), [2, 3])
+
+        Course.objects.filter(moodle_id=2).update(name='editado localmente')
+        self.sync([moodle_course(2), moodle_course(3, timemodified=2000, fullname='Renombrado')])
+        self.assertEqual(Course.objects.get(moodle_id=2).name, 'editado localmente')
+        self.assertEqual(Course.objects.get(moodle_id=3).name, 'Renombrado')
+        self.assertEqual(Course.objects.get(moodle_id=3).timemodified, 2000)
+
+    def test_sync_ids_use_one_multi_id_call(self):
+        call = self.sync([moodle_course(2)], ids=[4, 2, 3])
+        call.assert_called_once_with('core_course_get_courses', options={'ids': [2, 3, 4]})
+
+    def test_enroll_uses_local_catalog_without_calling_moodle(self):
+        self.sync([moodle_course(5)])
+        user = CustomUser.objects.create_user(email='ana@example.com', password=None, username='ana')
+        self.client.force_login(user)
+        with mock.patch.object(AsyncMoodleClient, 'call') as call:
+            response = self.client.post('/api/enroll/', {'courseid': 5}, content_type='application/json')
+        call.assert_not_called()
+        self.assertEqual(response.json()['course_name'], 'Curso de prueba 5')
+        self.assertTrue(Enrollment.objects.filter(user=user, course__moodle_id=5).exists())
+
+
+class CourseSearchTests(TestCase):
+    def setUp(self):
+        Course.objects.create(moodle_id=60, name='Programación en Python', summary='<p>Curso inicial</p>', category=3)
+        Course.objects.create(moodle_id=61, name='Estadística', summary='Análisis de datos con Python', category=4)
+        Course.objects.create(moodle_id=62, name='Cocina', summary='<p>Recetas</p>', category=3)
+
+    def search(self, **params):
+        return self.client.get('/api/courses/search/', params).json()
+
+    def test_ranks_name_matches_first_and_matches_prefixes(self):
+        self.assertEqual([c['id'] for c in self.search(q='pyth')['results']], [60, 61])
+        # Sin acentos y sin coincidir con las etiquetas HTML del resumen.
+        self.assertEqual([c['id'] for c in self.search(q='programacion')['results']], [60])
+        self.assertEqual(self.search(q='p')['results'][0]['id'], 60)
+
+    def test_category_filter_and_pagination(self):
+        self.assertEqual([c['id'] for c in self.search(q='python', category=4)['results']], [61])
+        first = self.search(q='python', page_size=1)
+        second = self.search(q='python', page_size=1, page=2)
+        self.assertEqual((first['results'][0]['id'], first['has_next']), (60, True))
+        self.assertEqual((second['results'][0]['id'], second['has_next']), (61, False))
+
+    def test_index_follows_saves_deletes_and_sync(self):
+        course = Course.objects.get(moodle_id=62)
+        course.name = 'Repostería'
+        course.save()
+        self.assertEqual([c['id'] for c in self.search(q='reposteria')['results']], [62])
+        course.delete()
+        self.assertEqual(self.search(q='reposteria')['results'], [])
+
+        with mock.patch.object(MoodleClient, 'call', return_value=[moodle_course(63, fullname='Jardinería')]):
+            call_command('sync_courses', stdout=mock.Mock())
+        self.assertEqual([c['id'] for c in self.search(q='jardin')['results']], [63])
+
+
+def png_bytes(size=(800, 600)):
+    out = io.BytesIO()
+    Image.new('RGBA', size, (200, 30, 30, 128)).save(out, 'PNG')
+    return out.getvalue()
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+class CourseImageTests(TestCase):
+    image_url = 'http://moodle.test/webservice/pluginfile.php/5/course/overviewfiles/portada.png'
+
+    def setUp(self):
+        cache.clear()
+        self.image_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.image_root.cleanup)
+        override = override_settings(COURSE_IMAGE_ROOT=self.image_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.course = Course.objects.create(moodle_id=70, name='Fotografía', image_url=self.image_url,
+                                            timemodified=1000)
+        self.version = images.image_version(self.image_url, 1000)
+
+    def get(self, variant='card', **extra):
+        return self.client.get(f'/api/courses/70/image/{variant}/', **extra)
+
+    def test_downloads_once_and_serves_resized_variants(self):
+        with mock.patch.object(MoodleClient, 'download', return_value=png_bytes()) as download:
+            card = self.get(QUERY_STRING=f'v={self.version}')
+            thumb = self.get('thumb')
+        download.assert_called_once()
+        self.assertEqual(download.call_args.args[0], self.image_url)
+
+        self.assertEqual(card['Content-Type'], 'image/jpeg')
+        with Image.open(io.BytesIO(b''.join(card.streaming_content))) as image:
+            self.assertEqual(image.size, images.IMAGE_VARIANTS['card'])
+        with Image.open(io.BytesIO(b''.join(thumb.streaming_content))) as image:
+            self.assertEqual(image.size, images.IMAGE_VARIANTS['thumb'])
+        self.assertIn('immutable', card['Cache-Control'])
+        self.assertNotIn('immutable', thumb['Cache-Control'])
+
+    def test_if_none_match_returns_304_without_touching_moodle(self):
+        etag = images.image_etag(self.version, 'card')
+        with mock.patch.object(MoodleClient, 'download') as download:
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        download.assert_not_called()
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+    def test_payload_points_to_proxy_and_unknown_images_are_404(self):
+        sync = moodle_course(71, overviewfiles=[{'fileurl': self.image_url, 'mimetype': 'image/png'}])
+        with mock.patch.object(MoodleClient, 'call', return_value=[sync]):
+            call_command('sync_courses', stdout=mock.Mock())
+        self.assertEqual(Course.objects.get(moodle_id=71).image_url, self.image_url)
+        result = self.client.get('/api/courses/search/', {'q': 'prueba'}).json()['results'][0]
+        self.assertTrue(result['courseimage'].startswith('/api/courses/71/image/card/?v='))
+
+        Course.objects.create(moodle_id=72, name='Sin imagen')
+        self.assertEqual(self.client.get('/api/courses/72/image/card/').status_code, 404)
+        self.assertEqual(self.get('enorme').status_code, 404)
+
+    def test_cache_evicts_least_recently_used_files(self):
+        with mock.patch.object(MoodleClient, 'download', return_value=png_bytes()):
+            b''.join(self.get().streaming_content)
+        paths = {v: images.variant_path(self.version, v) for v in images.IMAGE_VARIANTS}
+        os.utime(paths['thumb'], (1, 1))
+        total = sum(path.stat().st_size for path in paths.values())
+        # Un byte por encima del límite: sale solo la variante usada hace más tiempo.
+        self.assertEqual(images.evict(total - 1), 1)
+        self.assertFalse(paths['thumb'].exists())
+        self.assertTrue(paths['card'].exists())
+
+    def test_replaced_image_with_the_same_url_gets_a_new_version(self):
+        with mock.patch.object(MoodleClient, 'download', return_value=png_bytes()):
+            old = self.get()
+        Course.objects.filter(pk=self.course.pk).update(timemodified=2000)
+        with mock.patch.object(MoodleClient, 'download', return_value=png_bytes()) as download:
+            new = self.get(HTTP_IF_NONE_MATCH=old['ETag'])
+        # El ETag anterior ya no vale: se descarga y sirve la imagen nueva.
+        download.assert_called_once()
+        self.assertEqual(new.status_code, 200)
+        self.assertNotEqual(new['ETag'], old['ETag'])
+
+    def test_moodle_errors_are_502(self):
+        with self.assertLogs('moodle_api.views', 'WARNING'):
+            with mock.patch.object(MoodleClient, 'download', side_effect=MoodleUnavailable('caído')):
+                self.assertEqual(self.get().status_code, 502)
+            with mock.patch.object(MoodleClient, 'download', return_value=b'no es una imagen'):
+                self.assertEqual(self.get().status_code, 502)
+
+
+class ExportCourseUsersTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(moodle_id=9, name='Datos', summary='')
+
+    def enroll_users(self, count, offset=0):
+        for i in range(offset, offset + count):
+            user = CustomUser.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com', password=None,
+                first_name='Usuario', last_name=str(i))
+            if i % 2:
+                UserProfile.objects.create(user=user, age=20 + i, country='Cuba', purpose='Aprender')
+            Enrollment.objects.create(user=user, course=self.course)
+
+    def export(self):
+        response = self.client.get('/api/export/9/')
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_export_streams_csv_rows(self):
+        self.enroll_users(2)
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'Nombre Completo,Correo Electrónico,Edad,País,Propósito,Fecha de Matrícula')
+        self.assertTrue(lines[1].startswith('Usuario 0,user0@example.com,No disponible,No disponible,No disponible,'))
+        self.assertTrue(lines[2].startswith('Usuario 1,user1@example.com,21,Cuba,Aprender,'))
+
+    def test_export_query_count_does_not_grow_with_enrollments(self):
+        self.enroll_users(3)
+        # Curso local + una consulta con JOIN sobre matrícula, usuario y perfil.
+        with self.assertNumQueries(2):
+            self.export()
+        self.enroll_users(20, offset=3)
+        with self.assertNumQueries(2):
+            _, body = self.export()
+        self.assertEqual(len(body.splitlines()), 24)
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n',
+                   ENROLLMENT_GROUP_COMMIT=False)
+class AsyncEnrollTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='luis', email='luis@example.com', password=None)
+        self.client.force_login(self.user)
+
+    def enroll(self, course_id):
+        return self.client.post('/api/enroll/', {'courseid': course_id}, content_type='application/json')
+
+    def test_enroll_fetches_unsynced_course_with_async_client(self):
+        call = mock.AsyncMock(return_value=[moodle_course(12)])
+        with mock.patch.object(AsyncMoodleClient, 'call', call):
+            response = self.enroll(12)
+            again = self.enroll(12)
+        call.assert_awaited_once_with('core_course_get_courses', options={'ids': [12]})
+        self.assertEqual(response.json()['course_name'], 'Curso de prueba 12')
+        self.assertEqual(again.json()['message'], 'Ya estás matriculado en este curso')
+        self.assertEqual(Course.objects.get(moodle_id=12).timemodified, 1000)
+
+    def test_enroll_keeps_placeholder_when_moodle_is_down(self):
+        with mock.patch.object(AsyncMoodleClient, 'call', mock.AsyncMock(side_effect=MoodleUnavailable('caído'))), \
+                self.assertLogs('moodle_api.services', 'WARNING'):
+            response = self.enroll(13)
+        self.assertEqual(response.json()['course_name'], 'Curso 13')
+        self.assertEqual(Course.objects.get(moodle_id=13).category, 3)
+
+
+@override_settings(ENROLLMENT_GROUP_COMMIT=False)
+class EnrollmentCounterTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(moodle_id=30, name='Con cupo', summary='', seat_limit=1)
+        self.users = [
+            CustomUser.objects.create_user(username=f'cupo{i}', email=f'cupo{i}@example.com', password=None)
+            for i in range(2)
+        ]
+
+    def enroll_as(self, user):
+        self.client.force_login(user)
+        return self.client.post('/api/enroll/', {'courseid': 30}, content_type='application/json')
+
+    def test_enroll_counts_and_enforces_seat_limit(self):
+        self.assertEqual(self.enroll_as(self.users[0]).status_code, 200)
+        self.assertEqual(self.enroll_as(self.users[0]).json()['message'], 'Ya estás matriculado en este curso')
+        full = self.enroll_as(self.users[1])
+        self.assertEqual(full.status_code, 409)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 1)
+        self.assertFalse(Enrollment.objects.filter(user=self.users[1]).exists())
+
+    def test_enroll_race_does_not_double_count(self):
+        Enrollment.objects.create(user=self.users[0], course=self.course)
+        self.course.seat_limit = None
+        self.course.save()
+        self.assertEqual(enroll(self.users[0], self.course), ALREADY_ENROLLED)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 0)
+
+    def test_bulk_enroll_race_counts_only_inserted_rows(self):
+        self.course.seat_limit = None
+        self.course.save()
+        plan = enrollment._plan_bulk_enroll
+
+        def plan_then_lose_race(*args):
+            planned = plan(*args)
+            if not Enrollment.objects.filter(user=self.users[0]).exists():
+                # Otra alta inserta la matrícula entre la consulta y el bulk_create.
+                Enrollment.objects.create(user=self.users[0], course=self.course)
+            return planned
+
+        pairs = [(user.pk, self.course.pk) for user in self.users]
+        with mock.patch.object(enrollment, '_plan_bulk_enroll', side_effect=plan_then_lose_race):
+            results = bulk_enroll(pairs)
+        self.assertEqual(results, {pairs[0]: ALREADY_ENROLLED, pairs[1]: ENROLLED})
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 1)
+        self.assertEqual(EnrollmentStat.objects.get(course=self.course, dimension=EnrollmentStat.COUNTRY).count, 1)
+
+    def test_reconcile_command_repairs_drift(self):
+        Enrollment.objects.create(user=self.users[0], course=self.course)
+        Enrollment.objects.create(user=self.users[1], course=self.course)
+        other = Course.objects.create(moodle_id=31, name='Otro', summary='', enrollment_count=7)
+        out = io.StringIO()
+        call_command('reconcile_enrollment_counts', stdout=out)
+        self.assertIn('2 cursos', out.getvalue())
+        self.assertEqual(Course.objects.get(pk=self.course.pk).enrollment_count, 2)
+        self.assertEqual(Course.objects.get(pk=other.pk).enrollment_count, 0)
+
+
+class EnrollmentReconciliationTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.course = Course.objects.create(moodle_id=2, name='Dos', synced_at=now)
+        self.other = Course.objects.create(moodle_id=3, name='Tres', synced_at=now)
+        Course.objects.create(moodle_id=4, name='Provisional')
+        self.students = [
+            CustomUser.objects.create_user(username=f'alumno{i}', email=f'Alumno{i}@example.com', password=None)
+            for i in range(3)
+        ]
+        self.local_only = CustomUser.objects.create_user(username='solo', email='solo@example.com', password=None)
+        enroll(self.students[0], self.course)
+        enroll(self.local_only, self.course)
+
+    def reconcile(self, moodle, **kwargs):
+        with override_settings(MOODLE_URL=moodle.url, MOODLE_TOKEN='t', MOODLE_RETRY_BACKOFF=0):
+            return reconcile_enrollments(page_size=2, chunk_size=1, **kwargs)
+
+    def enrolled(self, course):
+        return sorted(Enrollment.objects.filter(course=course).values_list('user__username', flat=True))
+
+    def test_pulls_moodle_rosters_into_local_enrollments(self):
+        # El servidor falso matricula a alumno0..alumno3 en cada curso.
+        with FakeMoodleServer(users_per_course=4) as moodle:
+            report = self.reconcile(moodle)
+        self.assertEqual((report['courses'], report['added'], report['removed'], report['unmatched']), (2, 5, 0, 2))
+        # Las matrículas hechas aquí y no enviadas a Moodle se conservan.
+        self.assertEqual(report['local_only'], 1)
+        self.assertEqual(self.enrolled(self.course), ['alumno0', 'alumno1', 'alumno2', 'solo'])
+        self.assertEqual(self.enrolled(self.other), ['alumno0', 'alumno1', 'alumno2'])
+        # Tres páginas de dos alumnos por curso (la última vacía); el curso provisional no se consulta.
+        courses = [call[1]['courseid'] for call in moodle.calls if call[0] == 'core_enrol_get_enrolled_users']
+        self.assertEqual(sorted(courses), ['2', '2', '2', '3', '3', '3'])
+
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 4)
+
+    def test_delete_removes_local_only_enrollments(self):
+        with FakeMoodleServer(users_per_course=4) as moodle:
+            report = self.reconcile(moodle, delete=True, moodle_ids=[2])
+        self.assertEqual((report['added'], report['removed'], report['local_only']), (2, 1, 0))
+        self.assertEqual(self.enrolled(self.course), ['alumno0', 'alumno1', 'alumno2'])
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 3)
+        total = EnrollmentStat.objects.filter(course=self.course, dimension=EnrollmentStat.COUNTRY).get().count
+        self.assertEqual(total, 3)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_enrollments', '--push', '--delete')
+
+    def test_push_sends_local_only_enrollments_to_moodle(self):
+        with FakeMoodleServer(users_per_course=1) as moodle:
+            report = self.reconcile(moodle, push=True, moodle_ids=[2])
+        self.assertEqual((report['pushed'], report['removed']), (1, 0))
+        self.assertEqual(moodle.enrolments[0]['courseid'], '2')
+        self.assertEqual(moodle.enrolments[0]['roleid'], '5')
+        self.assertIn('solo', self.enrolled(self.course))
+
+    def test_dry_run_and_unreadable_courses_change_nothing(self):
+        with FakeMoodleServer(users_per_course=4) as moodle:
+            report = self.reconcile(moodle, delete=True, dry_run=True)
+        self.assertEqual((report['added'], report['removed']), (5, 1))
+
+        with FakeMoodleServer(error_rate=1.0) as moodle, \
+                self.assertLogs('moodle_api.reconciliation', 'WARNING'), \
+                self.assertLogs('moodle_api.client', 'WARNING'):
+            report = self.reconcile(moodle)
+        self.assertEqual((report['courses'], report['failed']), (0, 2))
+        self.assertEqual(self.enrolled(self.course), ['alumno0', 'solo'])
+
+    def test_malformed_roster_fails_only_its_course(self):
+        with FakeMoodleServer(users_per_course=4) as moodle:
+            enrolled_user = moodle.enrolled_user
+
+            def malformed(course_id, index):
+                return 'roto' if course_id == 3 else enrolled_user(course_id, index)
+
+            with mock.patch.object(moodle, 'enrolled_user', side_effect=malformed), \
+                    self.assertLogs('moodle_api.reconciliation', 'WARNING') as logs:
+                report = self.reconcile(moodle)
+        self.assertEqual((report['courses'], report['failed'], report['added']), (1, 1, 2))
+        self.assertIn('malformada del curso 3', logs.output[0])
+        self.assertEqual(self.enrolled(self.other), [])
+
+
+class GroupCommitTests(TransactionTestCase):
+    def setUp(self):
+        self.course = Course.objects.create(moodle_id=50, name='Lanzamiento', summary='', seat_limit=15)
+        self.users = [
+            CustomUser.objects.create_user(username=f'gc{i}', email=f'gc{i}@example.com', password=None)
+            for i in range(20)
+        ]
+
+    def test_concurrent_enrollments_share_one_transaction(self):
+        writer = EnrollmentQueue(max_batch=100, max_delay=0.2)
+        with mock.patch.object(writer, 'flush', wraps=writer.flush) as flush:
+            futures = [writer.submit(u.pk, self.course.pk) for u in self.users]
+            futures.append(writer.submit(self.users[0].pk, self.course.pk))
+            statuses = [f.result(timeout=5) for f in futures]
+        self.assertEqual(flush.call_count, 1)
+        self.assertEqual(statuses[:15], ['enrolled'] * 15)
+        self.assertEqual(statuses[15:20], ['course_full'] * 5)
+        self.assertEqual(statuses[20], 'already_enrolled')
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 15)
+
+    @override_settings(ENROLLMENT_GROUP_COMMIT=True)
+    def test_enroll_view_goes_through_the_queue(self):
+        self.client.force_login(self.users[0])
+        with mock.patch.object(enrollment_queue, 'submit', wraps=enrollment_queue.submit) as submit:
+            response = self.client.post('/api/enroll/', {'courseid': 50}, content_type='application/json')
+        submit.assert_called_once_with(self.users[0].pk, self.course.pk)
+        self.assertEqual(response.json()['message'], '¡Matrícula exitosa!')
+        self.assertTrue(Enrollment.objects.filter(user=self.users[0], course=self.course).exists())
+
+
+class EnrollmentAnalyticsTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(moodle_id=40, name='Estadística', summary='')
+        self.users = []
+        for i, (age, country) in enumerate([(17, 'Cuba'), (30, 'Cuba'), (33, 'México'), (None, 'Chile')]):
+            user = CustomUser.objects.create_user(username=f'est{i}', email=f'est{i}@example.com', password=None)
+            UserProfile.objects.create(user=user, age=age, country=country, purpose='Trabajo')
+            self.users.append(user)
+        self.users.append(CustomUser.objects.create_user(username='sinperfil', email='sp@example.com', password=None))
+        self.staff = CustomUser.objects.create_user(
+            username='admin', email='admin@example.com', password=None, is_staff=True)
+        self.client.force_login(self.staff)
+
+    def stats(self, **params):
+        return self.client.get('/api/analytics/enrollments/', params)
+
+    def test_incremental_stats_match_rebuild(self):
+        enroll(self.users[0], self.course)
+        bulk_enroll({(u.pk, self.course.pk) for u in self.users[1:]})
+        incremental = self.stats(courseid=40).json()
+        self.assertEqual(incremental['total'], 5)
+        self.assertEqual(incremental['country'][0], {'value': 'Cuba', 'count': 2})
+        self.assertEqual({r['value']: r['count'] for r in incremental['age_band']},
+                         {'<18': 1, '25-34': 2, '': 2})
+
+        insert = EnrollmentStat.objects.bulk_create
+        with mock.patch('moodle_api.analytics.REBUILD_BATCH_SIZE', 2), \
+                mock.patch.object(EnrollmentStat.objects, 'bulk_create', wraps=insert) as bulk_create:
+            call_command('rebuild_enrollment_stats', stdout=io.StringIO())
+        self.assertEqual(self.stats(courseid=40).json(), incremental)
+        # Nunca más de un bloque de filas en memoria.
+        self.assertEqual(max(len(call.args[0]) for call in bulk_create.call_args_list), 2)
+
+    def test_migration_backfills_existing_enrollments(self):
+        bulk_enroll({(u.pk, self.course.pk) for u in self.users})
+        expected = self.stats(courseid=40).json()
+        EnrollmentStat.objects.all().delete()
+        migration = importlib.import_module('moodle_api.migrations.0007_enrollment_stats')
+        migration.build_stats(django_apps, None)
+        self.assertEqual(self.stats(courseid=40).json(), expected)
+
+    def test_stats_are_read_without_scanning_enrollments(self):
+        bulk_enroll({(u.pk, self.course.pk) for u in self.users})
+        # Usuario (la sesión sale de la caché), curso, total y una consulta por dimensión.
+        with self.assertNumQueries(7):
+            data = self.stats(courseid=40, top=1).json()
+        self.assertEqual(data['purpose'], [{'value': 'Trabajo', 'count': 4}])
+        self.assertEqual(len(data['day']), 1)
+
+    def test_requires_staff(self):
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get('/api/analytics/enrollments/').status_code, 403)
+
+
+class MyCoursesTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='marta', email='marta@example.com', password=None)
+        other = CustomUser.objects.create_user(username='otro', email='otro@example.com', password=None)
+        for moodle_id in range(2, 7):
+            course = Course.objects.create(moodle_id=moodle_id, name=f'Curso {moodle_id}', summary='', category=3)
+            Enrollment.objects.create(user=self.user, course=course)
+            Enrollment.objects.create(user=other, course=course)
+        self.client.force_login(self.user)
+
+    def test_pages_through_enrollments_newest_first(self):
+        seen, cursor = [], None
+        with mock.patch.object(AsyncMoodleClient, 'call') as call, mock.patch.object(MoodleClient, 'call') as sync_call:
+            while True:
+                params = {'limit': 2, 'fields': 'id,fullname'}
+                if cursor:
+                    params['cursor'] = cursor
+                # Usuario (la sesión sale de la caché) y una consulta para la página.
+                with self.assertNumQueries(2):
+                    data = self.client.get('/api/my-courses/', params).json()
+                seen.extend(data['results'])
+                cursor = data['next']
+                if cursor is None:
+                    break
+        call.assert_not_called()
+        sync_call.assert_not_called()
+        self.assertEqual([c['id'] for c in seen], [6, 5, 4, 3, 2])
+        self.assertEqual(seen[0], {'id': 6, 'fullname': 'Curso 6'})
+
+    def test_rejects_unknown_fields_and_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/my-courses/', {'fields': 'id,password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/my-courses/', {'cursor': 'basura'}).status_code, 400)
+
+    def test_etag_returns_not_modified_until_data_changes(self):
+        response = self.client.get('/api/my-courses/')
+        etag = response['ETag']
+        self.assertEqual(len(response.json()['results']), 5)
+        not_modified = self.client.get('/api/my-courses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        # El usuario sale de la sesión o de un token Bearer.
+        for vary in (response['Vary'], not_modified['Vary']):
+            self.assertEqual({v.strip() for v in vary.split(',')} & {'Cookie', 'Authorization'},
+                             {'Cookie', 'Authorization'})
+        Course.objects.filter(moodle_id=4).update(name='Renombrado')
+        self.assertEqual(self.client.get('/api/my-courses/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/my-courses/').status_code, 401)
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+class BatchEnrollTests(TestCase):
+    def setUp(self):
+        self.registrar = CustomUser.objects.create_user(
+            username='registro', email='registro@example.com', password=None, is_staff=True)
+        self.client.force_login(self.registrar)
+        self.users = [
+            CustomUser.objects.create_user(username=f'alumno{i}', email=f'alumno{i}@example.com', password=None)
+            for i in range(3)
+        ]
+        self.course = Course.objects.create(moodle_id=20, name='Local', summary='', enrollment_count=1)
+        Enrollment.objects.create(user=self.users[0], course=self.course)
+
+    def post_batch(self, rows):
+        return self.client.post('/api/enroll/batch/', {'enrollments': rows}, content_type='application/json')
+
+    def test_batch_resolves_missing_courses_in_one_moodle_call(self):
+        rows = [
+            {'email': 'alumno0@example.com', 'courseid': 20},
+            {'email': 'alumno1@example.com', 'courseid': 20},
+            {'email': 'alumno1@example.com', 'courseid': 21},
+            {'email': 'alumno2@example.com', 'courseid': 22},
+            {'email': 'nadie@example.com', 'courseid': 20},
+            {'email': 'alumno2@example.com', 'courseid': 99},
+            {'email': 'alumno1@example.com', 'courseid': 20},
+            {'courseid': 20},
+        ]
+        call = mock.Mock(return_value=[moodle_course(21), moodle_course(22)])
+        with mock.patch.object(MoodleClient, 'call', call):
+            response = self.post_batch(rows)
+        call.assert_called_once_with('core_course_get_courses', options={'ids': [21, 22, 99]})
+
+        statuses = [r['status'] for r in response.json()['results']]
+        self.assertEqual(statuses, ['already_enrolled', 'enrolled', 'enrolled', 'enrolled',
+                                    'error', 'error', 'error', 'error'])
+        self.assertEqual(response.json()['summary'], {'already_enrolled': 1, 'enrolled': 3, 'error': 4})
+        self.assertEqual(Enrollment.objects.count(), 4)
+
+    def test_batch_query_count_is_constant(self):
+        rows = [{'email': u.email, 'courseid': 20} for u in self.users]
+        # usuario autenticado (la sesión sale de la caché), usuarios del lote,
+        # cursos, savepoint, plazas de los cursos, matrículas existentes, bulk
+        # insert en su propio savepoint (3), perfiles, alta y actualización de
+        # estadísticas, actualización de contadores y liberación del savepoint
+        with self.assertNumQueries(14):
+            self.post_batch(rows)
+
+    def test_batch_respects_seat_limit_and_updates_counter(self):
+        Course.objects.filter(pk=self.course.pk).update(seat_limit=2)
+        response = self.post_batch([{'email': u.email, 'courseid': 20} for u in self.users])
+        self.assertEqual(response.json()['summary'], {'already_enrolled': 1, 'enrolled': 1, 'course_full': 1})
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.enrollment_count, 2)
+        self.assertEqual(Enrollment.objects.filter(course=self.course).count(), 2)
+
+    def test_batch_accepts_csv_upload(self):
+        upload = SimpleUploadedFile('lote.csv', b'email,courseid\nalumno1@example.com,20\nalumno2@example.com,20\n')
+        response = self.client.post('/api/enroll/batch/', {'file': upload})
+        self.assertEqual(response.json()['summary'], {'enrolled': 2})
+
+    def test_batch_requires_staff(self):
+        self.client.force_login(self.users[1])
+        self.assertEqual(self.post_batch([]).status_code, 403)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight('test', lock_timeout=5, wait_timeout=5, result_ttl=5)
+
+    def test_concurrent_callers_share_one_call(self):
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'curso'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.flight.do(7, slow_fetch)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['curso'] * 10)
+
+    def test_waits_for_result_published_by_other_worker(self):
+        lock_key, result_key = self.flight._keys(8)
+        cache.set(lock_key, 'otro-worker')
+
+        def other_worker():
+            time.sleep(0.1)
+            cache.set(result_key, 'de otro worker')
+            cache.delete(lock_key)
+
+        threading.Thread(target=other_worker).start()
+        fetch = mock.Mock(return_value='propio')
+        self.assertEqual(self.flight.do(8, fetch), 'de otro worker')
+        fetch.assert_not_called()
+
+    def test_errors_are_shared_and_not_cached(self):
+        with self.assertRaises(MoodleUnavailable):
+            self.flight.do(9, mock.Mock(side_effect=MoodleUnavailable('caído')))
+        self.assertEqual(self.flight.do(9, lambda: 'ok'), 'ok')
+
+    def test_async_callers_share_one_call(self):
+        calls = []
+
+        async def slow_fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'curso'
+
+        async def main():
+            return await asyncio.gather(*(self.flight.ado(10, slow_fetch) for _ in range(20)))
+
+        self.assertEqual(asyncio.run(main()), ['curso'] * 20)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+class CourseLoaderTests(SimpleTestCase):
+    @staticmethod
+    def echo_courses(*args, options, **kwargs):
+        return [moodle_course(course_id) for course_id in options['ids']]
+
+    def test_long_id_lists_are_split_by_url_length(self):
+        loader = CourseLoader(max_url_length=300)
+        call = mock.Mock(side_effect=self.echo_courses)
+        with mock.patch.object(MoodleClient, 'call', call):
+            courses = loader.load_many(range(1000, 1030))
+        self.assertEqual(sorted(courses), list(range(1000, 1030)))
+        self.assertGreater(call.call_count, 1)
+        self.assertEqual(sum(len(c.kwargs['options']['ids']) for c in call.call_args_list), 30)
+        client = MoodleClient()
+        for chunk in loader.chunks(client, range(1000, 1030)):
+            query = client.build_params('core_course_get_courses', {'options': {'ids': chunk}})
+            self.assertLessEqual(len(client.url) + 1 + len(urlencode(query)), 300)
+
+    def test_concurrent_loads_within_window_share_one_call(self):
+        loader = CourseLoader(window=0.1)
+        call = mock.Mock(side_effect=self.echo_courses)
+        results = {}
+        with mock.patch.object(MoodleClient, 'call', call):
+            threads = [threading.Thread(target=lambda i=i: results.update({i: loader.load(i)}))
+                       for i in range(30, 35)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        call.assert_called_once_with('core_course_get_courses', options={'ids': [30, 31, 32, 33, 34]})
+        self.assertEqual(results[32]['fullname'], 'Curso de prueba 32')
+
+    def test_async_loads_within_window_share_one_call(self):
+        loader = CourseLoader(window=0.01)
+        call = mock.AsyncMock(side_effect=self.echo_courses)
+
+        async def main():
+            return await asyncio.gather(*(loader.aload(i) for i in (40, 41, 40)))
+
+        with mock.patch.object(AsyncMoodleClient, 'call', call):
+            results = asyncio.run(main())
+        call.assert_awaited_once_with('core_course_get_courses', options={'ids': [40, 41]})
+        self.assertEqual([r['id'] for r in results], [40, 41, 40])
+
+
+@override_settings(EXPORT_CURSOR_LAG=0)
+class IncrementalExportTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(
+            username='admin', email='admin@example.com', password=None, is_staff=True)
+        self.client.force_login(self.admin)
+        self.courses = [Course.objects.create(moodle_id=90 + i, name=f'Curso {i}') for i in range(2)]
+        self.when = timezone.now() - timedelta(hours=1)
+        for i in range(4):
+            self.enroll(f'e{i}', self.courses[i % 2])
+
+    def enroll(self, username, course, when=None):
+        user = CustomUser.objects.create_user(username=username, email=f'{username}@example.com', password=None)
+        enrollment = Enrollment.objects.create(user=user, course=course)
+        # Todas a la misma hora: el id desempata.
+        Enrollment.objects.filter(pk=enrollment.pk).update(enrolled_at=when or self.when)
+        return enrollment
+
+    def export(self, **params):
+        response = self.client.get('/api/export/enrollments/', params)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def emails(self, body):
+        return [json.loads(line)['email'] for line in body.decode().splitlines()]
+
+    def test_cursor_returns_only_new_enrollments(self):
+        response, body = self.export(format='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(self.emails(body), [f'e{i}@example.com' for i in range(4)])
+        cursor = response['X-Next-Cursor']
+
+        self.enroll('nuevo', self.courses[1], when=timezone.now())
+        response, body = self.export(format='ndjson', since=cursor)
+        self.assertEqual(self.emails(body), ['nuevo@example.com'])
+        self.assertEqual(json.loads(body)['courseid'], 91)
+
+        # Sin novedades: cuerpo vacío y el mismo cursor.
+        cursor = response['X-Next-Cursor']
+        response, body = self.export(format='ndjson', since=cursor)
+        self.assertEqual((body, response['X-Next-Cursor']), (b'', cursor))
+
+    def test_csv_per_course_with_limit(self):
+        response, body = self.export(courseid=90, limit=1)
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['ID', 'ID Curso', 'Curso'])
+        self.assertEqual([line.split(',')[4] for line in lines[1:]], ['e0@example.com'])
+
+        response, body = self.export(courseid=90, limit=5, since=response['X-Next-Cursor'])
+        self.assertEqual([line.split(',')[4] for line in body.decode().splitlines()[1:]], ['e2@example.com'])
+
+    def test_gzip_and_recent_rows_held_back(self):
+        response, body = self.export(format='ndjson', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('matriculas_todas.ndjson.gz', response['Content-Disposition'])
+        self.assertEqual(len(self.emails(gzip.decompress(body))), 4)
+
+        self.enroll('reciente', self.courses[0], when=timezone.now())
+        with override_settings(EXPORT_CURSOR_LAG=60):
+            _, body = self.export(format='ndjson', since=response['X-Next-Cursor'])
+        self.assertEqual(body, b'')
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.export(since='no-es-un-cursor')[0].status_code, 400)
+        self.assertEqual(self.export(format='xml')[0].status_code, 400)
+        self.assertEqual(self.export(courseid=999)[0].status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.export()[0].status_code, 403)
+
+
+class ExportJobTests(TestCase):
+    def setUp(self):
+        self.export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.export_root.cleanup)
+        override = override_settings(EXPORT_ROOT=self.export_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.admin = CustomUser.objects.create_user(
+            username='admin', email='admin@example.com', password=None, is_staff=True)
+        self.client.force_login(self.admin)
+        self.course = Course.objects.create(moodle_id=30, name='Historia', summary='')
+        for i in range(5):
+            user = CustomUser.objects.create_user(username=f'u{i}', email=f'u{i}@example.com', password=None,
+                                                  first_name='Alumno', last_name=str(i))
+            Enrollment.objects.create(user=user, course=self.course)
+
+    def create_job(self, **data):
+        return self.client.post('/api/export-jobs/', data, content_type='application/json')
+
+    def test_job_lifecycle(self):
+        response = self.create_job(courseid=30)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['id']
+        self.assertEqual(self.create_job(courseid=30).json()['id'], job_id)
+
+        run_job(claim_job(), chunk_size=2)
+        status = self.client.get(f'/api/export-jobs/{job_id}/').json()
+        self.assertEqual((status['status'], status['rows_written'], status['progress']), ('done', 5, 1.0))
+
+        download = self.client.get(status['download_url'])
+        lines = b''.join(download.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[5].startswith('Alumno 4,u4@example.com'))
+
+        # Sin cambios en las matrículas se reutiliza la exportación terminada.
+        self.assertEqual(self.create_job(courseid=30).status_code, 200)
+        user = CustomUser.objects.create_user(username='nuevo', email='nuevo@example.com', password=None)
+        Enrollment.objects.create(user=user, course=self.course)
+        self.assertEqual(self.create_job(courseid=30).status_code, 202)
+
+    def test_interrupted_job_resumes_from_checkpoint(self):
+        self.create_job()
+        job = claim_job()
+        stop = threading.Event()
+        stop.set()
+        run_job(job, chunk_size=2, stop_event=stop)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_written), (ExportJob.PENDING, 2))
+
+        # Simula un worker que murió tras escribir un bloque sin guardar el punto de control.
+        with open(export_path(job), 'ab') as f:
+            f.write(b'fila a medias')
+
+        run_job(claim_job(), chunk_size=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_written), (ExportJob.DONE, 5))
+        with open(export_path(job), encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['Curso', 'Nombre Completo'])
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], [f'u{i}@example.com' for i in range(5)])
+
+    def test_export_jobs_require_staff(self):
+        self.client.force_login(CustomUser.objects.get(username='u0'))
+        self.assertEqual(self.create_job().status_code, 403)
+
+
+@override_settings(ENROLLMENT_GROUP_COMMIT=False)
+class AdmissionControlTests(TestCase):
+    def test_token_bucket_refills_over_time(self):
+        bucket = TokenBucket(rate=2, burst=1, now=0)
+        self.assertEqual(bucket.delay(0), 0)
+        bucket.take()
+        self.assertEqual(bucket.delay(0.25), 0.25)
+        bucket.take()
+        # La ficha reservada por quien espera retrasa al siguiente.
+        self.assertEqual(bucket.delay(0.25), 0.75)
+
+    def test_sheds_when_wait_or_queue_is_exceeded(self):
+        controller = AdmissionController('prueba', rate=100, burst=100, user_rate=10, user_burst=1,
+                                         max_wait=0.5, queue_size=1)
+        self.assertEqual(controller.reserve('ana'), (0, None))
+        delay, reason = controller.reserve('ana')
+        self.assertIsNone(reason)
+        self.assertAlmostEqual(delay, 0.1, places=2)
+        # La cola (una petición) está ocupada por la espera anterior.
+        self.assertEqual(controller.reserve('ana')[1], 'queue')
+        controller.done()
+        self.assertEqual(controller.reserve('luis'), (0, None))
+
+        controller = AdmissionController('prueba', rate=1, burst=1, user_rate=100, user_burst=100,
+                                         max_wait=0.5, queue_size=10)
+        controller.reserve('ana')
+        self.assertEqual(controller.reserve('luis')[1], 'global')
+
+    @override_settings(ADMISSION_POLICIES={
+        'enroll': {'rate': 100, 'burst': 100, 'user_rate': 0.1, 'user_burst': 1},
+        'enrolled_courses': {'rate': 100, 'burst': 100, 'user_rate': 1, 'user_burst': 1},
+    })
+    def test_enroll_returns_429_with_retry_after(self):
+        Course.objects.create(moodle_id=80, name='Lanzamiento', synced_at=timezone.now())
+        user = CustomUser.objects.create_user(username='pico', email='pico@example.com', password=None)
+        self.client.force_login(user)
+        shed = metrics.ADMISSION_SHED.value(('enroll', 'user'))
+        first = self.client.post('/api/enroll/', {'courseid': 80}, content_type='application/json')
+        second = self.client.post('/api/enroll/', {'courseid': 80}, content_type='application/json')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual((second.status_code, second['Retry-After']), (429, '10'))
+        self.assertEqual(metrics.ADMISSION_SHED.value(('enroll', 'user')), shed + 1)
+
+    def test_sync_views_wait_for_a_token(self):
+        view = admission_control('prueba')(lambda request: HttpResponse('ok'))
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        with override_settings(ADMISSION_POLICIES={
+                'prueba': {'rate': 20, 'burst': 1, 'user_rate': 100, 'user_burst': 100}}):
+            start = time.monotonic()
+            self.assertEqual([view(request).status_code for _ in range(2)], [200, 200])
+            self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n',
+                   MOODLE_THROTTLE_MAX_WAIT=0.05)
+class MoodleThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(MOODLE_MAX_CONCURRENT_CALLS=1)
+    def test_concurrency_limit_is_shared_through_the_cache(self):
+        client = MoodleClient(retry_backoff=0)
+        shed = metrics.MOODLE_THROTTLED.value(('core_webservice_get_site_info', 'concurrency'))
+        with throttle.limit('core_course_get_courses'), \
+                mock.patch.object(client.session, 'get') as get:
+            with self.assertRaises(MoodleThrottled):
+                client.call('core_webservice_get_site_info')
+        get.assert_not_called()
+        self.assertEqual(breaker.state('core_webservice_get_site_info'), 'closed')
+        self.assertEqual(metrics.MOODLE_THROTTLED.value(('core_webservice_get_site_info', 'concurrency')), shed + 1)
+
+        # Liberado el hueco, la llamada pasa.
+        with mock.patch.object(client.session, 'get', return_value=fake_response({'userid': 3})):
+            self.assertEqual(client.call('core_webservice_get_site_info'), {'userid': 3})
+
+    @override_settings(MOODLE_MAX_CONCURRENT_CALLS=1, MOODLE_BREAKER_FAILURE_THRESHOLD=1,
+                       MOODLE_BREAKER_RECOVERY_TIMEOUT=30)
+    def test_throttled_probe_is_given_back_to_the_breaker(self):
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        breaker.record_failure('core_webservice_get_site_info')
+        breaker._states['core_webservice_get_site_info'].opened_at -= 31
+        client = MoodleClient(retry_backoff=0)
+        with throttle.limit('core_course_get_courses'), self.assertRaises(MoodleThrottled):
+            client.call('core_webservice_get_site_info')
+        self.assertEqual(breaker.state('core_webservice_get_site_info'), 'open')
+        # La siguiente llamada vuelve a ser la prueba, sin esperar a que caduque.
+        with mock.patch.object(client.session, 'get', return_value=fake_response({'userid': 3})):
+            self.assertEqual(client.call('core_webservice_get_site_info'), {'userid': 3})
+        self.assertEqual(breaker.state('core_webservice_get_site_info'), 'closed')
+
+    @override_settings(MOODLE_MAX_CALLS_PER_SECOND=3, MOODLE_FUNCTION_RATE_LIMITS={'core_course_get_courses': 1})
+    def test_per_second_limits(self):
+        client = MoodleClient(retry_backoff=0)
+        with mock.patch.object(throttle, '_current_second', return_value=1000), \
+                mock.patch.object(client.session, 'get', return_value=fake_response([])):
+            client.call('core_course_get_courses')
+            with self.assertRaises(MoodleThrottled):
+                client.call('core_course_get_courses')
+            client.call('core_enrol_get_users_courses', userid=1)
+            client.call('core_enrol_get_users_courses', userid=1)
+            with self.assertRaises(MoodleThrottled):
+                client.call('core_enrol_get_users_courses', userid=1)
+
+    @override_settings(MOODLE_MAX_CONCURRENT_CALLS=1)
+    def test_async_client_is_limited_too(self):
+        async def scenario():
+            async with throttle.alimit('core_course_get_courses'):
+                with self.assertRaises(MoodleThrottled):
+                    await AsyncMoodleClient().call('core_webservice_get_site_info')
+        asyncio.run(scenario())
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n',
+                   PROFILING_ENABLED=True, PROFILING_INTERVAL=0.001)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.profile_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_root.cleanup)
+        override = override_settings(PROFILING_ROOT=self.profile_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.staff = CustomUser.objects.create_user(username='perfil', email='perfil@example.com', password=None,
+                                                    is_staff=True)
+        course = Course.objects.create(moodle_id=90, name='Perfilado')
+        Enrollment.objects.create(user=self.staff, course=course)
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_middleware_leaves_the_chain(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: HttpResponse())
+        self.assertIsNone(self.client.get('/api/profiles/').get('X-Profile-Id'))
+
+    def test_staff_header_profiles_streaming_export(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/export/90/', HTTP_X_PROFILE='1')
+        profile_id = response['X-Profile-Id']
+        # El perfil se guarda al terminar de recorrer la respuesta.
+        self.assertEqual(self.client.get('/api/profiles/').json()['profiles'], [])
+        b''.join(response.streaming_content)
+
+        [summary] = self.client.get('/api/profiles/').json()['profiles']
+        self.assertEqual((summary['id'], summary['trigger'], summary['view'], summary['user'], summary['status']),
+                         (profile_id, 'header', 'export_enrollments', 'perfil@example.com', 200))
+        self.assertGreaterEqual(summary['sql']['count'], 2)
+        self.assertIn('SELECT moodle_api_enrollment', [q['statement'] for q in summary['sql']['top']])
+
+        download = self.client.get(summary['url'])
+        self.assertEqual(download.status_code, 200)
+        for line in b''.join(download.streaming_content).decode().splitlines():
+            self.assertRegex(line, r'^\S.* \d+$')
+
+    def test_header_from_non_staff_is_ignored(self):
+        user = CustomUser.objects.create_user(username='curioso', email='curioso@example.com', password=None)
+        self.client.force_login(user)
+        response = self.client.get('/api/my-courses/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 403)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_MAX_PROFILES=2)
+    def test_sampled_requests_keep_only_the_newest_profiles(self):
+        ids = [self.client.get('/api/courses/search/', {'q': 'perfil'})['X-Profile-Id'] for _ in range(3)]
+        self.client.force_login(self.staff)
+        profiles = self.client.get('/api/profiles/').json()['profiles']
+        # La lista también se muestrea, pero su perfil se guarda después de responder.
+        self.assertEqual([p['id'] for p in profiles], [ids[2], ids[1]])
+        self.assertEqual({p['trigger'] for p in profiles}, {'sample'})
+        self.assertIsNone(profiles[0]['user'])
+        self.assertEqual(self.client.get(f'/api/profiles/{ids[0]}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/profiles/..%2Fsettings/').status_code, 404)
+
+    def test_moodle_calls_appear_as_pseudo_frames(self):
+        client = MoodleClient(retry_backoff=0)
+
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            return fake_response({'userid': 3})
+
+        profile = profiling.Profile(threading.get_ident(), 'sample')
+        with profile.recording(), mock.patch.object(client.session, 'get', side_effect=slow_get):
+            client.call('core_webservice_get_site_info')
+        profile.stop()
+        self.assertEqual(profile.moodle_calls['core_webservice_get_site_info'][0], 1)
+        self.assertGreaterEqual(profile.moodle_calls['core_webservice_get_site_info'][1], 0.05)
+        leaves = {stack.rsplit(';', 1)[-1] for stack in profile.stacks}
+        self.assertIn('[moodle] core_webservice_get_site_info', leaves)
+
+    def test_async_profile_samples_the_request_sync_thread_not_the_loop(self):
+        def sync_work():
+            # Lo que hace sync_to_async: el hilo corre con el contexto de la petición.
+            profiling._profile_query(lambda *args: time.sleep(0.05), 'SELECT 1 FROM "moodle_api_course"',
+                                     None, False, {})
+
+        profile = profiling.Profile(None, 'sample')
+        with profile.recording():
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(sync_work,))
+            worker.start()
+            worker.join()
+        profile.stop()
+        self.assertEqual(profile.thread_ids, {worker.ident})
+        self.assertTrue(profile.summary()['asynchronous'])
+        self.assertIn('[sql] SELECT moodle_api_course', {stack.rsplit(';', 1)[-1] for stack in profile.stacks})
+        # Todas las pilas son del hilo de trabajo, ninguna del hilo que espera (el «loop»).
+        self.assertTrue(all(stack.startswith('threading:Thread._bootstrap;') for stack in profile.stacks))
+
+    def test_sql_shape(self):
+        self.assertEqual(profiling.sql_shape('SELECT "a"."id" FROM "moodle_api_course" WHERE 1'),
+                         'SELECT moodle_api_course')
+        self.assertEqual(profiling.sql_shape('INSERT INTO "moodle_api_enrollment" VALUES (1)'),
+                         'INSERT moodle_api_enrollment')
+        self.assertEqual(profiling.sql_shape('SAVEPOINT "s1"'), 'SAVEPOINT')
+
+
+@override_settings(MOODLE_URL='http://moodle.test/webservice/rest/server.php', MOODLE_TOKEN='t0k3n')
+class MetricsTests(TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_latency_seconds', 'Prueba.', ['view'], buckets=(0.1, 1))
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(('inicio',), value)
+        threading.Thread(target=histogram.observe, args=(('inicio',), 0.2)).start()
+        time.sleep(0.05)
+        self.assertEqual(histogram.render()[2:], [
+            'test_latency_seconds_bucket{view="inicio",le="0.1"} 1',
+            'test_latency_seconds_bucket{view="inicio",le="1"} 3',
+            'test_latency_seconds_bucket{view="inicio",le="+Inf"} 4',
+            'test_latency_seconds_sum{view="inicio"} 5.75',
+            'test_latency_seconds_count{view="inicio"} 4',
+        ])
+
+    def test_finished_threads_are_folded_into_one_shard(self):
+        counter = metrics.Counter('test_events_total', 'Prueba.', ['kind'])
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+        for _ in range(50):
+            worker = threading.Thread(target=counter.inc, args=(('a',), 2))
+            worker.start()
+            worker.join()
+        self.assertLessEqual(len(counter._shards), 1)
+        counter.inc(('a',))
+        self.assertEqual(counter.value(('a',)), 101)
+        self.assertEqual(len(counter._shards), 1)
+        self.assertEqual(counter.render()[2:], ['test_events_total{kind="a"} 101'])
+
+    @staticmethod
+    def sample(body, series):
+        for line in body.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_views_and_moodle_calls_are_measured(self):
+        course = Course.objects.create(moodle_id=50, name='Métricas', summary='')
+        user = CustomUser.objects.create_user(username='m', email='m@example.com', password=None)
+        Enrollment.objects.create(user=user, course=course)
+        queries = 'http_request_db_queries_sum{view="export_enrollments"}'
+        errors = 'moodle_call_errors_total{wsfunction="core_course_get_courses",error="MoodleUnavailable"}'
+        before = metrics.render()
+
+        b''.join(self.client.get('/api/export/50/').streaming_content)
+        client = MoodleClient(retry_backoff=0, max_retries=0)
+        with mock.patch.object(client.session, 'get', side_effect=requests.Timeout('lento')):
+            with self.assertRaises(MoodleUnavailable):
+                client.call('core_course_get_courses')
+
+        after = self.client.get('/metrics').content.decode()
+        # Las dos consultas del export se cuentan aunque ocurran al recorrer el streaming.
+        self.assertEqual(self.sample(after, queries) - self.sample(before, queries), 2)
+        self.assertEqual(self.sample(after, errors) - self.sample(before, errors), 1)
+        self.assertGreater(self.sample(after, 'http_response_size_bytes_sum{view="export_enrollments"}'), 0)
+
+    @override_settings(METRICS_ALLOWED_NETWORKS=['10.0.0.0/8'])
+    def test_metrics_are_only_served_to_allowed_networks_and_staff(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        user = CustomUser.objects.create_user(username='m', email='m@example.com', password=None)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        user.is_staff = True
+        user.save(update_fields=['is_staff'])
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class FakeMoodleServerTests(SimpleTestCase):
+    def test_client_against_fake_server(self):
+        with FakeMoodleServer(catalog_size=30) as moodle:
+            client = MoodleClient(url=moodle.url, token='t', retry_backoff=0)
+            self.assertEqual(client.call('core_webservice_get_site_info')['userid'], 2)
+            self.assertEqual(len(client.call('core_course_get_courses')), 31)
+            courses = client.call('core_course_get_courses', options={'ids': [4, 9, 500]})
+            self.assertEqual([c['id'] for c in courses], [4, 9])
+            with self.assertRaises(MoodleAPIError):
+                client.call('core_funcion_inexistente')
+
+    def test_injected_errors_and_latency(self):
+        with FakeMoodleServer(error_rate=1.0, latency=0.05) as moodle:
+            client = MoodleClient(url=moodle.url, token='t', retry_backoff=0, max_retries=1)
+            start = time.monotonic()
+            with self.assertRaises(MoodleUnavailable), self.assertLogs('moodle_api.client', 'WARNING'):
+                client.call('core_webservice_get_site_info')
+            self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(len(moodle.calls), 2)
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def test_compare_flags_regressions(self):
+        baseline = {'login': {'8': {'p99_ms': 100, 'rps': 50, 'queries_avg': 4}, 'peak_memory_kib': 10}}
+        ok = {'login': {'8': {'p99_ms': 110, 'rps': 45, 'queries_avg': 4}, 'peak_memory_kib': 12}}
+        slow = {'login': {'8': {'p99_ms': 200, 'rps': 20, 'queries_avg': 6}}}
+        self.assertEqual(benchmark.compare(ok, baseline, tolerance=0.25), [])
+        self.assertEqual(len(benchmark.compare(slow, baseline, tolerance=0.25)), 3)
@@ -0,0 +1,173 @@
+# moodle_api/throttle.py
+"""
+Límite de las llamadas salientes a Moodle, compartido entre workers a
+través de la caché de Django.
+
+- Concurrencia: ``MOODLE_MAX_CONCURRENT_CALLS`` huecos, cada uno una clave
+  de la caché que se toma con ``add`` y caduca sola (``MOODLE_CALL_LEASE``)
+  si el worker que la tenía muere sin liberarla.
+- Ritmo: como mucho ``MOODLE_MAX_CALLS_PER_SECOND`` llamadas por segundo en
+  total y, con ``MOODLE_FUNCTION_RATE_LIMITS``, por función, contadas con
+  ``incr`` en una clave por segundo.
+
+Una llamada que no consigue hueco en ``MOODLE_THROTTLE_MAX_WAIT`` segundos
+no se envía: el cliente lanza ``MoodleThrottled`` y las vistas la tratan
+como Moodle no disponible (sirven la copia obsoleta si la hay). Un límite a
+0 lo desactiva.
+"""
+import asyncio
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+POLL_INTERVAL = 0.02
+
+
+class ThrottleTimeout(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _current_second():
+    return int(time.time())
+
+
+def _rate_keys(wsfunction, second):
+    keys = []
+    if settings.MOODLE_MAX_CALLS_PER_SECOND:
+        keys.append((f'moodle:throttle:rate:*:{second}', settings.MOODLE_MAX_CALLS_PER_SECOND))
+    limit = settings.MOODLE_FUNCTION_RATE_LIMITS.get(wsfunction)
+    if limit:
+        keys.append((f'moodle:throttle:rate:{wsfunction}:{second}', limit))
+    return keys
+
+
+def _slot_keys():
+    slots = [f'moodle:throttle:slot:{i}' for i in range(settings.MOODLE_MAX_CONCURRENT_CALLS)]
+    # Empezar por un hueco al azar reparte las claves entre workers.
+    start = random.randrange(len(slots)) if slots else 0
+    return slots[start:] + slots[:start]
+
+
+def _try_rate(wsfunction):
+    """Cuenta la llamada en el segundo actual. Devuelve False si algún límite ya está lleno."""
+    second = _current_second()
+    counted = []
+    for key, limit in _rate_keys(wsfunction, second):
+        cache.add(key, 0, 2)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # La clave caducó entre add e incr.
+            cache.add(key, 1, 2)
+            count = 1
+        counted.append(key)
+        if count > limit:
+            for counted_key in counted:
+                _decr(counted_key)
+            return False
+    return True
+
+
+def _decr(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        pass
+
+
+def _try_slot(token):
+    for key in _slot_keys():
+        if cache.add(key, token, settings.MOODLE_CALL_LEASE):
+            return key
+    return None
+
+
+def _release(key, token):
+    if key is not None and cache.get(key) == token:
+        cache.delete(key)
+
+
+def _shed(wsfunction, reason):
+    metrics.MOODLE_THROTTLED.inc((wsfunction, reason))
+    raise ThrottleTimeout(reason)
+
+
+@contextmanager
+def limit(wsfunction):
+    """Reserva un hueco para una llamada a ``wsfunction`` o lanza ``ThrottleTimeout``."""
+    deadline = time.monotonic() + settings.MOODLE_THROTTLE_MAX_WAIT
+    while not _try_rate(wsfunction):
+        if time.monotonic() >= deadline:
+            _shed(wsfunction, 'rate')
+        time.sleep(POLL_INTERVAL)
+
+    token = uuid.uuid4().hex
+    slot = None
+    if settings.MOODLE_MAX_CONCURRENT_CALLS:
+        while (slot := _try_slot(token)) is None:
+            if time.monotonic() >= deadline:
+                _shed(wsfunction, 'concurrency')
+            time.sleep(POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        _release(slot, token)
+
+
+async def _atry_rate(wsfunction):
+    second = _current_second()
+    counted = []
+    for key, limit in _rate_keys(wsfunction, second):
+        await cache.aadd(key, 0, 2)
+        try:
+            count = await cache.aincr(key)
+        except ValueError:
+            await cache.aadd(key, 1, 2)
+            count = 1
+        counted.append(key)
+        if count > limit:
+            for counted_key in counted:
+                try:
+                    await cache.adecr(counted_key)
+                except ValueError:
+                    pass
+            return False
+    return True
+
+
+async def _atry_slot(token):
+    for key in _slot_keys():
+        if await cache.aadd(key, token, settings.MOODLE_CALL_LEASE):
+            return key
+    return None
+
+
+@asynccontextmanager
+async def alimit(wsfunction):
+    """Versión asíncrona de ``limit``."""
+    deadline = time.monotonic() + settings.MOODLE_THROTTLE_MAX_WAIT
+    while not await _atry_rate(wsfunction):
+        if time.monotonic() >= deadline:
+            _shed(wsfunction, 'rate')
+        await asyncio.sleep(POLL_INTERVAL)
+
+    token = uuid.uuid4().hex
+    slot = None
+    if settings.MOODLE_MAX_CONCURRENT_CALLS:
+        while (slot := await _atry_slot(token)) is None:
+            if time.monotonic() >= deadline:
+                _shed(wsfunction, 'concurrency')
+            await asyncio.sleep(POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        if slot is not None and await cache.aget(slot) == token:
+            await cache.adelete(slot)
@@ -1,9 +1,27 @@
 from django.urls import path
-from .views import GetEnrolledCourses, GetUserSiteInfo,EnrollUserView,ExportCourseUsersView
+from .admission import admission_control
+from .views import (
+    GetEnrolledCourses, GetUserSiteInfo, EnrollUserView, BatchEnrollView, ExportCourseUsersView,
+    ExportJobCreateView, ExportJobStatusView, ExportJobDownloadView, MyCoursesView,
+    EnrollmentAnalyticsView, CourseSearchView, CourseImageView, IncrementalExportView, ProfileListView,
+    ProfileDownloadView,
+)
 
 urlpatterns = [
     path('site-info/', GetUserSiteInfo.as_view(), name='get_site_info'),
-    path('enrolled-courses/', GetEnrolledCourses.as_view(), name='get_enrolled_courses'),
-    path('enroll/', EnrollUserView.as_view(), name='enroll'),
+    path('enrolled-courses/', admission_control('enrolled_courses')(GetEnrolledCourses.as_view()),
+         name='get_enrolled_courses'),
+    path('courses/search/', CourseSearchView.as_view(), name='course_search'),
+    path('courses/<int:moodle_id>/image/<str:variant>/', CourseImageView.as_view(), name='course_image'),
+    path('my-courses/', MyCoursesView.as_view(), name='my_courses'),
+    path('enroll/', admission_control('enroll')(EnrollUserView.as_view()), name='enroll'),
+    path('enroll/batch/', BatchEnrollView.as_view(), name='enroll_batch'),
     path('export/<int:course_id>/', ExportCourseUsersView.as_view(), name='export_enrollments'),
+    path('export/enrollments/', IncrementalExportView.as_view(), name='export_incremental'),
+    path('export-jobs/', ExportJobCreateView.as_view(), name='export_job_create'),
+    path('export-jobs/<int:job_id>/', ExportJobStatusView.as_view(), name='export_job_status'),
+    path('export-jobs/<int:job_id>/download/', ExportJobDownloadView.as_view(), name='export_job_download'),
+    path('analytics/enrollments/', EnrollmentAnalyticsView.as_view(), name='enrollment_analytics'),
+    path('profiles/', ProfileListView.as_view(), name='profile_list'),
+    path('profiles/<str:profile_id>/', ProfileDownloadView.as_view(), name='profile_download'),
 ]
\ No newline at end of file
@@ -1,185 +1,522 @@
 # moodle_api/views.py
-import os
-import requests
+import asyncio
 import csv
+import hashlib
+import io
 import json
-from dotenv import load_dotenv
-from django.http import JsonResponse
+import logging
+import os
+from collections import Counter
+from datetime import date
+from django.contrib.auth import get_user_model
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from users.models import UserProfile
-from .models import Course, Enrollment
+from .analytics import course_stats
+from .client import MoodleError, MoodleUnavailable
+from .enrollment import ALREADY_ENROLLED, COURSE_FULL, bulk_enroll
+from .groupcommit import aenroll
+from .jsoncodec import JsonResponse, LazyJSON
+from .images import IMAGE_VARIANTS, image_etag, image_version, open_variant, proxy_url
+from .exports import (
+    buffered, enrollment_rows, gzip_stream, incremental_values, iter_csv, iter_incremental_csv, iter_ndjson,
+)
+from . import metrics, profiling
+from .jobs import create_export_job, export_path
+from .models import Course, Enrollment, ExportJob
+from .pagination import InvalidCursor, paginate_desc
+from .search import search_courses
+from .services import (
+    aget_or_fetch_course, aget_site_info_or_stale, aget_users_courses_or_stale, alocal_courses, course_payload,
+    get_or_fetch_course, resolve_courses,
+)
 from django.http import HttpResponse
 
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
 
-load_dotenv()
+def mark_stale(response):
+    """Marca una respuesta servida desde la copia local mientras Moodle no responde."""
+    response['X-Moodle-Stale'] = '1'
+    response['Warning'] = '110 - "Response is Stale"'
+    return response
 
-MOODLE_URL = os.getenv("MOODLE_URL")
-MOODLE_TOKEN = os.getenv("MOODLE_TOKEN")
 
 class GetUserSiteInfo(View):
-    def get(self, request):
-        params = {
-            'wstoken': MOODLE_TOKEN,
-            'wsfunction': 'core_webservice_get_site_info',
-            'moodlewsrestformat': 'json'
-        }
+    async def get(self, request):
         try:
-            response = requests.get(MOODLE_URL, params=params)
-            return JsonResponse(response.json())
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=500)
+            site_info, stale = await aget_site_info_or_stale()
+        except MoodleError as e:
+            return JsonResponse({'error': str(e)}, status=502)
+        response = JsonResponse(site_info)
+        return mark_stale(response) if stale else response
+
+async def _proxy_course_images(courses):
+    """Cambia ``courseimage`` de Moodle por el proxy para los cursos con imagen en el catálogo local."""
+    if isinstance(courses, LazyJSON) and not courses.mentions(b'"courseimage"'):
+        # Nada que cambiar: la respuesta de Moodle se reenvía sin decodificar.
+        return
+    ids = [c['id'] for c in courses if isinstance(c, dict) and c.get('courseimage') and 'id' in c]
+    if not ids:
+        return
+    local = {
+        course.moodle_id: course
+        async for course in Course.objects.filter(moodle_id__in=ids, image_url__isnull=False)
+        .only('moodle_id', 'image_url', 'timemodified')
+    }
+    for c in courses:
+        if isinstance(c, dict) and c.get('courseimage') and c.get('id') in local:
+            c['courseimage'] = proxy_url(local[c['id']])
+
 
 class GetEnrolledCourses(View):
+    async def get(self, request):
+        try:
+            # Paso 1: Obtener el userid del usuario asociado al token (en caché)
+            try:
+                site_info, stale = await aget_site_info_or_stale()
+            except MoodleUnavailable:
+                # Moodle caído y sin copia previa: se sirve el catálogo local
+                return mark_stale(JsonResponse(await alocal_courses(), safe=False))
+
+            if 'userid' not in site_info:
+                return JsonResponse({'error': 'No se pudo obtener el userid del usuario'}, status=400)
+
+            # Paso 2: Obtener los cursos inscritos (o la última copia si Moodle no responde)
+            courses, courses_stale = await aget_users_courses_or_stale(site_info['userid'])
+            await _proxy_course_images(courses)
+            response = JsonResponse(courses, safe=False)
+            return mark_stale(response) if stale or courses_stale else response
+        except MoodleError as e:
+            return JsonResponse({'error': str(e)}, status=502)
+        
+
+SEARCH_DEFAULT_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+
+
+class CourseSearchView(View):
+    """
+    Búsqueda en el catálogo local: ``?q=`` (cada palabra como prefijo),
+    ``?category=`` y paginación con ``?page=`` y ``?page_size=``.
+    """
+
     def get(self, request):
-        # Paso 1: Obtener el userid del usuario asociado al token
-        site_info_url = f"{MOODLE_URL}?wstoken={MOODLE_TOKEN}&wsfunction=core_webservice_get_site_info&moodlewsrestformat=json"
-        site_info_response = requests.get(site_info_url)
-        site_info = site_info_response.json()
+        query = request.GET.get('q', '').strip()
+        if not query:
+            return JsonResponse({'error': 'Falta el texto a buscar'}, status=400)
+        try:
+            category = int(request.GET['category']) if request.GET.get('category') else None
+            page = max(int(request.GET.get('page', 1)), 1)
+            page_size = min(max(int(request.GET.get('page_size', SEARCH_DEFAULT_PAGE_SIZE)), 1),
+                            SEARCH_MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'error': 'Parámetros no válidos'}, status=400)
+
+        # Se pide un resultado de más para saber si hay otra página sin contar.
+        courses = search_courses(query, category, limit=page_size + 1, offset=(page - 1) * page_size)
+        return JsonResponse({
+            'results': [course_payload(course) for course in courses[:page_size]],
+            'page': page,
+            'has_next': len(courses) > page_size,
+        })
+
+
+# Vida en caché de las imágenes versionadas (inmutables) y de las que no lo están.
+IMAGE_MAX_AGE = 365 * 24 * 3600
+IMAGE_REVALIDATE_AGE = 300
+
+
+class CourseImageView(View):
+    """
+    Imagen de un curso redimensionada (``thumb`` o ``card``) servida desde la
+    caché en disco de images.py. Con el ``?v=`` actual de la imagen (el que
+    devuelve ``course_payload``) la respuesta es inmutable durante un año;
+    sin él el navegador revalida con ``If-None-Match``.
+    """
+
+    def get(self, request, moodle_id, variant):
+        if variant not in IMAGE_VARIANTS:
+            return JsonResponse({'error': 'Variante de imagen no válida'}, status=404)
+        image_url, timemodified = (
+            Course.objects.filter(moodle_id=moodle_id).values_list('image_url', 'timemodified').first() or (None, None))
+        if not image_url:
+            return JsonResponse({'error': 'El curso no tiene imagen'}, status=404)
+
+        version = image_version(image_url, timemodified)
+        etag = image_etag(version, variant)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                f = open_variant(image_url, version, variant)
+            except MoodleError as e:
+                logger.warning('No se pudo obtener la imagen del curso %s: %s', moodle_id, e)
+                return JsonResponse({'error': str(e)}, status=502)
+            response = FileResponse(f, content_type='image/jpeg')
+        response['ETag'] = etag
+        if request.GET.get('v') == version:
+            patch_cache_control(response, public=True, max_age=IMAGE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=IMAGE_REVALIDATE_AGE)
+        return response
 
-        if 'userid' not in site_info:
-            return JsonResponse({'error': 'No se pudo obtener el userid del usuario'}, status=400)
 
-        user_id = site_info['userid']
+# Campos que puede pedir ``?fields=`` en "mis cursos" y su origen en la consulta.
+MY_COURSE_FIELDS = {
+    'id': 'course__moodle_id',
+    'fullname': 'course__name',
+    'summary': 'course__summary',
+    'category': 'course__category',
+    'startdate': 'course__startdate',
+    'enddate': 'course__enddate',
+    'image_url': 'course__image_url',
+    'enrollment_count': 'course__enrollment_count',
+    'seat_limit': 'course__seat_limit',
+    'enrolled_at': 'enrolled_at',
+}
+MY_COURSES_DEFAULT_LIMIT = 20
+MY_COURSES_MAX_LIMIT = 100
 
-        # Paso 2: Obtener los cursos inscritos
-        params = {
-            'wstoken': MOODLE_TOKEN,
-            'wsfunction': 'core_enrol_get_users_courses',
-            'moodlewsrestformat': 'json',
-            'userid': user_id,
-            
-        }
 
+class MyCoursesView(View):
+    """
+    Cursos en los que está matriculado el usuario, leídos solo de la base de
+    datos local. Se pagina con ``?cursor=`` (el ``next`` de la página
+    anterior) y ``?limit=``, y ``?fields=id,fullname`` limita los campos.
+    La respuesta lleva ETag para que el cliente pueda revalidar con
+    ``If-None-Match`` y recibir un 304.
+    """
+
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Debes iniciar sesión'}, status=401)
+
+        fields = [f for f in request.GET.get('fields', '').split(',') if f] or list(MY_COURSE_FIELDS)
+        unknown = sorted(set(fields) - MY_COURSE_FIELDS.keys())
+        if unknown:
+            return JsonResponse({'error': f"Campos no válidos: {', '.join(unknown)}"}, status=400)
         try:
-            response = requests.get(MOODLE_URL, params=params)
-            return JsonResponse(response.json(), safe=False)
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=500)
-        
+            limit = min(int(request.GET.get('limit', MY_COURSES_DEFAULT_LIMIT)), MY_COURSES_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'error': 'El límite debe ser un número'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'El límite debe ser positivo'}, status=400)
+
+        lookups = {MY_COURSE_FIELDS[f] for f in fields}
+        queryset = Enrollment.objects.filter(user=request.user).values('id', 'enrolled_at', *lookups)
+        try:
+            rows, next_cursor = paginate_desc(queryset, 'enrolled_at', request.GET.get('cursor'), limit)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        results = [{f: row[MY_COURSE_FIELDS[f]] for f in fields} for row in rows]
+        response = JsonResponse({'results': results, 'next': next_cursor})
+        etag = '"%s"' % hashlib.md5(response.content, usedforsecurity=False).hexdigest()
+        response['ETag'] = etag
+        # Respuesta por usuario: solo la cachea el navegador y siempre revalida.
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie', 'Authorization'])
+        return get_conditional_response(request, etag=etag, response=response)
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class EnrollUserView(View):
-    def post(self, request):
+    async def post(self, request):
         try:
             data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'JSON no válido'}, status=400)
+        try:
             course_id = data.get('courseid')
 
             if not course_id:
                 return JsonResponse({'error': 'Falta el ID del curso'}, status=400)
 
             # 1. Verificar si el usuario está autenticado
-            if not request.user.is_authenticated:
+            user = await request.auser()
+            if not user.is_authenticated:
                 return JsonResponse({'error': 'Debes iniciar sesión'}, status=401)
 
-            # 2. Buscar o crear curso localmente
-            course, created = Course.objects.get_or_create(
-                moodle_id=course_id,
-                defaults={
-                    'name': f'Curso {course_id}',
-                    'summary': '',
-                    'category': 3  # Por defecto categoría MOOC
-                }
+            # 2. Buscar el curso en el catálogo local (solo se consulta Moodle
+            #    si todavía no se ha sincronizado) y, a la vez, comprobar si ya
+            #    existe la matrícula
+            course, already_enrolled = await asyncio.gather(
+                aget_or_fetch_course(course_id, defaults={'category': 3}),
+                Enrollment.objects.filter(user=user, course__moodle_id=course_id).aexists(),
             )
+            if already_enrolled:
+                return JsonResponse({'message': 'Ya estás matriculado en este curso'})
+
+            # 3. Crear la matrícula local reservando plaza en la misma transacción
+            #    (agrupada con las demás matrículas simultáneas, ver groupcommit.py)
+            status = await aenroll(user, course)
 
-            # 3. Si se creó, sincronizar con Moodle para obtener datos reales
-            if created:
-                params = {
-                    'wstoken': MOODLE_TOKEN,
-                    'wsfunction': 'core_course_get_courses',
-                    'moodlewsrestformat': 'json',
-                    'courseids[0]': course_id
-                }
-
-                response = requests.get(MOODLE_URL, params=params)
-                if response.status_code == 200:
-                    course_data = response.json()[0]
-                    course.name = course_data['fullname']
-                    course.summary = course_data.get('summary', '')
-                    course.category = course_data.get('categoryid', 3)
-                    course.save()
-
-            # 4. Crear la matrícula local
-            user = request.user
-            enrollment, created = Enrollment.objects.get_or_create(user=user, course=course)
-
-            if not created:
+            if status == ALREADY_ENROLLED:
                 return JsonResponse({'message': 'Ya estás matriculado en este curso'})
+            if status == COURSE_FULL:
+                return JsonResponse({'error': 'El curso no tiene plazas disponibles'}, status=409)
 
             return JsonResponse({
                 'message': '¡Matrícula exitosa!',
                 'course_name': course.name
             })
 
-        except Exception as e:
-            print("Error al matricular:", str(e))
-            return HttpResponse(f"Ocurrió un error en el servidor: {str(e)}")
-
-def get_course_from_moodle(course_id):
-    """Obtiene los datos del curso desde Moodle"""
-    params = {
-        'wstoken': os.getenv('MOODLE_TOKEN'),
-        'wsfunction': 'core_course_get_courses',
-        'moodlewsrestformat': 'json',
-        'courseids[0]': course_id
-    }
-    response = requests.get(os.getenv('MOODLE_URL'), params=params)
-    if response.status_code == 200:
-        data = response.json()
-        if isinstance(data, list) and len(data) > 0:
-            return data[0]
-    return None
+        except Exception:
+            logger.exception("Error al matricular")
+            return JsonResponse({'error': 'Ocurrió un error en el servidor al matricular'}, status=500)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchEnrollView(View):
+    """
+    Matricula muchos usuarios a la vez. Acepta JSON
+    ``{"enrollments": [{"email": ..., "courseid": ...}, ...]}`` o un CSV
+    subido en el campo ``file`` con las columnas ``email`` y ``courseid``.
+    """
+
+    def post(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede matricular en bloque'}, status=403)
+
+        try:
+            rows = self.read_rows(request)
+        except (ValueError, KeyError) as e:
+            return JsonResponse({'error': f'Formato de entrada no válido: {e}'}, status=400)
+
+        results = []
+        valid = []
+        for index, row in enumerate(rows):
+            email = (row.get('email') or '').strip()
+            try:
+                course_id = int(row.get('courseid'))
+            except (TypeError, ValueError):
+                course_id = None
+            result = {'row': index, 'email': email, 'courseid': course_id}
+            results.append(result)
+            if not email or course_id is None:
+                result.update(status='error', error='Faltan el correo o el ID del curso')
+            else:
+                valid.append(result)
+
+        # Una consulta para los usuarios y otra (más, como mucho, una llamada
+        # a Moodle) para los cursos.
+        users = dict(User.objects.filter(email__in={r['email'] for r in valid}).values_list('email', 'id'))
+        courses = resolve_courses({r['courseid'] for r in valid})
+
+        pairs = {}
+        for result in valid:
+            user_id = users.get(result['email'])
+            course = courses.get(result['courseid'])
+            if user_id is None:
+                result.update(status='error', error='Usuario no registrado')
+            elif course is None:
+                result.update(status='error', error='Curso no encontrado en Moodle')
+            elif (user_id, course.pk) in pairs:
+                result.update(status='error', error='Fila repetida en el lote')
+            else:
+                pairs[(user_id, course.pk)] = result
+
+        for pair, status in bulk_enroll(pairs).items():
+            pairs[pair]['status'] = status
+
+        summary = Counter(result['status'] for result in results)
+        return JsonResponse({'summary': summary, 'results': results})
+
+    def read_rows(self, request):
+        upload = request.FILES.get('file')
+        if upload is not None:
+            return list(csv.DictReader(io.StringIO(upload.read().decode('utf-8-sig'))))
+        data = json.loads(request.body)
+        rows = data['enrollments']
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('"enrollments" debe ser una lista de objetos')
+        return rows
 
 class ExportCourseUsersView(View):
     def get(self, request, course_id):
         try:
-            # 1. Busca el curso local o lo crea si no existe
-            course, created = Course.objects.get_or_create(
-                moodle_id=course_id,
-                defaults={'name': f'Curso {course_id} (sin sincronizar)'}
-            )
+            # 1. Busca el curso en el catálogo local
+            course = get_or_fetch_course(course_id, defaults={'name': f'Curso {course_id} (sin sincronizar)'})
 
-            if created:
-                # Si acabamos de crearlo, obtenemos su nombre real desde Moodle
-                moodle_data = get_course_from_moodle(course_id)
-                if moodle_data:
-                    course.name = moodle_data['fullname']
-                    course.summary = moodle_data.get('summary', '')
-                    course.startdate = moodle_data.get('startdate')
-                    course.enddate = moodle_data.get('enddate')
-                    course.save()
-
-            # 2. Obtiene las matrículas locales
-            enrollments = Enrollment.objects.filter(course=course)
-
-            # 3. Prepara respuesta CSV
-            response = HttpResponse(content_type='text/csv')
+            # 2. Genera el CSV en streaming: una sola consulta leída por bloques
+            response = StreamingHttpResponse(iter_csv(enrollment_rows(course)), content_type='text/csv')
             response['Content-Disposition'] = f'attachment; filename="usuarios_curso_{course.name}.csv"'
 
-            writer = csv.writer(response)
-            writer.writerow([
-                'Nombre Completo',
-                'Correo Electrónico',
-                'Edad',
-                'País',
-                'Propósito',
-                'Fecha de Matrícula'
-            ])
-
-            for enrollment in enrollments:
-                user = enrollment.user
-                profile, created = UserProfile.objects.get_or_create(user=user)# Asegúrate de tener el related_name='profile' en UserProfile
-                writer.writerow([
-                    f"{user.first_name} {user.last_name}".strip(),
-                    user.email,
-                    profile.age or 'No disponible',
-                    profile.country or 'No disponible',
-                    profile.purpose or 'No disponible',
-                    enrollment.enrolled_at.strftime("%d/%m/%Y %H:%M")
-                ])
-
             return response
 
-        except Exception as e:
-            return HttpResponse(f"Error al exportar usuarios: {str(e)}")
\ No newline at end of file
+        except Exception:
+            logger.exception("Error al exportar usuarios")
+            return JsonResponse({'error': 'Error al exportar usuarios'}, status=500)
+
+
+INCREMENTAL_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', iter_incremental_csv),
+    'ndjson': ('application/x-ndjson', iter_ndjson),
+}
+
+
+class IncrementalExportView(View):
+    """
+    Matrículas nuevas desde el cursor ``?since=`` (de un curso con
+    ``?courseid=`` o de todos) en CSV o NDJSON (``?format=``), opcionalmente
+    comprimidas con ``?gzip=1`` y limitadas con ``?limit=``. El cursor para
+    la siguiente exportación va en la cabecera ``X-Next-Cursor``.
+    """
+
+    def get(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede exportar'}, status=403)
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in INCREMENTAL_FORMATS:
+            return JsonResponse({'error': f'Formato no soportado: {fmt}'}, status=400)
+        try:
+            limit = int(request.GET['limit']) if request.GET.get('limit') else None
+            courseid = int(request.GET['courseid']) if request.GET.get('courseid') else None
+        except ValueError:
+            return JsonResponse({'error': 'Parámetros no válidos'}, status=400)
+        if limit is not None and limit < 1:
+            return JsonResponse({'error': 'El límite debe ser positivo'}, status=400)
+
+        course = None
+        if courseid is not None:
+            course = Course.objects.filter(moodle_id=courseid).first()
+            if course is None:
+                return JsonResponse({'error': 'Curso no encontrado'}, status=404)
+        try:
+            values, next_cursor = incremental_values(course, request.GET.get('since'), limit)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        content_type, serialize = INCREMENTAL_FORMATS[fmt]
+        chunks = buffered(serialize(values))
+        filename = f"matriculas_{courseid or 'todas'}.{fmt}"
+        if request.GET.get('gzip') == '1':
+            chunks, content_type, filename = gzip_stream(chunks), 'application/gzip', filename + '.gz'
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+
+def export_job_payload(job):
+    payload = {
+        'id': job.pk,
+        'status': job.status,
+        'courseid': job.course.moodle_id if job.course_id else None,
+        'total_rows': job.total_rows,
+        'rows_written': job.rows_written,
+        'progress': round(job.rows_written / job.total_rows, 4) if job.total_rows else 1.0,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == ExportJob.DONE:
+        payload['download_url'] = reverse('export_job_download', args=[job.pk])
+    if job.status == ExportJob.FAILED:
+        payload['error'] = job.error
+    return payload
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ExportJobCreateView(View):
+    """Encola la exportación de un curso (``courseid``) o de todos si se omite."""
+
+    def post(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede exportar'}, status=403)
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'JSON no válido'}, status=400)
+
+        course = None
+        if data.get('courseid'):
+            course = get_or_fetch_course(data['courseid'], defaults={'name': f"Curso {data['courseid']} (sin sincronizar)"})
+        job, created = create_export_job(course, request.user)
+        return JsonResponse(export_job_payload(job), status=202 if created else 200)
+
+
+class ExportJobStatusView(View):
+    def get(self, request, job_id):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede exportar'}, status=403)
+        job = ExportJob.objects.select_related('course').filter(pk=job_id).first()
+        if job is None:
+            return JsonResponse({'error': 'Exportación no encontrada'}, status=404)
+        return JsonResponse(export_job_payload(job))
+
+
+class ExportJobDownloadView(View):
+    def get(self, request, job_id):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede exportar'}, status=403)
+        job = ExportJob.objects.select_related('course').filter(pk=job_id, status=ExportJob.DONE).first()
+        if job is None or not os.path.exists(export_path(job)):
+            return JsonResponse({'error': 'La exportación no está disponible'}, status=404)
+        name = f'usuarios_curso_{job.course.name}.csv' if job.course_id else 'usuarios_todos_los_cursos.csv'
+        return FileResponse(open(export_path(job), 'rb'), as_attachment=True, filename=name, content_type='text/csv')
+
+
+class EnrollmentAnalyticsView(View):
+    """
+    Matrículas por día, país, franja de edad y propósito, leídas de las
+    tablas de resumen. Filtros opcionales: ``courseid`` (id de Moodle),
+    ``from``/``to`` (AAAA-MM-DD, solo para la serie diaria) y ``top``
+    (número de propósitos devueltos).
+    """
+
+    def get(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede ver las estadísticas'}, status=403)
+        try:
+            date_from = date.fromisoformat(request.GET['from']) if request.GET.get('from') else None
+            date_to = date.fromisoformat(request.GET['to']) if request.GET.get('to') else None
+            top = int(request.GET.get('top', 20))
+        except ValueError:
+            return JsonResponse({'error': 'Parámetros no válidos'}, status=400)
+
+        course_ids = None
+        if request.GET.get('courseid'):
+            course = Course.objects.filter(moodle_id=request.GET['courseid']).only('pk').first()
+            if course is None:
+                return JsonResponse({'error': 'Curso no encontrado'}, status=404)
+            course_ids = [course.pk]
+        return JsonResponse(course_stats(course_ids, date_from, date_to, top))
+
+
+class MetricsView(View):
+    """Métricas del proceso en el formato de texto de Prometheus."""
+
+    def get(self, request):
+        if not metrics.scrape_allowed(request):
+            return JsonResponse({'error': 'Solo el personal autorizado puede ver las métricas'}, status=403)
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProfileListView(View):
+    """Perfiles capturados por ``ProfilingMiddleware``, del más reciente al más antiguo."""
+
+    def get(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede ver los perfiles'}, status=403)
+        profiles = profiling.list_profiles()
+        for profile in profiles:
+            profile['url'] = reverse('profile_download', args=[profile['id']])
+        return JsonResponse({'profiles': profiles})
+
+
+class ProfileDownloadView(View):
+    """Pilas del perfil en formato collapsed (flamegraph.pl, speedscope)."""
+
+    def get(self, request, profile_id):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede ver los perfiles'}, status=403)
+        path = profiling.collapsed_path(profile_id)
+        if path is None:
+            return JsonResponse({'error': 'Perfil no encontrado'}, status=404)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.collapsed',
+                            content_type='text/plain; charset=utf-8')
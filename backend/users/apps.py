@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        # Revoca los tokens de la API al cerrar sesión o desactivar la cuenta.
+        from . import signals  # noqa: F401
+        # Avisa en check --deploy si la caché no permite revocar tokens en todos los workers.
+        from . import checks  # noqa: F401
@@ -0,0 +1,21 @@
+# users/checks.py
+from django.conf import settings
+from django.core import checks
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.security, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """La revocación de tokens de la API (``tokens.py``) necesita una caché compartida."""
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Warning(
+        'La caché por defecto no se comparte entre procesos: un token de la API revocado '
+        'sigue valiendo hasta API_TOKEN_MAX_AGE segundos en los demás workers.',
+        hint='Configura CACHES con Redis, Memcached o la base de datos.',
+        id='users.W001',
+    )]
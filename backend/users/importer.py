@@ -0,0 +1,208 @@
+# users/importer.py
+"""
+Alta masiva de usuarios desde CSV o JSONL.
+
+Cada fila admite ``email`` (obligatorio), ``password``, ``name`` (o
+``first_name``/``last_name``), ``username``, ``age``, ``country`` y
+``purpose``. Los correos se comprueban contra la base de datos en bloque,
+las contraseñas se cifran en paralelo en un pool de procesos (PBKDF2 es
+intensivo en CPU y no se beneficia de hilos) y usuarios y perfiles se
+insertan con ``bulk_create`` en transacciones por bloques. Las filas con
+errores no detienen la importación: se devuelven en el informe.
+"""
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from .models import UserProfile
+
+User = get_user_model()
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'jsonl')
+# Correos por consulta al buscar duplicados (límite de parámetros de SQLite).
+LOOKUP_CHUNK_SIZE = 5000
+
+
+def read_rows(stream, fmt):
+    """Lee las filas de un fichero binario en formato ``csv`` o ``jsonl``."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    if fmt == 'csv':
+        return list(csv.DictReader(text))
+    if fmt == 'jsonl':
+        rows = []
+        for number, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f'Línea {number}: JSON no válido ({e})') from e
+                if not isinstance(row, dict):
+                    raise ValueError(f'Línea {number}: se esperaba un objeto')
+                rows.append(row)
+        return rows
+    raise ValueError(f'Formato no soportado: {fmt}')
+
+
+def format_from_name(name):
+    return 'jsonl' if name.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def _text(row, field):
+    """Valor de texto de ``field`` sin espacios alrededor ('' si falta)."""
+    value = row.get(field)
+    if value is None:
+        return ''
+    # En JSONL un campo puede llegar como número, lista u objeto.
+    if not isinstance(value, str):
+        raise ValidationError(f'El campo {field} debe ser texto')
+    return value.strip()
+
+
+def _clean(row):
+    """Valida una fila y devuelve los campos de usuario y perfil normalizados."""
+    email = User.objects.normalize_email(_text(row, 'email'))
+    if not email:
+        raise ValidationError('Falta el correo')
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValidationError('Correo no válido')
+
+    first_name, last_name = _text(row, 'first_name'), _text(row, 'last_name')
+    name = _text(row, 'name')
+    if not first_name and name:
+        # Igual que RegisterView: la primera palabra es el nombre.
+        names = name.split(' ', 1)
+        first_name, last_name = names[0], names[1] if len(names) > 1 else ''
+
+    age = row.get('age')
+    if age in (None, ''):
+        age = None
+    else:
+        try:
+            age = int(age)
+        except (TypeError, ValueError):
+            raise ValidationError('La edad debe ser un número')
+        if age < 0:
+            raise ValidationError('La edad debe ser un número')
+
+    password = row.get('password')
+    if password is not None and not isinstance(password, str):
+        raise ValidationError('El campo password debe ser texto')
+
+    return {
+        'email': email,
+        'username': _text(row, 'username') or email.split('@')[0],
+        'first_name': first_name[:150],
+        'last_name': last_name[:150],
+        'password': password or None,
+        'age': age,
+        'country': _text(row, 'country')[:100],
+        'purpose': _text(row, 'purpose'),
+    }
+
+
+def _existing_emails(emails):
+    existing = set()
+    emails = list(emails)
+    for start in range(0, len(emails), LOOKUP_CHUNK_SIZE):
+        existing.update(
+            User.objects.filter(email__in=emails[start:start + LOOKUP_CHUNK_SIZE]).values_list('email', flat=True)
+        )
+    return existing
+
+
+def _init_worker():
+    # Con el método "spawn" los procesos hijos arrancan sin Django configurado.
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Cifra ``passwords`` con el hasher por defecto. Con más de un worker se
+    reparte en un pool de procesos; ``None`` produce contraseñas inutilizables.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < 2:
+        return [make_password(p) for p in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+
+def import_users(rows, chunk_size=IMPORT_CHUNK_SIZE, workers=None):
+    """
+    Importa ``rows`` (diccionarios) y devuelve
+    ``{'total': n, 'created': n, 'errors': [{'row': i, 'email': ..., 'error': ...}]}``.
+    """
+    errors = []
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows):
+        try:
+            data = _clean(row)
+        except ValidationError as e:
+            errors.append({'row': index, 'email': row.get('email'), 'error': ' '.join(e.messages)})
+            continue
+        if data['email'] in seen:
+            errors.append({'row': index, 'email': data['email'], 'error': 'Correo repetido en el fichero'})
+            continue
+        seen.add(data['email'])
+        valid.append((index, data))
+
+    existing = _existing_emails(seen)
+    pending = []
+    for index, data in valid:
+        if data['email'] in existing:
+            errors.append({'row': index, 'email': data['email'], 'error': 'Email ya registrado'})
+        else:
+            pending.append((index, data))
+
+    hashes = hash_passwords([data['password'] for _, data in pending], workers)
+    created = 0
+    for start in range(0, len(pending), chunk_size):
+        chunk = list(zip(pending[start:start + chunk_size], hashes[start:start + chunk_size]))
+        created += _create_chunk(chunk, errors)
+
+    errors.sort(key=lambda e: e['row'])
+    return {'total': len(rows), 'created': created, 'errors': errors}
+
+
+def _create_chunk(chunk, errors):
+    try:
+        return _insert(chunk)
+    except IntegrityError:
+        # Alguien registró alguno de estos correos durante la importación:
+        # se descartan esas filas y se reintenta el bloque una vez.
+        taken = _existing_emails(data['email'] for (_, data), _ in chunk)
+        remaining = []
+        for (index, data), password in chunk:
+            if data['email'] in taken:
+                errors.append({'row': index, 'email': data['email'], 'error': 'Email ya registrado'})
+            else:
+                remaining.append(((index, data), password))
+        return _insert(remaining) if remaining else 0
+
+
+def _insert(chunk):
+    with transaction.atomic():
+        users = User.objects.bulk_create([
+            User(email=data['email'], username=data['username'], first_name=data['first_name'],
+                 last_name=data['last_name'], password=password)
+            for (_, data), password in chunk
+        ])
+        UserProfile.objects.bulk_create([
+            UserProfile(user=user, age=data['age'], country=data['country'], purpose=data['purpose'])
+            for user, ((_, data), _) in zip(users, chunk)
+        ])
+    return len(users)
@@ -0,0 +1,113 @@
+# users/jobs.py
+"""
+Importaciones de usuarios en segundo plano.
+
+La vista de importación solo guarda el fichero en ``IMPORT_ROOT`` y encola
+un ``ImportJob``; los workers de ``run_import_workers`` los reclaman (igual
+que las exportaciones de moodle_api/jobs.py) y ejecutan ``import_users``
+fuera del servidor web, con el pool de procesos para las contraseñas.
+
+Un trabajo que se repite tras un reinicio no duplica usuarios: los que ya
+se crearon aparecen como "Email ya registrado" en el informe.
+"""
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .importer import import_users, read_rows
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+def import_path(job):
+    return os.path.join(settings.IMPORT_ROOT, job.file_name)
+
+
+def create_import_job(upload, fmt, user=None):
+    """Guarda el fichero subido ``upload`` y encola su importación."""
+    job = ImportJob.objects.create(
+        format=fmt,
+        requested_by=user if user is not None and user.is_authenticated else None,
+    )
+    job.file_name = f'import_{job.pk}.{fmt}'
+    os.makedirs(settings.IMPORT_ROOT, exist_ok=True)
+    with open(import_path(job), 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    job.save(update_fields=['file_name', 'updated_at'])
+    return job
+
+
+def claim_job():
+    """
+    Reclama la importación pendiente más antigua, o una en curso cuyo worker
+    lleva ``IMPORT_JOB_STALE_SECONDS`` sin terminarla.
+    """
+    stale_before = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS)
+    claimable = ImportJob.objects.filter(
+        Q(status=ImportJob.PENDING) | Q(status=ImportJob.RUNNING, updated_at__lt=stale_before)
+    ).exclude(file_name='').order_by('created_at')
+    for job in claimable[:10]:
+        claimed = ImportJob.objects.filter(
+            pk=job.pk, status=job.status, updated_at=job.updated_at,
+        ).update(status=ImportJob.RUNNING, updated_at=timezone.now())
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job, workers=None):
+    path = import_path(job)
+    try:
+        with open(path, 'rb') as f:
+            try:
+                rows = read_rows(f, job.format)
+            except ValueError as e:
+                raise ValueError(f'Formato de entrada no válido: {e}') from e
+        report = import_users(rows, workers=workers)
+    except Exception as e:
+        logger.exception('Falló la importación %s', job.pk)
+        job.status = ImportJob.FAILED
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+    else:
+        job.status = ImportJob.DONE
+        job.total_rows = report['total']
+        job.created_users = report['created']
+        job.row_errors = report['errors']
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'total_rows', 'created_users', 'row_errors', 'finished_at',
+                                'updated_at'])
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def work(stop_event=None, poll_interval=1.0, once=False, workers=None):
+    """Bucle de un worker: reclama importaciones y las ejecuta hasta que se le pide parar."""
+    try:
+        while stop_event is None or not stop_event.is_set():
+            close_old_connections()
+            job = claim_job()
+            if job is not None:
+                logger.info('Importando trabajo %s', job.pk)
+                run_job(job, workers=workers)
+                continue
+            if once:
+                break
+            if stop_event is None:
+                time.sleep(poll_interval)
+            else:
+                stop_event.wait(poll_interval)
+    finally:
+        connections.close_all()
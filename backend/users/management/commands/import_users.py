@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importer import IMPORT_CHUNK_SIZE, format_from_name, import_users, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Importa usuarios en bloque desde un fichero CSV o JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Fichero CSV o JSONL con una fila por usuario')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Formato del fichero (por defecto se deduce de la extensión)')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                            help='Usuarios insertados por transacción')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Procesos para cifrar contraseñas (por defecto, uno por CPU)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or format_from_name(options['path'])
+        try:
+            with open(options['path'], 'rb') as f:
+                rows = read_rows(f, fmt)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'No se pudo leer el fichero: {e}')
+
+        report = import_users(rows, chunk_size=options['chunk_size'], workers=options['workers'])
+        for error in report['errors']:
+            # Número de fila del fichero (la cabecera del CSV es la fila 1).
+            line = error['row'] + (2 if fmt == 'csv' else 1)
+            self.stderr.write(f"Fila {line} ({error['email'] or 'sin correo'}): {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['created']} de {report['total']} usuarios creados, {len(report['errors'])} con errores"
+        ))
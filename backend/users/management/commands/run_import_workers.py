@@ -0,0 +1,26 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from users.jobs import work
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta las importaciones de usuarios encoladas desde la API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Segundos de espera cuando la cola está vacía')
+        parser.add_argument('--once', action='store_true',
+                            help='Procesar las importaciones pendientes y terminar')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Procesos para cifrar contraseñas (por defecto, uno por CPU)')
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        # Un solo bucle: cada importación ya reparte el cifrado en un pool de procesos.
+        try:
+            work(poll_interval=options['poll_interval'], once=options['once'], workers=options['workers'])
+        except KeyboardInterrupt:
+            # Una importación interrumpida se repite entera: no duplica usuarios.
+            pass
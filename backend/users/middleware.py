@@ -0,0 +1,42 @@
+# users/middleware.py
+from asgiref.sync import iscoroutinefunction
+from django.http import JsonResponse
+from django.utils.decorators import sync_and_async_middleware
+
+from .tokens import InvalidToken, read_token, user_from_claims
+
+PREFIX = 'Bearer '
+
+
+def _authenticate(request):
+    """
+    Si la petición trae ``Authorization: Bearer <token>`` sustituye el usuario
+    de la sesión por el del token. Devuelve una respuesta 401 si el token no
+    es válido y ``None`` en otro caso.
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not header.startswith(PREFIX):
+        return None
+    try:
+        user = user_from_claims(read_token(header[len(PREFIX):].strip()))
+    except InvalidToken as e:
+        return JsonResponse({'error': str(e)}, status=401)
+
+    async def auser():
+        return user
+
+    request.user = user
+    request.auser = auser
+    return None
+
+
+@sync_and_async_middleware
+def TokenAuthenticationMiddleware(get_response):
+    """Autenticación por token firmado: no lee la sesión ni el usuario de la base de datos."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return _authenticate(request) or await get_response(request)
+    else:
+        def middleware(request):
+            return _authenticate(request) or get_response(request)
+    return middleware
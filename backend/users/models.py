@@ -18,4 +18,33 @@ class UserProfile(models.Model):
     purpose = models.TextField()
 
     def __str__(self):
-        return self.user.email
\ No newline at end of file
+        return self.user.email
+
+
+class ImportJob(models.Model):
+    """Importación de usuarios en segundo plano (ver users/jobs.py)."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pendiente'),
+        (RUNNING, 'En curso'),
+        (DONE, 'Terminada'),
+        (FAILED, 'Fallida'),
+    ]
+
+    requested_by = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    format = models.CharField(max_length=10)
+    # Fichero subido en IMPORT_ROOT; se borra al terminar.
+    file_name = models.CharField(max_length=255, blank=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    created_users = models.PositiveIntegerField(default=0)
+    # Filas rechazadas: [{'row': i, 'email': ..., 'error': ...}].
+    row_errors = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
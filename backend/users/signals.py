@@ -0,0 +1,36 @@
+# users/signals.py
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .tokens import revoke_tokens
+
+# Permisos que viajan dentro del token (ver tokens.issue_token).
+TOKEN_PRIVILEGE_FIELDS = ('is_staff', 'is_superuser')
+
+
+@receiver(user_logged_out)
+def revoke_on_logout(sender, user, **kwargs):
+    if user is not None and user.pk is not None:
+        revoke_tokens(user.pk)
+
+
+@receiver(pre_save, sender=get_user_model())
+def detect_privilege_change(sender, instance, update_fields=None, **kwargs):
+    """Marca el usuario si el guardado cambia alguno de los permisos que lleva el token."""
+    instance._token_privileges_changed = False
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(TOKEN_PRIVILEGE_FIELDS):
+        return
+    stored = sender.objects.filter(pk=instance.pk).values_list(*TOKEN_PRIVILEGE_FIELDS).first()
+    current = tuple(getattr(instance, field) for field in TOKEN_PRIVILEGE_FIELDS)
+    instance._token_privileges_changed = stored is not None and stored != current
+
+
+@receiver(post_save, sender=get_user_model())
+def revoke_on_deactivation(sender, instance, created, **kwargs):
+    # Los tokens ya emitidos conservarían is_staff/is_superuser antiguos hasta caducar.
+    if not created and (not instance.is_active or getattr(instance, '_token_privileges_changed', False)):
+        revoke_tokens(instance.pk)
@@ -1,3 +1,204 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from . import tokens
+from .checks import check_shared_cache
+from .importer import hash_passwords, import_users
+from .jobs import work
+from .models import CustomUser, UserProfile
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(username='existe', email='existe@example.com', password=None)
+
+    def test_import_reports_row_errors_and_creates_the_rest(self):
+        rows = [
+            {'email': 'ana@example.com', 'password': 'secreta', 'name': 'Ana María López', 'age': '31',
+             'country': 'Cuba', 'purpose': 'Trabajo'},
+            {'email': 'existe@example.com', 'password': 'x'},
+            {'email': 'no-es-un-correo'},
+            {'email': 'ana@example.com'},
+            {'email': 'luis@example.com', 'age': 'muchos'},
+            {'email': 'eva@example.com'},
+        ]
+        # Usuarios existentes, savepoint, usuarios, perfiles y liberación.
+        with self.assertNumQueries(5):
+            report = import_users(rows, workers=1)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([(e['row'], e['error']) for e in report['errors']], [
+            (1, 'Email ya registrado'),
+            (2, 'Correo no válido'),
+            (3, 'Correo repetido en el fichero'),
+            (4, 'La edad debe ser un número'),
+        ])
+
+        ana = CustomUser.objects.get(email='ana@example.com')
+        self.assertEqual((ana.first_name, ana.last_name, ana.username), ('Ana', 'María López', 'ana'))
+        self.assertTrue(ana.check_password('secreta'))
+        self.assertEqual(ana.profile.age, 31)
+        self.assertFalse(CustomUser.objects.get(email='eva@example.com').has_usable_password())
+
+    def test_non_string_json_fields_are_row_errors(self):
+        rows = [
+            {'email': 123},
+            {'email': 'nulo@example.com', 'name': None, 'country': None},
+            {'email': 'lista@example.com', 'name': ['Ana']},
+            {'email': 'clave@example.com', 'password': 1234},
+        ]
+        report = import_users(rows, workers=1)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([(e['row'], e['error']) for e in report['errors']], [
+            (0, 'El campo email debe ser texto'),
+            (2, 'El campo name debe ser texto'),
+            (3, 'El campo password debe ser texto'),
+        ])
+        self.assertEqual(UserProfile.objects.get(user__email='nulo@example.com').country, '')
+
+    def test_passwords_are_hashed_in_a_process_pool(self):
+        hashes = hash_passwords(['uno', 'dos', 'tres', None], workers=2)
+        self.assertTrue(check_password('dos', hashes[1]))
+        self.assertFalse(check_password('', hashes[3]))
+
+    def test_command_reads_jsonl(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8') as f:
+            f.write(json.dumps({'email': 'jl1@example.com', 'country': 'Chile'}) + '\n\n')
+            f.write(json.dumps({'email': 'existe@example.com'}) + '\n')
+            f.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('import_users', f.name, workers=1, stdout=out, stderr=err)
+        self.assertIn('1 de 2 usuarios creados', out.getvalue())
+        self.assertIn('Fila 2 (existe@example.com): Email ya registrado', err.getvalue())
+        self.assertEqual(UserProfile.objects.get(user__email='jl1@example.com').country, 'Chile')
+
+    def test_admin_endpoint_queues_the_import(self):
+        staff = CustomUser.objects.create_user(username='admin', email='admin@example.com', password=None,
+                                               is_staff=True)
+        self.client.force_login(staff)
+        upload = SimpleUploadedFile('alta.csv', b'email,name,password\ncsv1@example.com,Pepe,clave\n')
+        with tempfile.TemporaryDirectory() as root, override_settings(IMPORT_ROOT=root):
+            response = self.client.post('/api/users/import/', {'file': upload})
+            self.assertEqual((response.status_code, response.json()['status']), (202, 'pending'))
+            self.assertFalse(CustomUser.objects.filter(email='csv1@example.com').exists())
+
+            work(once=True, workers=1)
+            status = self.client.get(response.json()['url']).json()
+            self.assertEqual(os.listdir(root), [])
+        self.assertEqual((status['status'], status['total'], status['created'], status['errors']), ('done', 1, 1, []))
+        self.assertTrue(CustomUser.objects.get(email='csv1@example.com').check_password('clave'))
+
+    def test_admin_endpoint_rejects_bad_uploads(self):
+        staff = CustomUser.objects.create_user(username='admin', email='admin@example.com', password=None,
+                                               is_staff=True)
+        self.client.force_login(staff)
+        with tempfile.TemporaryDirectory() as root, override_settings(IMPORT_ROOT=root):
+            upload = SimpleUploadedFile('alta.xlsx', b'email\n')
+            response = self.client.post('/api/users/import/', {'file': upload, 'format': 'xlsx'})
+            self.assertEqual(response.status_code, 400)
+            with override_settings(IMPORT_MAX_UPLOAD_BYTES=3):
+                upload = SimpleUploadedFile('alta.csv', b'email\n')
+                self.assertEqual(self.client.post('/api/users/import/', {'file': upload}).status_code, 413)
+
+            upload = SimpleUploadedFile('alta.jsonl', b'{roto\n')
+            url = self.client.post('/api/users/import/', {'file': upload}).json()['url']
+            with self.assertLogs('users.jobs', 'ERROR'):
+                work(once=True, workers=1)
+        status = self.client.get(url).json()
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('Formato de entrada no válido', status['error'])
+
+    def test_admin_endpoint_requires_staff(self):
+        upload = SimpleUploadedFile('alta.csv', b'email\nx@example.com\n')
+        self.assertEqual(self.client.post('/api/users/import/', {'file': upload}).status_code, 403)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class TokenAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='token', email='token@example.com', password='clave', first_name='Ana')
+
+    def login(self):
+        response = self.client.post('/api/login/', {'email': 'token@example.com', 'password': 'clave'},
+                                    content_type='application/json')
+        # Sin la cookie de sesión: solo se autentica con el token.
+        self.client.cookies.clear()
+        return response.json()['token']
+
+    def test_bearer_token_authenticates_without_session_or_user_queries(self):
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {self.login()}'}
+        # Solo la consulta de la propia vista.
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/my-courses/', **auth)
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_and_revoked_tokens_are_rejected(self):
+        token = self.login()
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        self.assertEqual(self.client.get('/api/my-courses/', HTTP_AUTHORIZATION=f'Bearer {token}x').status_code, 401)
+        self.client.post('/api/logout/', **auth)
+        response = self.client.get('/api/my-courses/', **auth)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error'], 'Token revocado')
+
+    def test_revocation_outlives_its_first_timeout_and_allows_new_logins(self):
+        old = self.login()
+        self.client.post('/api/logout/', HTTP_AUTHORIZATION=f'Bearer {old}')
+        # Una segunda revocación renueva la marca en vez de conservar la caducidad de la primera.
+        with mock.patch('users.tokens.cache.set') as cache_set:
+            tokens.revoke_tokens(self.user.pk)
+        self.assertEqual(cache_set.call_args.args[2], settings.API_TOKEN_MAX_AGE)
+        new = self.login()
+        self.assertEqual(self.client.get('/api/my-courses/', HTTP_AUTHORIZATION=f'Bearer {old}').status_code, 401)
+        self.assertEqual(self.client.get('/api/my-courses/', HTTP_AUTHORIZATION=f'Bearer {new}').status_code, 200)
+
+    def test_losing_staff_rights_revokes_tokens(self):
+        self.user.is_staff = True
+        self.user.save()
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {self.login()}'}
+        self.assertEqual(self.client.get('/api/profiles/', **auth).status_code, 200)
+        # Guardar sin tocar los permisos (p. ej. last_login) no revoca nada.
+        self.user.first_name = 'Ana María'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profiles/', **auth).status_code, 200)
+
+        self.user.is_staff = False
+        self.user.save(update_fields=['is_staff'])
+        response = self.client.get('/api/profiles/', **auth)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error'], 'Token revocado')
+
+    def test_deploy_check_warns_about_process_local_cache(self):
+        self.assertEqual([w.id for w in check_shared_cache(None)], ['users.W001'])
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_tokens_expire(self):
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {self.login()}'}
+        with override_settings(API_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.client.get('/api/my-courses/', **auth).status_code, 401)
+
+    def test_refresh_checks_the_account_is_still_active(self):
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {self.login()}'}
+        refreshed = self.client.post('/api/token/refresh/', **auth)
+        self.assertEqual(refreshed.status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        new_auth = {'HTTP_AUTHORIZATION': f"Bearer {refreshed.json()['token']}"}
+        self.assertEqual(self.client.post('/api/token/refresh/', **new_auth).status_code, 401)
+        self.assertEqual(self.client.get('/api/my-courses/', **new_auth).status_code, 401)
@@ -0,0 +1,90 @@
+# users/tokens.py
+"""
+Tokens de acceso firmados y de vida corta para la API.
+
+El token lleva dentro los datos del usuario que necesitan las vistas (id,
+correo, nombre y permisos), firmados con ``SECRET_KEY``: validarlo no
+requiere leer ni la sesión ni el usuario de la base de datos.
+
+Para revocarlos se guarda en la caché el momento en que el usuario cerró
+sesión o se desactivó su cuenta; los tokens firmados antes de ese momento
+dejan de aceptarse. La marca dura ``API_TOKEN_MAX_AGE`` segundos, lo mismo
+que el token más antiguo que podría seguir vivo, y cada revocación la
+renueva.
+
+La revocación solo es efectiva en todos los workers si ``CACHES`` es
+compartida (Redis, Memcached, base de datos). Con ``LocMemCache`` cada
+proceso tiene su propia caché y un token revocado sigue valiendo hasta
+``API_TOKEN_MAX_AGE`` segundos en los demás; lo mismo ocurre si la caché se
+pierde. ``manage.py check --deploy`` avisa de ello. Como se comparan
+momentos de distintos procesos, los servidores deben tener el reloj
+sincronizado.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+
+User = get_user_model()
+
+SALT = 'users.api-token'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _revoked_key(user_id):
+    return f'auth:tokens_revoked_at:{user_id}'
+
+
+def revoked_at(user_id):
+    """Momento (``time.time()``) de la última revocación vigente, o ``None``."""
+    return cache.get(_revoked_key(user_id))
+
+
+def revoke_tokens(user_id):
+    """Invalida todos los tokens emitidos hasta ahora para ``user_id``."""
+    # Pasado API_TOKEN_MAX_AGE ya han caducado todos los tokens anteriores.
+    cache.set(_revoked_key(user_id), time.time(), settings.API_TOKEN_MAX_AGE)
+
+
+def issue_token(user):
+    return signing.dumps({
+        'uid': user.pk,
+        'iat': time.time(),
+        'email': user.email,
+        'fn': user.first_name,
+        'ln': user.last_name,
+        'staff': user.is_staff,
+        'su': user.is_superuser,
+    }, salt=SALT, compress=True)
+
+
+def read_token(token):
+    """Devuelve los datos del token o lanza ``InvalidToken``."""
+    try:
+        claims = signing.loads(token, salt=SALT, max_age=settings.API_TOKEN_MAX_AGE)
+    except signing.BadSignature as e:
+        raise InvalidToken('Token inválido o caducado') from e
+    revoked = revoked_at(claims['uid'])
+    if revoked is not None and claims.get('iat', 0) <= revoked:
+        raise InvalidToken('Token revocado')
+    return claims
+
+
+def user_from_claims(claims):
+    """
+    Construye el usuario a partir del token sin consultar la base de datos.
+    Sirve para filtrar y comprobar permisos, pero no debe guardarse: los
+    campos que no van en el token están vacíos.
+    """
+    user = User(
+        id=claims['uid'], email=claims['email'], first_name=claims['fn'], last_name=claims['ln'],
+        is_staff=claims['staff'], is_superuser=claims['su'], is_active=True,
+    )
+    user._state.adding = False
+    user._state.db = 'default'
+    return user
@@ -1,8 +1,11 @@
 from django.urls import path
-from users.views import RegisterView, LoginView,LogoutView
+from users.views import RegisterView, LoginView,LogoutView, ImportUsersView, ImportJobStatusView, TokenRefreshView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('users/import/', ImportUsersView.as_view(), name='import_users'),
+    path('users/import/<int:job_id>/', ImportJobStatusView.as_view(), name='import_job_status'),
 ]
\ No newline at end of file
@@ -2,11 +2,16 @@
 from django.contrib.auth import authenticate,logout
 from django.contrib.auth import login as django_login
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.http import JsonResponse
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .models import UserProfile
+from django.urls import reverse
+from .importer import IMPORT_FORMATS, format_from_name
+from .jobs import create_import_job
+from .models import ImportJob, UserProfile
+from .tokens import InvalidToken, issue_token, read_token
 import json
 
 User = get_user_model()
@@ -62,6 +67,10 @@ class LoginView(View):
 
             return JsonResponse({
                 'message': 'Login exitoso',
+                # Token para la API (cabecera "Authorization: Bearer ..."):
+                # autentica sin leer la sesión ni el usuario de la base de datos.
+                'token': issue_token(user),
+                'token_expires_in': settings.API_TOKEN_MAX_AGE,
                 'user': {
                     'id': user.id,
                     'name': user.get_full_name(),
@@ -76,4 +85,74 @@ class LoginView(View):
 class LogoutView(View):
     def post(self, request):
         logout(request)
-        return JsonResponse({'message': 'Sesión cerrada correctamente'}, status=200)
\ No newline at end of file
+        return JsonResponse({'message': 'Sesión cerrada correctamente'}, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class TokenRefreshView(View):
+    """
+    Cambia un token válido por otro nuevo. Aquí sí se consulta la base de
+    datos, así que una cuenta desactivada no puede renovar su token.
+    """
+
+    def post(self, request):
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if not header.startswith('Bearer '):
+            return JsonResponse({'error': 'Falta el token'}, status=401)
+        try:
+            claims = read_token(header[len('Bearer '):].strip())
+        except InvalidToken as e:
+            return JsonResponse({'error': str(e)}, status=401)
+        user = User.objects.filter(pk=claims['uid'], is_active=True).first()
+        if user is None:
+            return JsonResponse({'error': 'Usuario no disponible'}, status=401)
+        return JsonResponse({'token': issue_token(user), 'token_expires_in': settings.API_TOKEN_MAX_AGE})
+
+
+def import_job_payload(job):
+    payload = {
+        'id': job.pk,
+        'status': job.status,
+        'url': reverse('import_job_status', args=[job.pk]),
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == ImportJob.DONE:
+        payload.update(total=job.total_rows, created=job.created_users, errors=job.row_errors)
+    if job.status == ImportJob.FAILED:
+        payload['error'] = job.error
+    return payload
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ImportUsersView(View):
+    """
+    Importación masiva de usuarios: fichero CSV o JSONL en el campo ``file``.
+    Se encola y la ejecuta ``run_import_workers``; responde 202 con la URL de
+    estado, que incluye el informe al terminar.
+    """
+
+    def post(self, request):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede importar usuarios'}, status=403)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'error': 'Falta el fichero'}, status=400)
+        if upload.size > settings.IMPORT_MAX_UPLOAD_BYTES:
+            return JsonResponse({'error': f'El fichero supera el máximo de {settings.IMPORT_MAX_UPLOAD_BYTES} bytes'},
+                                status=413)
+        fmt = request.POST.get('format') or format_from_name(upload.name)
+        if fmt not in IMPORT_FORMATS:
+            return JsonResponse({'error': f'Formato no soportado: {fmt}'}, status=400)
+        job = create_import_job(upload, fmt, request.user)
+        return JsonResponse(import_job_payload(job), status=202)
+
+
+class ImportJobStatusView(View):
+    def get(self, request, job_id):
+        if not request.user.is_authenticated or not request.user.is_staff:
+            return JsonResponse({'error': 'Solo el personal autorizado puede importar usuarios'}, status=403)
+        job = ImportJob.objects.filter(pk=job_id).first()
+        if job is None:
+            return JsonResponse({'error': 'Importación no encontrada'}, status=404)
+        return JsonResponse(import_job_payload(job))